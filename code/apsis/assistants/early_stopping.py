@@ -0,0 +1,205 @@
+__author__ = 'Frederik Diehl'
+
+from abc import ABCMeta, abstractmethod
+import numpy as np
+from apsis.utilities.logging_utils import get_logger
+
+
+class EarlyStoppingRule(object):
+    """
+    An early stopping rule decides whether a running evaluation should stop.
+
+    It does so by comparing the intermediate results (the learning curve) of
+    a candidate currently being evaluated with the curves and results of the
+    already finished candidates of the same experiment.
+
+    Attributes
+    ----------
+    params : dict
+        The dictionary of parameters defining the behaviour of the rule.
+        Every rule supports at least
+        "min_finished" : int, optional
+            The minimum number of finished, non-failed candidates required
+            before any candidate is stopped. Default is 3.
+        "min_reports" : int, optional
+            The minimum number of intermediate results a candidate must have
+            reported before it can be stopped. Default is 3.
+    _logger : logger
+        The logger instance for this class.
+    """
+    __metaclass__ = ABCMeta
+
+    params = None
+    _logger = None
+
+    def __init__(self, params=None):
+        """
+        Initializes the early stopping rule.
+
+        Parameters
+        ----------
+        params : dict or None, optional
+            The dictionary of parameters defining the behaviour of the rule.
+        """
+        self._logger = get_logger(self)
+        if params is None:
+            params = {}
+        self.params = params
+        self._logger.debug("Initialized early stopping rule with params %s",
+                           params)
+
+    def should_stop(self, candidate, experiment):
+        """
+        Decides whether the evaluation of candidate should be stopped.
+
+        Parameters
+        ----------
+        candidate : Candidate
+            The candidate currently being evaluated. Its intermediate_results
+            are used as its learning curve.
+        experiment : Experiment
+            The experiment containing the finished candidates to compare with.
+
+        Returns
+        -------
+        stop : bool
+            True iff the worker evaluating candidate should stop.
+        """
+        curve = candidate.intermediate_results
+        if len(curve) < self.params.get("min_reports", 3):
+            self._logger.debug("Too few intermediate results (%s) to stop.",
+                               len(curve))
+            return False
+        finished = [c for c in experiment.candidates_finished
+                    if not c.failed and c.result is not None]
+        if len(finished) < self.params.get("min_finished", 3):
+            self._logger.debug("Too few finished candidates (%s) to stop.",
+                               len(finished))
+            return False
+        stop = self._should_stop(curve, finished, experiment)
+        self._logger.debug("Stopping decision for %s is %s", candidate, stop)
+        return stop
+
+    @abstractmethod
+    def _should_stop(self, curve, finished, experiment):
+        """
+        Implements the actual stopping decision.
+
+        Parameters
+        ----------
+        curve : list of [step, result] lists
+            The intermediate results of the running candidate. Contains at
+            least min_reports entries.
+        finished : list of Candidates
+            The finished, non-failed candidates. Contains at least
+            min_finished entries.
+        experiment : Experiment
+            The experiment, used for the optimization direction.
+
+        Returns
+        -------
+        stop : bool
+            True iff the worker should stop.
+        """
+        pass
+
+    def _is_worse(self, value, reference, experiment):
+        """
+        Returns whether value is strictly worse than reference.
+        """
+        if experiment.minimization_problem:
+            return value > reference
+        return value < reference
+
+
+class MedianStoppingRule(EarlyStoppingRule):
+    """
+    Implements the median stopping rule.
+
+    A candidate is stopped at step s iff its best intermediate result so far
+    is worse than the median of the running averages of all finished
+    candidates' curves up to step s. See "Google Vizier: A Service for
+    Black-Box Optimization", Golovin et al., 2017.
+
+    Finished candidates without intermediate results are ignored. Besides the
+    common parameters, it supports
+    "grace_period" : float, optional
+        The smallest step at which a candidate may be stopped. Default is 0.
+    """
+
+    def _should_stop(self, curve, finished, experiment):
+        step = curve[-1][0]
+        if step < self.params.get("grace_period", 0):
+            return False
+        running_averages = []
+        for c in finished:
+            values = [v for s, v in c.intermediate_results
+                      if s <= step and v is not None]
+            if values:
+                running_averages.append(np.mean(values))
+        if len(running_averages) < self.params.get("min_finished", 3):
+            return False
+        values = [v for s, v in curve if v is not None]
+        if not values:
+            return False
+        if experiment.minimization_problem:
+            best_so_far = min(values)
+        else:
+            best_so_far = max(values)
+        median = np.median(running_averages)
+        self._logger.debug("Best so far %s, median of running averages %s",
+                           best_so_far, median)
+        return self._is_worse(best_so_far, median, experiment)
+
+
+class CurveExtrapolationRule(EarlyStoppingRule):
+    """
+    Stops candidates whose extrapolated final result will not be competitive.
+
+    The curve is extrapolated by fitting result = a + b * log(1 + step) to the
+    intermediate results, then evaluated at the median final step of the
+    finished candidates' curves (or at "final_step", if given). A candidate is
+    stopped iff this prediction is worse than the best finished result.
+
+    Besides the common parameters, it supports
+    "final_step" : float, optional
+        The step at which the final result is achieved. By default, this is
+        estimated from the finished candidates.
+    "margin" : float, optional
+        A relative tolerance. The prediction has to be worse than the best
+        result by more than margin * abs(best result). Default is 0.
+    """
+
+    def _should_stop(self, curve, finished, experiment):
+        points = [(s, v) for s, v in curve if v is not None]
+        if len(points) < 2:
+            return False
+        final_step = self.params.get("final_step", None)
+        if final_step is None:
+            final_steps = [c.intermediate_results[-1][0] for c in finished
+                           if c.intermediate_results]
+            if not final_steps:
+                return False
+            final_step = np.median(final_steps)
+        if final_step <= points[-1][0]:
+            return False
+        steps = np.log1p(np.array([p[0] for p in points], dtype=float))
+        values = np.array([p[1] for p in points], dtype=float)
+        if np.ptp(steps) == 0:
+            return False
+        slope, intercept = np.polyfit(steps, values, 1)
+        prediction = intercept + slope * np.log1p(final_step)
+
+        best_result = None
+        for c in finished:
+            if best_result is None or \
+                    self._is_worse(best_result, c.result, experiment):
+                best_result = c.result
+        margin = self.params.get("margin", 0) * abs(best_result)
+        if experiment.minimization_problem:
+            threshold = best_result + margin
+        else:
+            threshold = best_result - margin
+        self._logger.debug("Predicted %s at step %s; threshold is %s",
+                           prediction, final_step, threshold)
+        return self._is_worse(prediction, threshold, experiment)
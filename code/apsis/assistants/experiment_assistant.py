@@ -1,13 +1,18 @@
 __author__ = 'Frederik Diehl'
 
 from apsis.models.experiment import Experiment
+import apsis.models.experiment as experiment_module
 from apsis.models.candidate import Candidate
 from apsis.utilities.optimizer_utils import check_optimizer
 from apsis.utilities.file_utils import ensure_directory_exists
+from apsis.utilities.early_stopping_utils import check_early_stopping
 import numpy as np
 import datetime
+import uuid
 import os
 import time
+import threading
+from functools import wraps
 from apsis.utilities.logging_utils import get_logger
 from apsis.utilities.plot_utils import plot_lists, write_plot_to_file
 import matplotlib.pyplot as plt
@@ -15,6 +20,22 @@ import json
 
 AVAILABLE_STATUS = ["finished", "pausing", "working"]
 
+# The optimizer_arguments used by the experiment assistant itself, which are
+# not passed on to the optimizer.
+ASSISTANT_ARGUMENTS = ["early_stopping", "early_stopping_params",
+                       "lease_duration", "max_lease_expiries"]
+
+
+def _synchronized(method):
+    """
+    Decorates a method of ExperimentAssistant to hold the assistant's _lock.
+    """
+    @wraps(method)
+    def locked_method(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return locked_method
+
 
 class ExperimentAssistant(object):
     """
@@ -25,6 +46,20 @@ class ExperimentAssistant(object):
     minimized) and an optimizer for optimizing the experiment.
     It also contains functions for writing out results and for plotting.
 
+    Optionally, candidates are handed out with leases. A lease is renewed by
+    every "working" update of its candidate, so workers send them as
+    heartbeats. A candidate whose lease expired, for example because its
+    worker crashed, is moved back to pending by reap_expired_leases, or
+    marked as failed after max_lease_expiries expiries. Every lease has a
+    token (see Candidate.lease_token). An update carrying a token is ignored
+    if the candidate has since been leased with another token or has
+    finished. A worker whose lease was reaped can still report its result
+    while the candidate is pending.
+
+    All public methods are safe to call from several threads. They are
+    serialized by a per-experiment lock, so that different experiments can
+    be served concurrently.
+
     Parameters
     ----------
     _optimizer : Optimizer
@@ -36,6 +71,33 @@ class ExperimentAssistant(object):
         The experiment storing the evaluated points and parameter definition.
     _write_dir : basestring
         Directory containing the checkpoints.
+    _early_stopping : EarlyStoppingRule or None
+        The rule deciding whether workers reporting intermediate results
+        should stop. None if no early stopping is used.
+    _lease_duration : float or None
+        The number of seconds a lease lasts without a "working" update. None
+        if candidates are handed out without leases.
+    _max_lease_expiries : int
+        The number of expiries after which a candidate is marked as failed.
+    _leases : dict
+        Maps the cand_id of each leased working candidate to the time its
+        lease expires.
+    _lease_expiries : dict
+        Maps cand_ids to the number of times their leases expired.
+    _source_experiments : list of Experiments or None
+        The experiments the optimizer is warm started from, or None.
+    _optimizer_pool : OptimizerPool or None
+        The pool the optimizer's backend runs on, or None.
+    _state_writer : StateWriter or None
+        The writer the state is written by in the background, or None to
+        write it synchronously.
+    _delta_seq : int
+        The sequence number of the last recorded delta.
+    _unsent_deltas : list of tuples
+        The (seq, status, candidate) deltas not yet sent to the optimizer.
+        At most one delta per candidate is kept.
+    _lock : threading.RLock
+        Guards the experiment, the optimizer and the deltas.
     _logger : logger
         The logger instance for this class.
     """
@@ -46,11 +108,30 @@ class ExperimentAssistant(object):
 
     _write_dir = None
 
+    _early_stopping = None
+
+    _lease_duration = None
+    _max_lease_expiries = None
+    _leases = None
+    _lease_expiries = None
+
+    _source_experiments = None
+
+    _optimizer_pool = None
+
+    _state_writer = None
+
+    _delta_seq = 0
+    _unsent_deltas = None
+
+    _lock = None
+
     _logger = None
 
     def __init__(self, optimizer_class, experiment,
                  optimizer_arguments=None,
-                 write_dir=None):
+                 write_dir=None, source_experiments=None,
+                 optimizer_pool=None, state_writer=None):
         """
         Initializes this experiment assistant.
 
@@ -70,35 +151,155 @@ class ExperimentAssistant(object):
         optimizer_arguments : dict, optional
             The dictionary of optimizer arguments. If None, default values will
             be used.
+            Additionally to the optimizer's own arguments, the experiment
+            assistant supports
+            "early_stopping" : string or EarlyStoppingRule, optional
+                The early stopping rule (see
+                early_stopping_utils.AVAILABLE_STOPPING_RULES) used to decide
+                whether workers reporting intermediate results should stop.
+                Default is None, which never stops workers.
+            "early_stopping_params" : dict, optional
+                The parameters of the early stopping rule.
+            "lease_duration" : float, optional
+                The number of seconds a handed out candidate stays leased to
+                its worker without a "working" update. Default is None, which
+                never expires leases.
+            "max_lease_expiries" : int, optional
+                The number of lease expiries after which a candidate is
+                marked as failed instead of moved back to pending. Default
+                is 3.
+        source_experiments : list of Experiments, optional
+            Related experiments used to warm start the optimizer. They are
+            passed to the optimizer as "warm_start_experiments" and stored
+            once in write_dir/warm_start.json. If None (default), they are
+            reloaded from there if available.
+        optimizer_pool : OptimizerPool, optional
+            A pool shared with other experiment assistants. If given, the
+            optimizer runs on it (as multiprocessing "pool") unless
+            optimizer_arguments set multiprocessing. Default is None.
+        state_writer : StateWriter, optional
+            A writer shared with other experiment assistants. If given, the
+            state is only marked as dirty and written by it. Default is None,
+            which writes the state synchronously.
         """
         self._logger = get_logger(self, extra_info="exp_id: " +
                                                    str(experiment.exp_id))
         self._logger.info("Initializing experiment assistant.")
+        self._lock = threading.RLock()
         self._optimizer = optimizer_class
         self._optimizer_arguments = optimizer_arguments
         self._write_dir = write_dir
         self._experiment = experiment
+        self._optimizer_pool = optimizer_pool
+        self._state_writer = state_writer
+        if optimizer_arguments is None:
+            optimizer_arguments = {}
+        self._early_stopping = check_early_stopping(
+            optimizer_arguments.get("early_stopping", None),
+            optimizer_arguments.get("early_stopping_params", None))
+        self._init_leases(optimizer_arguments.get("lease_duration", None),
+                          optimizer_arguments.get("max_lease_expiries", 3))
+        self._init_source_experiments(source_experiments)
         self._init_optimizer()
         self._write_state_to_file()
         self._logger.info("Experiment assistant successfully initialized.")
 
+    def _init_leases(self, lease_duration, max_lease_expiries):
+        """
+        Initializes the leases. Candidates already working, for example
+        after reloading, are leased anew.
+
+        Raises
+        ------
+        ValueError
+            Iff lease_duration is not positive or max_lease_expiries is
+            smaller than 1.
+        """
+        if lease_duration is not None and not lease_duration > 0:
+            raise ValueError("lease_duration must be positive, but is %s."
+                             %lease_duration)
+        if max_lease_expiries < 1:
+            raise ValueError("max_lease_expiries must be at least 1, but is "
+                             "%s." %max_lease_expiries)
+        self._lease_duration = lease_duration
+        self._max_lease_expiries = max_lease_expiries
+        self._leases = {}
+        self._lease_expiries = {}
+        for c in self._experiment.candidates_working:
+            self._renew_lease(c)
+
     def _init_optimizer(self):
         """
         Initializes the optimizer if it does not exist.
         """
         self._logger.debug("Initializing optimizer. Current state is %s"
                            %self._optimizer)
+        # Runtime-only arguments are added to a copy, so that they are not
+        # written to exp_assistant.json.
+        optimizer_arguments = dict(self._optimizer_arguments or {})
+        for key in ASSISTANT_ARGUMENTS:
+            optimizer_arguments.pop(key, None)
+        if self._source_experiments:
+            optimizer_arguments["warm_start_experiments"] = \
+                self._source_experiments
+        if self._write_dir is not None:
+            optimizer_arguments["checkpoint_dir"] = self._write_dir
+        if self._optimizer_pool is not None:
+            optimizer_arguments.setdefault("multiprocessing", "pool")
+            optimizer_arguments["optimizer_pool"] = self._optimizer_pool
         self._optimizer= check_optimizer(self._optimizer, self._experiment,
-            optimizer_arguments=self._optimizer_arguments)
+            optimizer_arguments=optimizer_arguments)
         self._logger.debug("Initialized optimizer. State afterwards is %s"
                            %self._optimizer)
 
-    def get_next_candidate(self):
+    def _init_source_experiments(self, source_experiments):
+        """
+        Sets the source experiments for warm starting.
+
+        If source_experiments is given, they are written to
+        write_dir/warm_start.json. Otherwise, they are reloaded from there if
+        the file exists.
+
+        Parameters
+        ----------
+        source_experiments : list of Experiments or None
+            The experiments to warm start from.
+        """
+        warm_start_file = None
+        if self._write_dir is not None:
+            warm_start_file = os.path.join(self._write_dir, "warm_start.json")
+        if source_experiments is None:
+            if warm_start_file is not None and os.path.isfile(warm_start_file):
+                with open(warm_start_file, "r") as infile:
+                    warm_start_json = json.load(infile)
+                source_experiments = [experiment_module.from_dict(d) for d in
+                                      warm_start_json["source_experiments"]]
+                self._logger.debug("Reloaded %s source experiments.",
+                                   len(source_experiments))
+        elif warm_start_file is not None:
+            state = {"source_experiments": [e.to_dict() for e in
+                                            source_experiments]}
+            with open(warm_start_file, "w") as outfile:
+                json.dump(state, outfile)
+            self._logger.debug("Wrote %s source experiments to %s",
+                               len(source_experiments), warm_start_file)
+        self._source_experiments = source_experiments
+
+    def get_next_candidate(self, timeout=None):
         """
         Returns the Candidate next to evaluate.
 
         Internally, it first tries to return the most recent pending candidate
         of this experiment. If there is none, it generates one from optimizer.
+        If the optimizer handles pausing itself, pending candidates are only
+        resumed when the optimizer returns them.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            The maximum number of seconds to wait for the optimizer to
+            produce a candidate if none is ready. If None (the default),
+            returns None immediately in that case.
 
         Returns
         -------
@@ -106,28 +307,99 @@ class ExperimentAssistant(object):
             The Candidate object that should be evaluated next. May be None,
             which is equivalent to no candidate generated.
         """
+        candidates = self.get_next_candidates(num_candidates=1,
+                                              timeout=timeout)
+        if not candidates:
+            return None
+        return candidates[0]
 
-        self._logger.debug("Returning next candidate.")
-        to_return = None
-        if not self._experiment.candidates_pending:
-            self._logger.debug("No candidate pending; requesting one from "
-                               "optimizer.")
-            candidates = self._optimizer.get_next_candidates(num_candidates=1)
-            self._logger.debug("Got %s", [str(c) for c in candidates])
-            if candidates is None:
-                to_return = None
-            elif len(candidates) > 0:
-                self._experiment.add_working(candidates[0])
-                to_return = candidates[0]
-        else:
-            self._logger.debug("Had at least one pending.")
-            cand = self._experiment.candidates_pending.pop()
-            self._experiment.add_working(cand)
-            to_return = cand
-        self._logger.debug("Returning candidate %s" %str(to_return))
+    def get_next_candidates(self, num_candidates=1, timeout=None):
+        """
+        Returns up to num_candidates Candidates to evaluate next.
+
+        This works like get_next_candidate, but hands out several candidates
+        at once: First the most recent pending candidates (unless the
+        optimizer handles pausing), then candidates generated by the
+        optimizer in a single request. All of them are marked as working,
+        and the state is written only once.
+
+        If nothing is ready and timeout is given, the optimizer is waited for
+        without holding the lock, so that updates to this experiment are not
+        blocked meanwhile.
+
+        Parameters
+        ----------
+        num_candidates : int, optional
+            The maximum number of candidates to return. Default is 1.
+        timeout : float, optional
+            The maximum number of seconds to wait for the optimizer to
+            produce a candidate if no candidate is ready. If None (the
+            default), does not wait.
+
+        Returns
+        -------
+        next_candidates : list of Candidates
+            The Candidates that should be evaluated next. May contain fewer
+            than num_candidates, or none.
+        """
+        self._logger.debug("Returning next %s candidates.", num_candidates)
+        with self._lock:
+            # Expired candidates can be handed out again right away.
+            reaped, update_optimizer = self._reap_expired_leases()
+            if update_optimizer:
+                self._update_optimizer()
+            to_return = []
+            if not self._optimizer.handles_pausing:
+                while (self._experiment.candidates_pending and
+                       len(to_return) < num_candidates):
+                    to_return.append(self._experiment.candidates_pending.pop())
+                self._logger.debug("Had %s pending.", len(to_return))
+            if len(to_return) < num_candidates:
+                self._logger.debug("Requesting %s candidates from optimizer.",
+                                   num_candidates - len(to_return))
+                candidates = self._optimizer.get_next_candidates(
+                    num_candidates=num_candidates - len(to_return))
+                self._add_new_candidates(candidates, to_return)
+            if to_return or timeout is None or timeout <= 0:
+                return self._hand_out(to_return)
+        self._logger.debug("Waiting up to %s seconds for the optimizer.",
+                           timeout)
+        candidates = self._optimizer.get_next_candidates(
+            num_candidates=num_candidates, timeout=timeout)
+        with self._lock:
+            to_return = []
+            self._add_new_candidates(candidates, to_return)
+            return self._hand_out(to_return)
+
+    def _add_new_candidates(self, candidates, to_return):
+        """
+        Appends those of candidates to to_return not already being worked on.
+        Must be called with _lock held.
+        """
+        self._logger.debug("Got %s", candidates)
+        for c in candidates or []:
+            if c in self._experiment.candidates_working or c in to_return:
+                self._logger.debug("Candidate %s is already being worked "
+                                   "on; not handing it out twice.", c)
+                continue
+            to_return.append(c)
+
+    def _hand_out(self, to_return):
+        """
+        Marks the candidates of to_return as working, writes the state once
+        and returns to_return. Must be called with _lock held.
+        """
+        for c in to_return:
+            if self._lease_duration is not None:
+                c.lease_token = uuid.uuid4().hex
+            self._experiment.add_working(c)
+            self._record_delta("working", c)
+            self._renew_lease(c)
+        self._logger.debug("Returning candidates %s", to_return)
         self._write_state_to_file()
         return to_return
 
+    @_synchronized
     def get_experiment_as_dict(self):
         """
         Returns the dictionary describing this EAss' experiment.
@@ -144,7 +416,8 @@ class ExperimentAssistant(object):
         self._logger.log(5, "Exp_dict is %s" %exp_dict)
         return exp_dict
 
-    def update(self, candidate, status="finished"):
+    @_synchronized
+    def update(self, candidate, status="finished", step=None):
         """
         Updates the experiment_assistant with the status of an experiment
         evaluation.
@@ -157,12 +430,82 @@ class ExperimentAssistant(object):
             A string defining the status change. Can be one of the following:
             - finished: The Candidate is now finished.
             - pausing: The evaluation of Candidate has been paused and can be
-                resumed by another worker.
-            - working: The Candidate is now being worked on by a worker.
+                resumed by another worker. If its result is set, it is
+                recorded as an intermediate result.
+            - working: The Candidate is now being worked on by a worker. If
+                its result is set, it is recorded as an intermediate result.
+        step : int or float, optional
+            The step at which the intermediate result of a working or pausing
+            candidate has been achieved. If None, the budget of a pausing
+            candidate or else the step following the last recorded one is
+            used.
 
+        Returns
+        -------
+        stop : bool
+            True iff the early stopping rule decided that the worker should
+            stop evaluating candidate, or the update carries a stale lease
+            token. Always False unless status is "working".
         """
         self._logger.debug("Updating experiment assistant with candidate %s,"
                            "status %s" %(candidate, status))
+        self._check_update(candidate, status)
+        update_optimizer, stop = self._apply_update(candidate, status, step)
+        if update_optimizer:
+            self._logger.debug("Updating optimizer.")
+            self._update_optimizer()
+            self._logger.debug("Optimizer updated.")
+        self._write_state_to_file()
+        return stop
+
+    @_synchronized
+    def update_many(self, updates):
+        """
+        Applies several updates, with a single optimizer update and write.
+
+        Parameters
+        ----------
+        updates : list of tuples
+            One (candidate, status, step) tuple per update, with parameters
+            as for update. They are applied in order. All are checked before
+            any is applied.
+
+        Returns
+        -------
+        stops : list of bools
+            For each update, whether the worker should stop evaluating the
+            candidate (see update).
+
+        Raises
+        ------
+        ValueError
+            Iff any status or candidate is invalid.
+        """
+        self._logger.debug("Applying %s updates.", len(updates))
+        for candidate, status, step in updates:
+            self._check_update(candidate, status)
+        update_optimizer = False
+        stops = []
+        for candidate, status, step in updates:
+            needs_update, stop = self._apply_update(candidate, status, step)
+            update_optimizer = update_optimizer or needs_update
+            stops.append(stop)
+        if update_optimizer:
+            self._logger.debug("Updating optimizer once for all updates.")
+            self._update_optimizer()
+        self._write_state_to_file()
+        return stops
+
+    def _check_update(self, candidate, status):
+        """
+        Checks the arguments of an update.
+
+        Raises
+        ------
+        ValueError
+            Iff status is not in AVAILABLE_STATUS or candidate is not a
+            Candidate.
+        """
         if status not in AVAILABLE_STATUS:
             message = ("status not in %s but %s."
                              %(str(AVAILABLE_STATUS), str(status)))
@@ -175,23 +518,181 @@ class ExperimentAssistant(object):
             self._logger.error(message)
             raise ValueError(message)
 
+    def _apply_update(self, candidate, status, step):
+        """
+        Applies an update to the experiment, without updating the optimizer
+        or writing the state.
+
+        Parameters are as for update.
+
+        Returns
+        -------
+        update_optimizer : bool
+            Whether the optimizer has to be updated.
+        stop : bool
+            See update.
+        """
         self._logger.debug("Got new %s of candidate %s with parameters %s"
                          " and result %s", status, candidate, candidate.params,
                           candidate.result)
 
+        current = self._experiment.get_candidate(candidate.cand_id)
+        if (candidate.lease_token is not None and current is not None and
+                ((current.lease_token is not None and
+                  candidate.lease_token != current.lease_token) or
+                 current in self._experiment.candidates_finished)):
+            # The worker's lease has expired, and the candidate has been
+            # handed out again or finished since.
+            self._logger.warning("Ignoring %s update of candidate %s with "
+                                 "the stale lease token %s.", status,
+                                 candidate, candidate.lease_token)
+            return False, status == "working"
+        candidate.merge_intermediate_results(current)
+        stop = False
+        update_optimizer = False
         if status == "finished":
             if (candidate.result is None or not np.isfinite(candidate.result)):
                 candidate.failed = True
             self._experiment.add_finished(candidate)
-            self._logger.debug("Was finished, updating optimizer.")
-            # And we rebuild the new optimizer.
-            self._optimizer.update(self._experiment)
-            self._logger.debug("Optimizer updated.")
+            self._record_delta("finished", candidate)
+            self._leases.pop(candidate.cand_id, None)
+            self._lease_expiries.pop(candidate.cand_id, None)
+            update_optimizer = True
         elif status == "pausing":
+            if candidate.result is not None:
+                if step is None:
+                    step = candidate.budget
+                candidate.add_intermediate_result(candidate.result, step)
+            candidate.lease_token = None
             self._experiment.add_pausing(candidate)
+            self._record_delta("pausing", candidate)
+            self._leases.pop(candidate.cand_id, None)
+            update_optimizer = self._optimizer.handles_pausing
         elif status == "working":
+            if candidate.result is not None:
+                candidate.add_intermediate_result(candidate.result, step)
             self._experiment.add_working(candidate)
-        self._write_state_to_file()
+            self._record_delta("working", candidate)
+            self._renew_lease(candidate)
+            if self._early_stopping is not None:
+                stop = self._early_stopping.should_stop(candidate,
+                                                        self._experiment)
+                self._logger.debug("Early stopping decision is %s", stop)
+        return update_optimizer, stop
+
+    def _renew_lease(self, candidate):
+        """
+        Leases candidate for another _lease_duration seconds, if leases are
+        used.
+        """
+        if self._lease_duration is not None:
+            self._leases[candidate.cand_id] = (time.time() +
+                                               self._lease_duration)
+
+    @_synchronized
+    def reap_expired_leases(self, now=None):
+        """
+        Requeues all working candidates whose leases have expired.
+
+        Each is moved back to pending, or marked as failed and finished once
+        its lease expired max_lease_expiries times. The optimizer is updated
+        and the state written if anything changed.
+
+        Parameters
+        ----------
+        now : float, optional
+            The current time. Default is time.time().
+
+        Returns
+        -------
+        reaped : list of Candidates
+            The candidates whose leases expired.
+        """
+        reaped, update_optimizer = self._reap_expired_leases(now)
+        if update_optimizer:
+            self._update_optimizer()
+        if reaped:
+            self._write_state_to_file()
+        return reaped
+
+    def _reap_expired_leases(self, now=None):
+        """
+        Applies reap_expired_leases to the experiment, without updating the
+        optimizer or writing the state. Must be called with _lock held.
+
+        Returns
+        -------
+        reaped : list of Candidates
+            The candidates whose leases expired.
+        update_optimizer : bool
+            Whether the optimizer has to be updated.
+        """
+        if not self._leases:
+            return [], False
+        if now is None:
+            now = time.time()
+        reaped = []
+        update_optimizer = False
+        for c in list(self._experiment.candidates_working):
+            expiry = self._leases.get(c.cand_id)
+            if expiry is None or expiry > now:
+                continue
+            del self._leases[c.cand_id]
+            # Later updates of the expired lease are stale.
+            c.lease_token = None
+            expiries = self._lease_expiries.get(c.cand_id, 0) + 1
+            if expiries >= self._max_lease_expiries:
+                self._logger.warning("Lease of candidate %s expired %s "
+                                     "times; marking it as failed.", c,
+                                     expiries)
+                self._lease_expiries.pop(c.cand_id)
+                c.failed = True
+                self._experiment.add_finished(c)
+                self._record_delta("finished", c)
+                update_optimizer = True
+            else:
+                self._logger.info("Lease of candidate %s expired; moving it "
+                                  "back to pending.", c)
+                self._lease_expiries[c.cand_id] = expiries
+                self._experiment.add_pausing(c)
+                self._record_delta("pausing", c)
+                update_optimizer = (update_optimizer or
+                                    self._optimizer.handles_pausing)
+            reaped.append(c)
+        return reaped, update_optimizer
+
+    def _record_delta(self, status, candidate):
+        """
+        Records that candidate has changed to status.
+
+        An unsent delta of the same candidate is replaced, since the
+        optimizer only needs the latest status of each candidate.
+
+        Parameters
+        ----------
+        status : {"finished", "pausing", "working"}
+            The new status of candidate.
+        candidate : Candidate
+            The changed candidate.
+        """
+        if self._unsent_deltas is None:
+            self._unsent_deltas = []
+        self._unsent_deltas = [d for d in self._unsent_deltas
+                               if d[2].cand_id != candidate.cand_id]
+        self._delta_seq += 1
+        self._unsent_deltas.append((self._delta_seq, status, candidate))
+
+    def _update_optimizer(self):
+        """
+        Sends all unsent deltas to the optimizer.
+
+        Deltas of working candidates are only recorded, and sent with the
+        next finished (or, for optimizers handling pausing, pausing) update.
+        """
+        deltas = self._unsent_deltas or []
+        self._unsent_deltas = []
+        self._logger.debug("Sending %s deltas to the optimizer.", len(deltas))
+        self._optimizer.update_delta(deltas)
 
     def _write_state_to_file(self):
         """
@@ -202,7 +703,8 @@ class ExperimentAssistant(object):
         writes them to file. It also forces _experiment to write its state to
         file.
         All of this only happens if _write_dir is not None - if it is, we will
-        do nothing.
+        do nothing. If there is a _state_writer, the state is only marked as
+        dirty, and written by the writer.
         """
         self._logger.debug("Writing experiment assistant status to file %s",
                            self._write_dir)
@@ -210,6 +712,19 @@ class ExperimentAssistant(object):
             self._logger.debug("No write directory is set; not writing "
                                "anything.")
             return
+        if self._state_writer is not None:
+            self._state_writer.mark_dirty(self._write_dir, self._get_state)
+            return
+        state = self._get_assistant_state()
+        with open(self._write_dir + '/exp_assistant.json', 'w') as outfile:
+            json.dump(state, outfile)
+        self._logger.debug("Writing state %s", state)
+        self._experiment.write_state_to_file(self._write_dir)
+
+    def _get_assistant_state(self):
+        """
+        Returns the state of this experiment assistant as a dict.
+        """
         state = {}
         opt = self._optimizer
         if not isinstance(opt, basestring):
@@ -217,11 +732,27 @@ class ExperimentAssistant(object):
         state["optimizer_class"] = opt
         state["optimizer_arguments"] = self._optimizer_arguments
         state["write_dir"] = self._write_dir
-        with open(self._write_dir + '/exp_assistant.json', 'w') as outfile:
-            json.dump(state, outfile)
-        self._logger.debug("Writing state %s", state)
-        self._experiment.write_state_to_file(self._write_dir)
+        return state
 
+    @_synchronized
+    def _get_state(self):
+        """
+        Returns the files to write for the _state_writer.
+
+        Returns
+        -------
+        files : list of tuples
+            The (filename, object) tuples for exp_assistant.json and
+            experiment.json.
+        """
+        return [
+            (os.path.join(self._write_dir, "exp_assistant.json"),
+             self._get_assistant_state()),
+            (os.path.join(self._write_dir, "experiment.json"),
+             self._experiment.to_dict())
+        ]
+
+    @_synchronized
     def get_best_candidate(self):
         """
         Returns the best candidate to date.
@@ -290,6 +821,9 @@ class ExperimentAssistant(object):
         This internal function returns quality of the results by step.
         This returns an x coordinate, and for each of them a value for the
         currently evaluated result and the best found result.
+
+        The finished part is read from the experiment's incrementally
+        maintained result series (see Experiment.get_result_series).
         Returns
         -------
         x: list of ints
@@ -300,41 +834,24 @@ class ExperimentAssistant(object):
             The best result that has been found until then.
         """
         self._logger.debug("Returning best result per step dicts.")
-        x = []
-        step_evaluation = []
-        step_best = []
-        best_candidate = None
-        if plot_up_to is None:
-            plot_up_to = len(self._experiment.candidates_finished)
-        self._logger.debug("Plotting %s candidates", plot_up_to)
-        x_from = 0
-        for i, e in enumerate(self._experiment.candidates_finished
-                              [:plot_up_to]):
-            x.append(i)
-            if not e.failed:
-                step_evaluation.append(e.result)
-                if self._experiment.better_cand(e, best_candidate):
-                    best_candidate = e
-                    step_best.append(e.result)
-                else:
-                    step_best.append(best_candidate.result)
-            else:
-                step_evaluation.append(float("NaN"))
-                if best_candidate is None:
-                    step_best.append(float("NaN"))
-                else:
-                    step_best.append(best_candidate.result)
-            x_from += 1
+        step_results, step_best, num_steps = \
+            self._experiment.get_result_series(plot_up_to)
+        self._logger.debug("Plotting %s candidates", num_steps)
+        step_evaluation = step_results[:num_steps].tolist()
+        step_best = step_best[:num_steps].tolist()
+        x = range(len(step_evaluation))
+        x_from = len(step_evaluation)
 
         non_finished_evals = []
         non_finished_xs = []
 
-        for i, e in enumerate(sorted(self._experiment.candidates_pending, key=lambda v: v.generated_time)):
+        # Both lists are ordered by generated_time.
+        for e in self._experiment.candidates_pending:
             x_from += 1
             non_finished_xs.append(x_from)
             non_finished_evals.append(e.result)
 
-        for i, e in enumerate(sorted(self._experiment.candidates_working, key=lambda v: v.generated_time)):
+        for e in self._experiment.candidates_working:
             x_from += 1
             non_finished_xs.append(x_from)
             non_finished_evals.append(e.result)
@@ -344,6 +861,7 @@ class ExperimentAssistant(object):
         return x, step_evaluation, step_best, \
                non_finished_xs, non_finished_evals
 
+    @_synchronized
     def get_candidates(self):
         """
         Returns the candidates of this experiment in a dict.
@@ -355,12 +873,14 @@ class ExperimentAssistant(object):
             working, with the corresponding candidates.
         """
         self._logger.debug("Returning candidates of exp_ass.")
-        result = {"finished": self._experiment.candidates_finished,
-                  "pending": self._experiment.candidates_pending,
-                  "working": self._experiment.candidates_working}
+        # Copies, since the lists change on later updates.
+        result = {"finished": list(self._experiment.candidates_finished),
+                  "pending": list(self._experiment.candidates_pending),
+                  "working": list(self._experiment.candidates_working)}
         self._logger.debug("Candidates are %s", result)
         return result
 
+    @_synchronized
     def plot_result_per_step(self, ax=None, color="b",
                              plot_min=None, plot_max=None):
         """
@@ -384,6 +904,32 @@ class ExperimentAssistant(object):
         self._logger.debug("Plotting result per step. ax %s, colors %s, "
                            "plot_min %s, plot_max %s", ax, color, plot_min,
                            plot_max)
+        plots, plot_options = self.get_plot_result_per_step_data(color)
+        fig, ax = plot_lists(plots, ax=ax, fig_options=plot_options,
+                             plot_min=plot_min, plot_max=plot_max)
+
+        return fig
+
+    @_synchronized
+    def get_plot_result_per_step_data(self, color="b"):
+        """
+        Returns the data plot_result_per_step plots, without plotting it.
+
+        Since it contains only lists, strings and numbers, it can be sent to
+        another process to be plotted there.
+
+        Parameters
+        ----------
+        color : string, optional
+            A string representing a pyplot color.
+
+        Returns
+        -------
+        plots : list of dicts
+            The functions to plot, as for plot_utils.plot_lists.
+        plot_options : dict
+            The fig_options for plot_utils.plot_lists.
+        """
         plots = self._best_result_per_step_dicts(color, cutoff_percentage=0.5)
         if self._experiment.minimization_problem:
             legend_loc = 'upper right'
@@ -399,11 +945,54 @@ class ExperimentAssistant(object):
             "minimizing": self._experiment.minimization_problem
         }
         self._logger.debug("Plot options are %s", plot_options)
-        fig, ax = plot_lists(plots, ax=ax, fig_options=plot_options,
-                             plot_min=plot_min, plot_max=plot_max)
+        return plots, plot_options
 
-        return fig
+    @_synchronized
+    def get_result_series(self):
+        """
+        Returns the result of each finished candidate and the best result
+        after each of them.
+
+        The series are not copied, see Experiment.get_result_series.
+
+        Returns
+        -------
+        step_results : array.array of doubles
+            The results in the order the candidates finished. NaN for failed
+            candidates.
+        step_best : array.array of doubles
+            The best result after each step. NaN while there is none.
+        num_steps : int
+            The number of entries of both arrays belonging to the series.
+        """
+        self._logger.debug("Returning result series.")
+        return self._experiment.get_result_series()
+
+    @_synchronized
+    def has_working_candidates(self):
+        """
+        Returns whether any candidate is working or leased.
+
+        Returns
+        -------
+        has_working : bool
+            True iff candidates_working or the leases are not empty.
+        """
+        return bool(self._experiment.candidates_working or self._leases)
+
+    @_synchronized
+    def get_last_update_time(self):
+        """
+        Returns the time the experiment was last changed.
+
+        Returns
+        -------
+        last_update_time : float
+            The time of the last change, see Experiment.last_update_time.
+        """
+        return self._experiment.last_update_time
 
+    @_synchronized
     def set_exit(self):
         """
         Exits this assistant.
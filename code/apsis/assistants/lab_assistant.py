@@ -2,12 +2,18 @@ __author__ = 'Frederik Diehl'
 
 import json
 import os
+import threading
 import time
 import uuid
+from contextlib import contextmanager
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 
 import apsis.models.experiment as experiment
 from apsis.assistants.experiment_assistant import ExperimentAssistant
+from apsis.optimizers.optimizer_pool import OptimizerPool
 from apsis.utilities.file_utils import ensure_directory_exists
+from apsis.utilities.state_writer import StateWriter
 from apsis.utilities.logging_utils import get_logger
 
 # These are the colours supported by the plot.
@@ -20,23 +26,85 @@ class LabAssistant(object):
 
     This is done by abstracting a dict of named experiment assistants.
 
+    Experiments reloaded from write_dir are only loaded on first access (or
+    when activated), and experiments not accessed for hibernate_after
+    seconds are hibernated: their optimizer is stopped, their state written
+    and their experiment assistant dropped until the next access. That way,
+    memory and threads are only used by the experiments in active use.
+
+    A housekeeping thread regularly requeues the candidates of experiments
+    using leases whose workers stopped sending updates (see
+    ExperimentAssistant.reap_expired_leases), and hibernates idle
+    experiments.
+
+    It is safe to use from several threads. The lab's lock only guards the
+    dict of experiment assistants; each experiment assistant has its own
+    lock, so requests for different experiments run concurrently.
+
     Attributes
     ----------
     _exp_assistants : dict of ExperimentAssistants.
-        The dictionary of experiment assistants this LabAssistant uses.
+        The dictionary of the loaded experiment assistants.
+    _exp_paths : dict
+        Maps the id of every experiment, loaded or not, to its write
+        directory (None if there is no _write_dir).
+    _last_access : dict
+        Maps the ids of loaded experiments to the time they were last used.
+    _in_use : dict
+        Maps the ids of loaded experiments to the number of calls currently
+        using them. Experiments in use are never hibernated.
+    _load_locks : dict
+        Maps exp_ids to the locks ensuring each is loaded only once.
+    _unloaded_update_times : dict
+        Maps the ids of experiments not loaded to their last_update_time,
+        once known. See get_last_update_time.
+    _on_hibernate : function or None
+        Called with the id of every hibernated experiment.
+    _hibernate_after : float or None
+        The number of seconds after which unused experiments are hibernated,
+        or None to never hibernate them.
     _write_dir : String, optional
         The directory to write all the results and plots to.
+    _optimizer_pool : OptimizerPool
+        The pool of workers shared by the optimizers of all experiments.
+    _state_writer : StateWriter
+        The writer writing the state of this and all experiment assistants.
+    _lock : threading.RLock
+        Guards _exp_assistants, _exp_paths, _last_access, _in_use,
+        _load_locks and _unloaded_update_times.
+    _reap_interval : float
+        The number of seconds between two runs of the housekeeping thread.
+    _reaper_stop : threading.Event
+        Set to stop the housekeeping thread.
+    _reaper : threading.Thread
+        The housekeeping thread.
     _logger : logging.logger
         The logger for this class.
     """
     _exp_assistants = None
+    _exp_paths = None
+    _last_access = None
+    _in_use = None
+    _load_locks = None
+    _unloaded_update_times = None
+    _hibernate_after = None
+    _on_hibernate = None
 
     _write_dir = None
 
     _global_start_date = None
+    _optimizer_pool = None
+    _state_writer = None
+    _lock = None
+    _reap_interval = None
+    _reaper_stop = None
+    _reaper = None
     _logger = None
 
-    def __init__(self, write_dir=None):
+    def __init__(self, write_dir=None, num_optimizer_workers=None,
+                 blas_threads=1, durability="batched", write_interval=1.,
+                 reap_interval=10., hibernate_after=None, preload=False,
+                 on_hibernate=None):
         """
         Initializes the lab assistant.
 
@@ -45,13 +113,68 @@ class LabAssistant(object):
         write_dir: string, optional
             Sets the write directory for the lab assistant. If None (default),
             nothing will be written.
+        num_optimizer_workers : int, optional
+            The number of workers shared by all experiments' optimizers.
+            Default is the number of CPUs.
+        blas_threads : int or None, optional
+            The maximum number of BLAS threads while optimizing. Only has an
+            effect if threadpoolctl is installed. Default is 1.
+        durability : string, optional
+            When the state is written, one of "fsync" (during each request),
+            "batched" (in the background, as soon as possible) and "periodic"
+            (every write_interval seconds). See StateWriter. Default is
+            "batched".
+        write_interval : float, optional
+            The number of seconds between writes for "periodic" durability.
+            Default is 1.
+        reap_interval : float, optional
+            The number of seconds between checks for expired leases and idle
+            experiments. Default is 10.
+        hibernate_after : float, optional
+            The number of seconds without access after which an experiment
+            is hibernated. Only used with a write_dir. Default is None,
+            which never hibernates experiments.
+        preload : bool, optional
+            If True, all reloaded experiments are loaded in parallel during
+            initialization (see activate). Default is False, which loads
+            each on first access.
+        on_hibernate : function, optional
+            Called with the id of every hibernated experiment, for example
+            to drop data cached for it. Default is None.
+
+        Raises
+        ------
+        ValueError
+            Iff reap_interval or hibernate_after is not positive.
         """
         self._logger = get_logger(self)
         self._logger.info("Initializing lab assistant.")
         self._logger.info("\tWriting results to %s" %write_dir)
+        if not reap_interval > 0:
+            raise ValueError("reap_interval must be positive, but is %s."
+                             %reap_interval)
+        if hibernate_after is not None and not hibernate_after > 0:
+            raise ValueError("hibernate_after must be positive, but is %s."
+                             %hibernate_after)
         self._write_dir = write_dir
+        self._reap_interval = reap_interval
+        if hibernate_after is not None and not write_dir:
+            self._logger.warning("Cannot hibernate experiments without a "
+                                 "write_dir; never hibernating.")
+            hibernate_after = None
+        self._hibernate_after = hibernate_after
+        self._on_hibernate = on_hibernate
 
         self._exp_assistants = {}
+        self._exp_paths = {}
+        self._last_access = {}
+        self._in_use = {}
+        self._load_locks = {}
+        self._unloaded_update_times = {}
+        self._lock = threading.RLock()
+        self._optimizer_pool = OptimizerPool(num_optimizer_workers,
+                                             blas_threads)
+        self._state_writer = StateWriter(durability, write_interval)
 
         reloading_possible = True
         try:
@@ -74,16 +197,22 @@ class LabAssistant(object):
             with open(self._write_dir + "/lab_assistant.json", 'r') as infile:
                 lab_assistant_json = json.load(infile)
             self._global_start_date = lab_assistant_json["global_start_date"]
-            for p in lab_assistant_json["exp_assistants"].values():
-                self._load_exp_assistant_from_path(p)
-            self._logger.debug("\tReloaded all exp_assistants.")
+            self._exp_paths.update(lab_assistant_json["exp_assistants"])
+            self._logger.debug("\tFound %s exp_assistants to reload.",
+                               len(self._exp_paths))
+            if preload:
+                self.activate()
 
         self._write_state_to_file()
+        self._reaper_stop = threading.Event()
+        self._reaper = threading.Thread(target=self._run_housekeeping)
+        self._reaper.daemon = True
+        self._reaper.start()
         self._logger.info("lab assistant successfully initialized.")
 
     def init_experiment(self, name, optimizer, param_defs, exp_id=None,
                         notes=None, optimizer_arguments=None,
-                        minimization=True):
+                        minimization=True, source_exp_ids=None):
         """
         Initializes an experiment.
 
@@ -109,6 +238,13 @@ class LabAssistant(object):
             user starting it.
         minimization : bool, optional
             Whether the problem is one of minimization. Defaults to True.
+        source_exp_ids : list of strings, optional
+            The ids of related experiments of this lab assistant whose
+            finished candidates are used to warm start the optimizer. They
+            must have the same parameter names and optimization direction.
+            Their current state is copied; later results are not used.
+            Only the BayesianOptimizer uses them; other optimizers ignore
+            them. Default is None, which means no warm start.
 
         Returns
         -------
@@ -119,7 +255,8 @@ class LabAssistant(object):
         ------
         ValueError :
             Iff there already is an experiment with the exp_id for this lab
-            assistant. Does not occur if no exp_id is given.
+            assistant. Does not occur if no exp_id is given. Iff one of the
+            source experiments does not exist or is incompatible.
         """
         self._logger.debug("Initializing new experiment. Parameters: "
                            "name: %s, optimizer: %s, param_defs: %s, "
@@ -128,42 +265,117 @@ class LabAssistant(object):
                                                 exp_id, notes,
                                                 optimizer_arguments,
                                                 minimization))
-        if exp_id in self._exp_assistants.keys():
-            raise ValueError("Already an experiment with id %s registered."
-                             %exp_id)
-
-        if exp_id is None:
-            while True:
-                exp_id = uuid.uuid4().hex
-                if exp_id not in self._exp_assistants.keys():
-                    break
-            self._logger.debug("\tGenerated new exp_id: %s" %exp_id)
+        # Resolved first, since this may load the source experiments.
+        source_experiments = self._get_source_experiments(
+            source_exp_ids, param_defs, minimization)
+
+        with self._lock:
+            if exp_id in self._exp_paths:
+                raise ValueError("Already an experiment with id %s registered."
+                                 %exp_id)
+            if exp_id is None:
+                while True:
+                    exp_id = uuid.uuid4().hex
+                    if exp_id not in self._exp_paths:
+                        break
+                self._logger.debug("\tGenerated new exp_id: %s" %exp_id)
+            if not self._write_dir:
+                exp_assistant_write_directory = None
+            else:
+                exp_assistant_write_directory = os.path.join(
+                    self._write_dir + "/" + exp_id)
+            # Reserves exp_id. Accesses wait on the load lock until the
+            # experiment assistant is registered. Since the lock is new, it
+            # is acquired without blocking.
+            load_lock = threading.Lock()
+            load_lock.acquire()
+            self._load_locks[exp_id] = load_lock
+            self._exp_paths[exp_id] = exp_assistant_write_directory
 
-        if not self._write_dir:
-            exp_assistant_write_directory = None
+        try:
+            if exp_assistant_write_directory is not None:
+                ensure_directory_exists(exp_assistant_write_directory)
+            self._logger.debug("\tExp_ass directory: %s"
+                               %exp_assistant_write_directory)
+
+            exp = experiment.Experiment(name,
+                                        param_defs,
+                                        exp_id,
+                                        notes,
+                                        minimization)
+
+            exp_ass = ExperimentAssistant(
+                optimizer, experiment=exp,
+                optimizer_arguments=optimizer_arguments,
+                write_dir=exp_assistant_write_directory,
+                source_experiments=source_experiments,
+                optimizer_pool=self._optimizer_pool,
+                state_writer=self._state_writer)
+        except Exception:
+            with self._lock:
+                del self._exp_paths[exp_id]
+                del self._load_locks[exp_id]
+            raise
         else:
-            exp_assistant_write_directory = os.path.join(self._write_dir +
-                                                     "/" + exp_id)
-            ensure_directory_exists(exp_assistant_write_directory)
-        self._logger.debug("\tExp_ass directory: %s"
-                           %exp_assistant_write_directory)
-
-        exp = experiment.Experiment(name,
-                                    param_defs,
-                                    exp_id,
-                                    notes,
-                                    minimization)
-
-        exp_ass = ExperimentAssistant(optimizer,
-                                      experiment=exp,
-                                      optimizer_arguments=optimizer_arguments,
-                                      write_dir=exp_assistant_write_directory)
-        self._exp_assistants[exp_id] = exp_ass
+            with self._lock:
+                self._register(exp_id, exp_ass)
+        finally:
+            load_lock.release()
         self._logger.info("Experiment initialized successfully with id %s."
                           %exp_id)
         self._write_state_to_file()
         return exp_id
 
+    def _get_source_experiments(self, source_exp_ids, param_defs,
+                                minimization):
+        """
+        Returns copies of the source experiments for warm starting.
+
+        Parameters
+        ----------
+        source_exp_ids : list of strings or None
+            The ids of the source experiments.
+        param_defs : dict of parameter definitions
+            The parameter definitions of the new experiment.
+        minimization : bool
+            Whether the new experiment is a minimization problem.
+
+        Returns
+        -------
+        source_experiments : list of Experiments or None
+            Copies of the source experiments, or None if source_exp_ids is
+            None or empty.
+
+        Raises
+        ------
+        ValueError :
+            Iff a source experiment does not exist, has different parameter
+            names or a different optimization direction.
+        """
+        if not source_exp_ids:
+            return None
+        source_experiments = []
+        for source_id in source_exp_ids:
+            if not self.contains_id(source_id):
+                raise ValueError("Source experiment %s does not exist."
+                                 %source_id)
+            # A copy, taken under the source's lock.
+            with self._using_exp_assistant(source_id) as exp_ass:
+                source = experiment.from_dict(exp_ass.get_experiment_as_dict())
+            if (set(source.parameter_definitions.keys()) !=
+                    set(param_defs.keys())):
+                raise ValueError("Source experiment %s has parameters %s, "
+                                 "but the new experiment has %s."
+                                 %(source_id,
+                                   sorted(source.parameter_definitions.keys()),
+                                   sorted(param_defs.keys())))
+            if source.minimization_problem != minimization:
+                raise ValueError("Source experiment %s has a different "
+                                 "optimization direction." %source_id)
+            source_experiments.append(source)
+        self._logger.debug("\tWarm starting from %s" %source_exp_ids)
+        return source_experiments
+
     def _load_exp_assistant_from_path(self, path):
         """
         This loads a complete exp_assistant from path.
@@ -178,6 +390,11 @@ class LabAssistant(object):
         path : string
             The path from which to initialize. This must contain an
             exp_assistant.json as specified.
+
+        Returns
+        -------
+        exp_ass : ExperimentAssistant
+            The loaded experiment assistant. It is not registered yet.
         """
         self._logger.debug("Loading Exp_assistant from path %s" %path)
         with open(path + "/exp_assistant.json", 'r') as infile:
@@ -199,13 +416,12 @@ class LabAssistant(object):
         exp_ass = ExperimentAssistant(optimizer_class=optimizer_class,
                                       experiment=exp,
                                       optimizer_arguments=optimizer_arguments,
-                                      write_dir=exp_ass_write_dir)
+                                      write_dir=exp_ass_write_dir,
+                                      optimizer_pool=self._optimizer_pool,
+                                      state_writer=self._state_writer)
 
-        if exp_ass.exp_id in self._exp_assistants:
-            raise ValueError("Loaded exp_id is duplicated in experiment! id "
-                             "is %s" %exp_ass.exp_id)
-        self._exp_assistants[exp_ass.exp_id] = exp_ass
         self._logger.info("Successfully loaded experiment from %s." %path)
+        return exp_ass
 
     def _load_experiment(self, path):
         """
@@ -238,12 +454,204 @@ class LabAssistant(object):
                            %self._write_dir)
         if not self._write_dir:
             return
-        state = {"global_start_date": self._global_start_date,
-                "exp_assistants": {x.exp_id: x.write_dir for x
-                                    in self._exp_assistants.values()}}
+        self._state_writer.mark_dirty(self._write_dir, self._get_state)
+
+    def _get_state(self):
+        """
+        Returns the files to write for the _state_writer.
+
+        Returns
+        -------
+        files : list of tuples
+            The (filename, object) tuple for lab_assistant.json.
+        """
+        with self._lock:
+            state = {"global_start_date": self._global_start_date,
+                     "exp_assistants": dict(self._exp_paths)}
         self._logger.debug("\tState is %s" %state)
-        with open(self._write_dir + '/lab_assistant.json', 'w') as outfile:
-            json.dump(state, outfile)
+        return [(os.path.join(self._write_dir, "lab_assistant.json"), state)]
+
+    def _register(self, exp_id, exp_ass):
+        """
+        Adds the loaded or new exp_ass. Must be called with _lock held.
+        """
+        self._exp_assistants[exp_id] = exp_ass
+        self._exp_paths[exp_id] = exp_ass.write_dir
+        self._last_access[exp_id] = time.time()
+        self._in_use.setdefault(exp_id, 0)
+        self._unloaded_update_times.pop(exp_id, None)
+
+    @contextmanager
+    def _using_exp_assistant(self, exp_id):
+        """
+        Provides the experiment assistant for exp_id, loading it if
+        necessary. It is not hibernated while in use.
+
+        Only the lookup holds the lab's lock; the assistant is used without
+        it.
+
+        Raises
+        ------
+        KeyError
+            Iff there is no experiment with exp_id.
+        """
+        exp_ass = self._acquire_exp_assistant(exp_id)
+        try:
+            yield exp_ass
+        finally:
+            with self._lock:
+                self._in_use[exp_id] -= 1
+                self._last_access[exp_id] = time.time()
+
+    def _acquire_exp_assistant(self, exp_id):
+        """
+        Returns the experiment assistant for exp_id, loaded if necessary, and
+        marks it as in use.
+
+        Raises
+        ------
+        KeyError
+            Iff there is no experiment with exp_id.
+        ValueError
+            Iff the loaded experiment has a different id.
+        """
+        with self._lock:
+            if exp_id not in self._exp_assistants:
+                if exp_id not in self._exp_paths:
+                    raise KeyError("No experiment with id %s." %exp_id)
+                load_lock = self._load_locks.setdefault(exp_id,
+                                                        threading.Lock())
+            else:
+                self._in_use[exp_id] += 1
+                return self._exp_assistants[exp_id]
+        # Loading only blocks requests for the same experiment.
+        with load_lock:
+            with self._lock:
+                if exp_id not in self._exp_paths:
+                    # Its initialization failed meanwhile.
+                    raise KeyError("No experiment with id %s." %exp_id)
+                loaded = exp_id in self._exp_assistants
+                path = self._exp_paths[exp_id]
+            if not loaded:
+                exp_ass = self._load_exp_assistant_from_path(path)
+                if exp_ass.exp_id != exp_id:
+                    exp_ass.set_exit()
+                    raise ValueError("Experiment at %s has id %s instead of "
+                                     "%s." %(path, exp_ass.exp_id, exp_id))
+                with self._lock:
+                    self._register(exp_id, exp_ass)
+            with self._lock:
+                self._in_use[exp_id] += 1
+                return self._exp_assistants[exp_id]
+
+    def activate(self, exp_ids=None, num_threads=None):
+        """
+        Loads experiments in parallel.
+
+        Parameters
+        ----------
+        exp_ids : list of strings, optional
+            The ids of the experiments to load. Default is None, which loads
+            all experiments.
+        num_threads : int, optional
+            The number of threads loading experiments. Default is the number
+            of CPUs.
+
+        Returns
+        -------
+        loaded : list of strings
+            The ids of the experiments which had not been loaded before.
+        """
+        with self._lock:
+            if exp_ids is None:
+                exp_ids = self._exp_paths.keys()
+            to_load = [e for e in exp_ids if e not in self._exp_assistants]
+        if not to_load:
+            return []
+        self._logger.info("Loading %s experiments.", len(to_load))
+
+        def load(exp_id):
+            with self._using_exp_assistant(exp_id):
+                pass
+        pool = ThreadPool(min(num_threads or cpu_count(), len(to_load)))
+        try:
+            pool.map(load, to_load)
+        finally:
+            pool.close()
+            pool.join()
+        return to_load
+
+    def hibernate(self, exp_id):
+        """
+        Hibernates the experiment with exp_id: Its optimizer is stopped, its
+        state written and its experiment assistant dropped. It is loaded
+        again on the next access.
+
+        Parameters
+        ----------
+        exp_id : string
+            The id of the experiment.
+
+        Returns
+        -------
+        hibernated : bool
+            False if the experiment is not loaded, currently in use or
+            cannot be reloaded since there is no write_dir.
+        """
+        if not self._write_dir:
+            return False
+        with self._lock:
+            if exp_id not in self._exp_assistants:
+                return False
+            load_lock = self._load_locks.setdefault(exp_id, threading.Lock())
+        # Accesses during hibernation wait on the load lock, so that the
+        # experiment is only reloaded once its final state is on disk.
+        with load_lock:
+            with self._lock:
+                if self._in_use.get(exp_id, 0) > 0:
+                    return False
+                exp_ass = self._exp_assistants.pop(exp_id, None)
+                if exp_ass is None:
+                    return False
+                del self._last_access[exp_id]
+                del self._in_use[exp_id]
+            self._logger.info("Hibernating experiment %s.", exp_id)
+            exp_ass.set_exit()
+            self._state_writer.flush()
+            last_update_time = exp_ass.get_last_update_time()
+            with self._lock:
+                self._unloaded_update_times[exp_id] = last_update_time
+        if self._on_hibernate is not None:
+            self._on_hibernate(exp_id)
+        return True
+
+    def hibernate_idle(self, now=None):
+        """
+        Hibernates every experiment not used for hibernate_after seconds.
+
+        Experiments with working or leased candidates are kept loaded, since
+        their workers may still send updates.
+
+        Parameters
+        ----------
+        now : float, optional
+            The current time. Default is time.time().
+
+        Returns
+        -------
+        hibernated : list of strings
+            The ids of the hibernated experiments.
+        """
+        if self._hibernate_after is None:
+            return []
+        if now is None:
+            now = time.time()
+        with self._lock:
+            idle = [(e, self._exp_assistants[e])
+                    for e, t in self._last_access.items()
+                    if now - t >= self._hibernate_after]
+        return [e for e, exp_ass in idle
+                if not exp_ass.has_working_candidates() and self.hibernate(e)]
 
     def get_candidates(self, experiment_id):
         """
@@ -261,11 +669,12 @@ class LabAssistant(object):
             working, with the corresponding candidates.
         """
         self._logger.debug("Returning candidates for exp %s" %experiment_id)
-        candidates = self._exp_assistants[experiment_id].get_candidates()
+        with self._using_exp_assistant(experiment_id) as exp_ass:
+            candidates = exp_ass.get_candidates()
         self._logger.debug("\tCandidates are %s" %candidates)
         return candidates
 
-    def get_next_candidate(self, experiment_id):
+    def get_next_candidate(self, experiment_id, timeout=None):
         """
         Returns the next candidates for a specific experiment.
 
@@ -273,6 +682,9 @@ class LabAssistant(object):
         ----------
         experiment_id : string
             The id of the experiment for which to return the next candidate.
+        timeout : float, optional
+            The maximum number of seconds to wait for a candidate if none is
+            ready. If None (the default), does not wait.
 
         Returns
         -------
@@ -281,10 +693,39 @@ class LabAssistant(object):
             which is equivalent to no candidate generated.
         """
         self._logger.debug("Returning next candidate for id %s" %experiment_id)
-        next_cand = self._exp_assistants[experiment_id].get_next_candidate()
+        with self._using_exp_assistant(experiment_id) as exp_ass:
+            next_cand = exp_ass.get_next_candidate(timeout=timeout)
         self._logger.debug("\tNext candidate is %s" %next_cand)
         return next_cand
 
+    def get_next_candidates(self, experiment_id, num_candidates=1,
+                            timeout=None):
+        """
+        Returns up to num_candidates next candidates for an experiment.
+
+        Parameters
+        ----------
+        experiment_id : string
+            The id of the experiment for which to return the candidates.
+        num_candidates : int, optional
+            The maximum number of candidates to return. Default is 1.
+        timeout : float, optional
+            The maximum number of seconds to wait for a candidate if none is
+            ready. If None (the default), does not wait.
+
+        Returns
+        -------
+        next_candidates : list of Candidates
+            The Candidates that should be evaluated next. May be empty.
+        """
+        self._logger.debug("Returning %s next candidates for id %s",
+                           num_candidates, experiment_id)
+        with self._using_exp_assistant(experiment_id) as exp_ass:
+            next_cands = exp_ass.get_next_candidates(
+                num_candidates=num_candidates, timeout=timeout)
+        self._logger.debug("\tNext candidates are %s", next_cands)
+        return next_cands
+
     def get_best_candidate(self, experiment_id):
         """
         Returns the best candidates for a specific experiment.
@@ -301,11 +742,12 @@ class LabAssistant(object):
             which is equivalent to no candidate being evaluated.
         """
         self._logger.debug("Returning best candidate for id %s" %experiment_id)
-        best_cand = self._exp_assistants[experiment_id].get_best_candidate()
+        with self._using_exp_assistant(experiment_id) as exp_ass:
+            best_cand = exp_ass.get_best_candidate()
         self._logger.debug("\tBest candidate is %s" %best_cand)
         return best_cand
 
-    def update(self, experiment_id, status, candidate):
+    def update(self, experiment_id, status, candidate, step=None):
         """
         Updates the specicied experiment with the status of an experiment
         evaluation.
@@ -321,13 +763,47 @@ class LabAssistant(object):
             - finished: The Candidate is now finished.
             - pausing: The evaluation of Candidate has been paused and can be
                 resumed by another worker.
-            - working: The Candidate is now being worked on by a worker.
+            - working: The Candidate is now being worked on by a worker. If
+                its result is set, it is recorded as an intermediate result.
+        step : int or float, optional
+            The step of the intermediate result of a working candidate.
 
+        Returns
+        -------
+        stop : bool
+            True iff the worker should stop evaluating candidate.
         """
         self._logger.debug("Updating exp_id %s with candidate %s with status"
                            "%s." %(experiment_id, candidate, status))
-        self._exp_assistants[experiment_id].update(status=status,
-                                                         candidate=candidate)
+        with self._using_exp_assistant(experiment_id) as exp_ass:
+            stop = exp_ass.update(status=status, candidate=candidate,
+                                  step=step)
+        return stop
+
+    def update_many(self, experiment_id, updates):
+        """
+        Applies several updates to the specified experiment at once.
+
+        The optimizer is updated and the state written only once.
+
+        Parameters
+        ----------
+        experiment_id : string
+            The id of the experiment to update.
+        updates : list of tuples
+            One (candidate, status, step) tuple per update, see update.
+
+        Returns
+        -------
+        stops : list of bools
+            For each update, True iff the worker should stop evaluating the
+            candidate.
+        """
+        self._logger.debug("Applying %s updates to exp_id %s.", len(updates),
+                           experiment_id)
+        with self._using_exp_assistant(experiment_id) as exp_ass:
+            stops = exp_ass.update_many(updates)
+        return stops
 
     def get_experiment_as_dict(self, exp_id):
         """
@@ -344,7 +820,8 @@ class LabAssistant(object):
             The experiment dictionary as defined by Experiment.to_dict().
         """
         self._logger.debug("Returning experiment %s as dict." %exp_id)
-        exp_dict = self._exp_assistants[exp_id].get_experiment_as_dict()
+        with self._using_exp_assistant(exp_id) as exp_ass:
+            exp_dict = exp_ass.get_experiment_as_dict()
         self._logger.debug("\tDict is %s" %exp_dict)
         return exp_dict
 
@@ -364,10 +841,130 @@ class LabAssistant(object):
         """
         self._logger.debug("Returning plot of results per step for %s."
                            %exp_id)
-        fig = self._exp_assistants[exp_id].plot_result_per_step()
+        with self._using_exp_assistant(exp_id) as exp_ass:
+            fig = exp_ass.plot_result_per_step()
         self._logger.debug("Figure is %s" %fig)
         return fig
 
+    def get_plot_result_per_step_data(self, exp_id):
+        """
+        Returns the data plotted by get_plot_result_per_step.
+
+        Parameters
+        ----------
+        exp_id : string
+            The id of the experiment.
+
+        Returns
+        -------
+        plots : list of dicts
+            The functions to plot, as for plot_utils.plot_lists.
+        plot_options : dict
+            The fig_options for plot_utils.plot_lists.
+        """
+        self._logger.debug("Returning plot data of results per step for %s.",
+                           exp_id)
+        with self._using_exp_assistant(exp_id) as exp_ass:
+            return exp_ass.get_plot_result_per_step_data()
+
+    def get_result_series(self, exp_id):
+        """
+        Returns the result series of the specified experiment.
+
+        Parameters
+        ----------
+        exp_id : string
+            The id of the experiment.
+
+        Returns
+        -------
+        step_results, step_best, num_steps
+            See ExperimentAssistant.get_result_series.
+        """
+        self._logger.debug("Returning result series of %s.", exp_id)
+        with self._using_exp_assistant(exp_id) as exp_ass:
+            return exp_ass.get_result_series()
+
+    def get_last_update_time(self, exp_id):
+        """
+        Returns the time the specified experiment was last changed.
+
+        An experiment not loaded is not loaded for this. Its time is
+        remembered from its hibernation, or read from its experiment.json.
+
+        Parameters
+        ----------
+        exp_id : string
+            The id of the experiment.
+
+        Returns
+        -------
+        last_update_time : float
+            The time of the last change.
+
+        Raises
+        ------
+        KeyError
+            Iff there is no experiment with exp_id.
+        """
+        with self._lock:
+            if exp_id not in self._exp_paths:
+                raise KeyError("No experiment with id %s." %exp_id)
+            load_lock = self._load_locks.setdefault(exp_id, threading.Lock())
+        # Waits for a loading or hibernation of the experiment to finish.
+        with load_lock:
+            with self._lock:
+                exp_ass = self._exp_assistants.get(exp_id)
+                last_update_time = self._unloaded_update_times.get(exp_id)
+                path = self._exp_paths.get(exp_id)
+            if exp_ass is not None:
+                return exp_ass.get_last_update_time()
+            if last_update_time is None and path is not None:
+                with open(path + "/experiment.json", "r") as infile:
+                    last_update_time = json.load(infile).get(
+                        "last_update_time")
+                with self._lock:
+                    self._unloaded_update_times[exp_id] = last_update_time
+        if last_update_time is None:
+            # Older states do not contain the time; loading sets it.
+            with self._using_exp_assistant(exp_id) as exp_ass:
+                return exp_ass.get_last_update_time()
+        return last_update_time
+
+
+    def reap_expired_leases(self):
+        """
+        Requeues the candidates with expired leases of all loaded
+        experiments.
+
+        Returns
+        -------
+        reaped : dict
+            Maps the ids of experiments with expired leases to the list of
+            their reaped candidates.
+        """
+        with self._lock:
+            exp_assistants = self._exp_assistants.values()
+        reaped = {}
+        for exp_ass in exp_assistants:
+            exp_reaped = exp_ass.reap_expired_leases()
+            if exp_reaped:
+                reaped[exp_ass.exp_id] = exp_reaped
+        return reaped
+
+    def _run_housekeeping(self):
+        """
+        Calls reap_expired_leases and hibernate_idle every _reap_interval
+        seconds until _reaper_stop is set.
+        """
+        while not self._reaper_stop.wait(self._reap_interval):
+            try:
+                reaped = self.reap_expired_leases()
+                if reaped:
+                    self._logger.info("Reaped expired leases: %s", reaped)
+                self.hibernate_idle()
+            except Exception:
+                self._logger.exception("Housekeeping failed.")
 
     def contains_id(self, exp_id):
         """
@@ -384,7 +981,9 @@ class LabAssistant(object):
             True iff this lab assistant contains an experiment with this id.
         """
         self._logger.debug("Testing whether this contains id %s" %exp_id)
-        if exp_id in self._exp_assistants:
+        with self._lock:
+            contains = exp_id in self._exp_paths
+        if contains:
             self._logger.debug("exp_id %s is contained." %exp_id)
             return True
         self._logger.debug("exp_id %s is not contained." %exp_id)
@@ -400,7 +999,8 @@ class LabAssistant(object):
             All ids this lab assitant knows.
         """
         self._logger.debug("Requested all exp_ids.")
-        exp_ids = self._exp_assistants.keys()
+        with self._lock:
+            exp_ids = self._exp_paths.keys()
         self._logger.debug("All exp_ids: %s" %exp_ids)
         return exp_ids
 
@@ -408,9 +1008,16 @@ class LabAssistant(object):
         """
         Exits this assistant.
 
-        Currently, all that is done is exiting all exp_assistants..
+        Exits all exp_assistants, then stops the optimizer pool and writes
+        the remaining state.
         """
         self._logger.info("Shutting down lab assistant: Setting exit.")
-        for exp in self._exp_assistants.values():
+        self._reaper_stop.set()
+        self._reaper.join()
+        with self._lock:
+            exp_assistants = self._exp_assistants.values()
+        for exp in exp_assistants:
             exp.set_exit()
-        self._logger.info("Shut down all experiment assistants.")
\ No newline at end of file
+        self._logger.info("Shut down all experiment assistants.")
+        self._optimizer_pool.exit()
+        self._state_writer.exit()
\ No newline at end of file
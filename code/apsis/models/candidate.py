@@ -46,6 +46,23 @@ class Candidate(object):
 
     generated_time : float
         The time this candidate has been generated.
+
+    intermediate_results : list of [step, result] lists
+        The append-only series of intermediate results reported by workers
+        while evaluating this candidate, ordered by strictly increasing step.
+        This is used, for example, to compare learning curves for early
+        stopping.
+
+    budget : float or None
+        The resource budget (for example the number of epochs) the worker
+        should evaluate this candidate with. None if the optimizer does not
+        assign budgets, in which case the evaluation uses its full budget.
+
+    lease_token : string or None
+        Identifies the lease under which this candidate has been handed out.
+        Workers send it back with their updates, so that updates from a
+        worker whose lease has expired can be recognized. None if the
+        candidate is not leased.
     """
 
     cand_id = None
@@ -54,6 +71,9 @@ class Candidate(object):
     cost = None
     failed = None
     worker_information = None
+    intermediate_results = None
+    budget = None
+    lease_token = None
     _logger = None
 
     last_update_time = None
@@ -101,10 +121,27 @@ class Candidate(object):
         self.failed = False
         self.params = params
         self.worker_information = worker_information
+        self.intermediate_results = []
         self.last_update_time = time.time()
         self.generated_time = time.time()
         self._logger.debug("Finished initializing the candidate.")
 
+    def __getstate__(self):
+        """
+        Returns the state for pickling, without the unpicklable logger.
+        """
+        state = dict(self.__dict__)
+        state.pop("_logger", None)
+        return state
+
+    def __setstate__(self, state):
+        """
+        Restores the pickled state and recreates the logger.
+        """
+        self.__dict__.update(state)
+        self._logger = get_logger(self, extra_info="cand_id " +
+                                                   str(self.cand_id))
+
     def __eq__(self, other):
         """
         Compares two Candidate instances.
@@ -134,6 +171,68 @@ class Candidate(object):
         self._logger.debug("Equality: %s", equality)
         return equality
 
+    def add_intermediate_result(self, result, step=None):
+        """
+        Appends an intermediate result to this candidate's series.
+
+        The series is append-only: A result whose step is not greater than
+        the last recorded step is ignored.
+
+        Parameters
+        ----------
+        result : float
+            The intermediate result.
+        step : int or float, optional
+            The step (for example the epoch) at which result has been
+            achieved. If None (default), the step following the last
+            recorded one is used, starting at 0.
+
+        Returns
+        -------
+        added : bool
+            True iff the result has been appended.
+        """
+        last_step = None
+        if self.intermediate_results:
+            last_step = self.intermediate_results[-1][0]
+        if step is None:
+            if last_step is None:
+                step = 0
+            else:
+                step = last_step + 1
+        if last_step is not None and step <= last_step:
+            self._logger.debug("Ignoring intermediate result %s at step %s; "
+                               "last step is %s.", result, step, last_step)
+            return False
+        self.intermediate_results.append([step, result])
+        self._logger.debug("Added intermediate result %s at step %s.",
+                           result, step)
+        return True
+
+    def merge_intermediate_results(self, other):
+        """
+        Merges the intermediate results of other into this candidate.
+
+        Since workers only report the newest values, a candidate received from
+        a worker usually misses the earlier part of its series. This prepends
+        all entries of other which lie before this candidate's first step.
+
+        Parameters
+        ----------
+        other : Candidate
+            The (usually previously stored) version of this candidate.
+        """
+        if other is None or not other.intermediate_results:
+            return
+        if not self.intermediate_results:
+            self.intermediate_results = [list(e) for e in
+                                         other.intermediate_results]
+            return
+        first_step = self.intermediate_results[0][0]
+        earlier = [list(e) for e in other.intermediate_results
+                   if e[0] < first_step]
+        self.intermediate_results = earlier + self.intermediate_results
+
     def __str__(self):
         """
         Stringifies this Candidate.
@@ -171,6 +270,12 @@ class Candidate(object):
                 The cost of evaluating the Candidate
             "worker_information" : any jsonable or None
                 Client-settable worker information.
+            "intermediate_results" : list of [step, result] lists
+                The intermediate results reported so far.
+            "budget" : float or None
+                The resource budget assigned to this candidate.
+            "lease_token" : string or None
+                The token of the candidate's lease.
         """
         if do_logging:
             self._logger.debug("Converting cand to dict.")
@@ -181,7 +286,10 @@ class Candidate(object):
              "cost": self.cost,
              "last_update_time": self.last_update_time,
              "generated_time": self.generated_time,
-             "worker_information": self.worker_information}
+             "worker_information": self.worker_information,
+             "intermediate_results": self.intermediate_results,
+             "budget": self.budget,
+             "lease_token": self.lease_token}
         if do_logging:
             self._logger.debug("Generated dict %s", d)
         return d
@@ -231,5 +339,9 @@ def from_dict(d):
     c.last_update_time = d.get("last_update_time")
     c.generated_time = d.get("generated_time")
     c.worker_information = d.get("worker_information", None)
+    c.intermediate_results = [list(e) for e in
+                              d.get("intermediate_results", None) or []]
+    c.budget = d.get("budget", None)
+    c.lease_token = d.get("lease_token", None)
     cand_logger.log(5, "Constructed candidate is %s", c)
     return c
@@ -2,6 +2,7 @@ __author__ = 'Frederik Diehl'
 
 from apsis.models.candidate import Candidate
 from apsis.models.parameter_definition import ParamDef
+import array
 import copy
 import uuid
 import time
@@ -31,9 +32,10 @@ class Experiment(object):
     candidates_pending : list of Candidate instances
         These Candidate instances have been generated by an optimizer to be
         evaluated at the next possible time, but are not yet assigned to a
-        worker.
+        worker. Ordered by generated_time.
     candidates_working : list of Candidate instances
         These Candidate instances are currently being evaluated by workers.
+        Ordered by generated_time.
     candidates_finished : list of Candidate instances
         These Candidate instances have finished evaluated.
     best_candidate : Candidate instance
@@ -43,6 +45,17 @@ class Experiment(object):
         the experiment.
     last_update_time : float
         The time the last update happened.
+    _step_results : array.array of doubles
+        The result of each finished candidate, in the order of
+        candidates_finished. NaN for failed candidates.
+    _step_best : array.array of doubles
+        The best result up to and including each finished candidate. NaN
+        while there is none.
+    _series_best : Candidate or None
+        The best candidate covered by _step_best.
+    _series_source : list or None
+        The candidates_finished list the series have been computed from, or
+        None if they have to be recomputed.
     """
     name = None
 
@@ -60,6 +73,11 @@ class Experiment(object):
 
     last_update_time = None
 
+    _step_results = None
+    _step_best = None
+    _series_best = None
+    _series_source = None
+
     _logger = None
 
     def __init__(self, name, parameter_definitions, exp_id=None, notes=None,
@@ -154,12 +172,19 @@ class Experiment(object):
             self.candidates_working.remove(candidate)
         if candidate in self.candidates_finished:
             self.candidates_finished.remove(candidate)
+            self._series_source = None
 
         cur_time = time.time()
         candidate.last_update_time = cur_time
         self.last_update_time = cur_time
         self.candidates_finished.append(candidate)
-        self._update_best()
+        if self._series_source is self.candidates_finished:
+            self._append_to_series(candidate)
+        if candidate == self.best_candidate:
+            # Its result may have become worse.
+            self._update_best()
+        elif self.better_cand(candidate, self.best_candidate):
+            self.best_candidate = candidate
         self._logger.debug("Added finished candidate %s", candidate)
 
     def add_pending(self, candidate):
@@ -188,14 +213,15 @@ class Experiment(object):
             self.candidates_working.remove(candidate)
         if candidate in self.candidates_finished:
             self.candidates_finished.remove(candidate)
+            self._series_source = None
 
         cur_time = time.time()
         candidate.last_update_time = cur_time
         self.last_update_time = cur_time
 
-        self.candidates_pending.append(candidate)
+        self._insert_by_generated_time(self.candidates_pending, candidate)
 
-        self._update_best()
+        self._update_best_removed(candidate)
         self._logger.debug("Added pending candidate %s", candidate)
 
     def add_working(self, candidate):
@@ -223,13 +249,14 @@ class Experiment(object):
             self.candidates_working.remove(candidate)
         if candidate in self.candidates_finished:
             self.candidates_finished.remove(candidate)
+            self._series_source = None
 
         cur_time = time.time()
         candidate.last_update_time = cur_time
         self.last_update_time = cur_time
 
-        self.candidates_working.append(candidate)
-        self._update_best()
+        self._insert_by_generated_time(self.candidates_working, candidate)
+        self._update_best_removed(candidate)
         self._logger.debug("Added working candidate %s", candidate)
 
     def add_pausing(self, candidate):
@@ -260,15 +287,53 @@ class Experiment(object):
             self.candidates_working.remove(candidate)
         if candidate in self.candidates_finished:
             self.candidates_finished.remove(candidate)
+            self._series_source = None
 
         cur_time = time.time()
         candidate.last_update_time = cur_time
         self.last_update_time = cur_time
 
-        self.candidates_pending.append(candidate)
-        self._update_best()
+        self._insert_by_generated_time(self.candidates_pending, candidate)
+        self._update_best_removed(candidate)
         self._logger.debug("Pausing candidate %s", candidate)
 
+    def _insert_by_generated_time(self, cand_list, candidate):
+        """
+        Inserts candidate into cand_list, keeping it ordered by
+        generated_time.
+
+        The position is searched from the end, since most candidates are
+        newer than all others in the list.
+        """
+        i = len(cand_list)
+        while (i > 0 and
+               cand_list[i - 1].generated_time > candidate.generated_time):
+            i -= 1
+        cand_list.insert(i, candidate)
+
+    def get_candidate(self, cand_id):
+        """
+        Returns the stored Candidate instance with cand_id.
+
+        Parameters
+        ----------
+        cand_id : string
+            The id of the candidate to look for.
+
+        Returns
+        -------
+        candidate : Candidate or None
+            The candidate from candidates_working, candidates_pending or
+            candidates_finished (searched in that order) with the same id, or
+            None if this experiment does not know such a candidate.
+        """
+        for cand_list in [self.candidates_working, self.candidates_pending,
+                          self.candidates_finished]:
+            for c in cand_list:
+                if c.cand_id == cand_id:
+                    return c
+        return None
+
     def better_cand(self, candidateA, candidateB):
         """
         Determines whether CandidateA is better than candidateB in the context
@@ -381,6 +446,21 @@ class Experiment(object):
         self._logger.debug("Warped-out parameters: %s", warped_out)
         return warped_out
 
+    def __getstate__(self):
+        """
+        Returns the state for pickling, without the unpicklable logger.
+        """
+        state = dict(self.__dict__)
+        state.pop("_logger", None)
+        return state
+
+    def __setstate__(self, state):
+        """
+        Restores the pickled state and recreates the logger.
+        """
+        self.__dict__.update(state)
+        self._logger = logging_utils.get_logger(self)
+
     def clone(self):
         """
         Create a deep copy of this experiment and return it.
@@ -505,6 +585,78 @@ class Experiment(object):
         self._logger.debug("Final dictionary: %s", result_dict)
         return result_dict
 
+    def _update_best_removed(self, candidate):
+        """
+        Updates the best candidate after candidate left candidates_finished.
+
+        Only the best candidate leaving requires a scan of all finished
+        candidates.
+        """
+        if candidate == self.best_candidate:
+            self._update_best()
+
+    def get_result_series(self, up_to=None):
+        """
+        Returns the results of the finished candidates and the best result
+        after each of them.
+
+        Both series are maintained incrementally as candidates finish. They
+        are only recomputed after a finished candidate has been removed or
+        finished again, or candidates_finished has been replaced.
+
+        The arrays are returned without copying them, so this takes
+        constant time unless the series have to be recomputed. Only their
+        first num_steps entries belong to the series. Since the arrays are
+        only ever appended to (a recomputation creates new ones), these
+        entries stay valid when the experiment changes later. The arrays
+        must not be modified.
+
+        Parameters
+        ----------
+        up_to : int, optional
+            Only the first up_to finished candidates are covered. Default
+            is None, which covers all.
+
+        Returns
+        -------
+        step_results : array.array of doubles
+            The result of each finished candidate, in the order of
+            candidates_finished. NaN for failed candidates.
+        step_best : array.array of doubles
+            The best result up to and including each finished candidate.
+            NaN while there is none.
+        num_steps : int
+            The number of entries of step_results and step_best belonging
+            to the series.
+        """
+        if self._series_source is not self.candidates_finished:
+            self._logger.debug("Recomputing result series.")
+            self._step_results = array.array("d")
+            self._step_best = array.array("d")
+            self._series_best = None
+            self._series_source = self.candidates_finished
+            for c in self.candidates_finished:
+                self._append_to_series(c)
+        num_steps = len(self._step_results)
+        if up_to is not None:
+            num_steps = max(0, min(up_to, num_steps))
+        return self._step_results, self._step_best, num_steps
+
+    def _append_to_series(self, candidate):
+        """
+        Appends the just finished candidate to the result series.
+        """
+        if candidate.failed or candidate.result is None:
+            self._step_results.append(float("NaN"))
+        else:
+            self._step_results.append(candidate.result)
+        if self.better_cand(candidate, self._series_best):
+            self._series_best = candidate
+        if self._series_best is None:
+            self._step_best.append(float("NaN"))
+        else:
+            self._step_best.append(self._series_best.result)
+
     def _update_best(self):
         self._logger.debug("Updating best candidate.")
         best_candidate = None
@@ -524,7 +676,7 @@ class Experiment(object):
 
 def from_dict(d):
     experiment_logger = logging_utils.get_logger("models.Experiment")
-    experiment_logger.log(5, "Reconstructing experiment from dict %d", d)
+    experiment_logger.log(5, "Reconstructing experiment from dict %s", d)
     name = d["name"]
     param_defs = dict_to_param_defs(d["parameter_definitions"])
     minimization_problem = d["minimization_problem"]
@@ -549,8 +701,11 @@ def from_dict(d):
     exp = Experiment(name, param_defs, exp_id, notes, minimization_problem)
 
     exp.candidates_finished = cands_finished
-    exp.candidates_pending = cands_pending
-    exp.candidates_working = exp.candidates_working
+    # Older states may not be ordered yet.
+    exp.candidates_pending = sorted(cands_pending,
+                                    key=lambda c: c.generated_time)
+    exp.candidates_working = sorted(cands_working,
+                                    key=lambda c: c.generated_time)
     exp._update_best()
     exp.last_update_time = d.get("last_update_time", time.time())
 
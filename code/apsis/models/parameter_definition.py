@@ -18,6 +18,21 @@ class ParamDef(object):
     def __init__(self):
         self._logger = logging_utils.get_logger(self)
 
+    def __getstate__(self):
+        """
+        Returns the state for pickling, without the unpicklable logger.
+        """
+        state = dict(self.__dict__)
+        state.pop("_logger", None)
+        return state
+
+    def __setstate__(self, state):
+        """
+        Restores the pickled state and recreates the logger.
+        """
+        self.__dict__.update(state)
+        self._logger = logging_utils.get_logger(self)
+
     @abstractmethod
     def is_in_parameter_domain(self, value):
         """
@@ -222,6 +237,120 @@ class NominalParamDef(ParamDef):
         return warped_size
 
 
+class EncodedNominalParamDef(NominalParamDef):
+    """
+    Defines a nominal parameter definition with a compact warping.
+
+    The one-hot warping of NominalParamDef uses one dimension per value,
+    which makes the surrogate expensive for many values. This instead warps
+    each value according to its rank in value_order, using one of the
+    following encodings:
+    "ordinal" : The rank is mapped to a single dimension, evenly spaced in
+        [0, 1].
+    "binary" : The rank is mapped to the bits of its gray code, using
+        ceil(log2(len(values))) dimensions. Neighbouring ranks differ in a
+        single bit.
+
+    Both encodings assume that values close in value_order behave similarly.
+    value_order can therefore be changed at any time, for example ordered by
+    the mean result of each value (see BayesianOptimizer). Since candidates
+    store unwarped values, warp_in and warp_out stay consistent as long as
+    the same order is used for both.
+    """
+    encoding = None
+    value_order = None
+
+    def __init__(self, values, encoding="ordinal", value_order=None):
+        """
+        Initializes the EncodedNominalParamDef.
+
+        Parameters
+        ----------
+        values : list
+            The possible values.
+        encoding : string, optional
+            Either "ordinal" (the default) or "binary".
+        value_order : list, optional
+            A permutation of values defining the rank of each value. Default
+            is the order of values.
+
+        Raises
+        ------
+        ValueError :
+            Iff values is not a non-empty list, encoding is unknown or
+            value_order is no permutation of values.
+        """
+        super(EncodedNominalParamDef, self).__init__(values)
+        if encoding not in ["ordinal", "binary"]:
+            raise ValueError("encoding must be 'ordinal' or 'binary', but is "
+                             "%s." %encoding)
+        self.encoding = encoding
+        self.set_value_order(value_order)
+
+    def set_value_order(self, value_order):
+        """
+        Sets the order of values used for warping.
+
+        Parameters
+        ----------
+        value_order : list or None
+            A permutation of values. If None, the order of values is used.
+
+        Raises
+        ------
+        ValueError :
+            Iff value_order is no permutation of values.
+        """
+        if value_order is None:
+            value_order = list(self.values)
+        if (len(value_order) != len(self.values) or
+                any(v not in value_order for v in self.values)):
+            raise ValueError("value_order %s is no permutation of values %s."
+                             %(value_order, self.values))
+        self._logger.debug("Setting value order to %s", value_order)
+        self.value_order = list(value_order)
+
+    def warp_in(self, unwarped_value):
+        self._logger.debug("Warping in %s", unwarped_value)
+        warped_value = self._encode(self.value_order.index(unwarped_value))
+        self._logger.debug("Results in %s", warped_value)
+        return warped_value
+
+    def warp_out(self, warped_value):
+        self._logger.debug("Warping out %s", warped_value)
+        warped_value = list(warped_value)
+        num_values = len(self.value_order)
+        if self.encoding == "ordinal":
+            rank = int(round(warped_value[0] * max(num_values - 1, 1)))
+            rank = min(max(rank, 0), num_values - 1)
+        else:
+            # The nearest valid code. Codes beyond the last rank are invalid.
+            distances = [sum((w - c)**2 for w, c in
+                             zip(warped_value, self._encode(i)))
+                         for i in range(num_values)]
+            rank = distances.index(min(distances))
+        unwarped_value = self.value_order[rank]
+        self._logger.debug("Results in %s", unwarped_value)
+        return unwarped_value
+
+    def warped_size(self):
+        if self.encoding == "ordinal":
+            return 1
+        return max(1, int(math.ceil(math.log(len(self.values), 2))))
+
+    def _encode(self, rank):
+        """
+        Returns the warped representation of rank.
+        """
+        if self.encoding == "ordinal":
+            if len(self.values) == 1:
+                return [0.]
+            return [float(rank) / (len(self.values) - 1)]
+        gray = rank ^ (rank >> 1)
+        size = self.warped_size()
+        return [float((gray >> (size - 1 - i)) & 1) for i in range(size)]
+
+
 class OrdinalParamDef(NominalParamDef, ComparableParamDef):
     """
     Defines an ordinal parameter definition.
@@ -1,9 +1,14 @@
 from abc import ABCMeta, abstractmethod
 import numpy as np
 import scipy.optimize
+import scipy.linalg
 from scipy.stats import multivariate_normal
 import random
+import copy
+import Queue
+from multiprocessing.pool import ThreadPool
 from apsis.utilities.logging_utils import get_logger
+from apsis.models.parameter_definition import NominalParamDef
 
 
 class AcquisitionFunction(object):
@@ -43,6 +48,10 @@ class AcquisitionFunction(object):
         returns a list of n proposals such that the probability of each
         proposal getting returned is proportional to the quality of its result.
 
+    The random searchers evaluate all their proposals at once via
+    ``evaluate_batch``. Subclasses should override it with a vectorized
+    implementation; the default falls back to calling ``evaluate`` per row.
+
     Attributes
     ----------
     _logger : logger instance
@@ -105,6 +114,35 @@ class AcquisitionFunction(object):
         """
         pass
 
+    def evaluate_batch(self, X, gp, experiment):
+        """
+        Evaluates the gp on each row of the matrix X.
+
+        This implementation calls evaluate for each row. Subclasses should
+        override it to use a single prediction call for all rows.
+
+        Parameters
+        ----------
+        X : np.array
+            An (n x d) matrix, each row being a point in the warped 0-1
+            hypercube with the parameters in order of key.
+        gp : GPy gp
+            The gp on which to evaluate
+        experiment : Experiment
+            The experiment for further information.
+
+        Returns
+        -------
+        evals : np.array
+            The vector of the n acquisition function values.
+        """
+        evals = np.zeros(X.shape[0])
+        for i in range(X.shape[0]):
+            evals[i] = self.evaluate(self._translate_vector_dict(X[i, :],
+                                                                 experiment),
+                                     gp, experiment)
+        return evals
+
     def _compute_minimizing_evaluate(self, x, gp, experiment):
         """
         One problem is that, as a standard, scipy.optimize only searches
@@ -131,6 +169,17 @@ class AcquisitionFunction(object):
             self._logger.log(5, "Is maximizing, returning %s", -value)
             return -value
 
+    def _compute_minimizing_evaluate_batch(self, X, gp, experiment):
+        """
+        The batch version of _compute_minimizing_evaluate.
+
+        Function signature is as evaluate_batch.
+        """
+        values = self.evaluate_batch(X, gp, experiment)
+        if self.minimizes:
+            return values
+        return -values
+
     def compute_proposals(self, gp, experiment, number_proposals=1,
                           return_max=True):
         """
@@ -170,8 +219,7 @@ class AcquisitionFunction(object):
         max_searcher = "none"
         multi_searcher = "none"
         if return_max:
-            max_searcher = self.params.get("max_searcher",
-                                           self.default_max_searcher)
+            max_searcher = self._get_max_searcher(experiment)
             self._logger.debug("Returning maximum. Max_searcher is %s",
                                max_searcher)
             if number_proposals > 1:
@@ -225,6 +273,15 @@ class AcquisitionFunction(object):
         self._logger.debug("Returning proposals %s", proposals)
         return proposals
 
+    def _get_max_searcher(self, experiment):
+        """
+        Returns the key of the max_searcher to use for experiment.
+
+        This is max_searcher from self.params or, if not given,
+        default_max_searcher.
+        """
+        return self.params.get("max_searcher", self.default_max_searcher)
+
     def max_searcher_random(self, gp, experiment, good_results=None):
         """
         Randomly searches the best result.
@@ -242,20 +299,10 @@ class AcquisitionFunction(object):
                                                     , 1000)
         self._logger.debug("Will generated %s random initial steps",
                            optimization_random_steps)
-        evaluated_params = []
-
-        best_param_idx = 0
-        best_score = float("inf")
-
-        for i in range(optimization_random_steps):
-            param_dict_eval = self._gen_random_prop(experiment)
-            score = self._compute_minimizing_evaluate(param_dict_eval, gp,
-                                                      experiment)
-            if score < best_score:
-                best_param_idx = i
-                best_score = score
-            evaluated_params.append((param_dict_eval, score))
-        self._logger.debug("Evaluated all steps: %s", evaluated_params)
+        evaluated_params = self._evaluate_random_props(
+            gp, experiment, optimization_random_steps)
+        self._logger.log(5, "Evaluated all steps: %s", evaluated_params)
+        best_param_idx = int(np.argmin([p[1] for p in evaluated_params]))
         max_prop = evaluated_params[best_param_idx]
         del evaluated_params[best_param_idx]
         evaluated_params.extend(good_results)
@@ -345,11 +392,8 @@ class AcquisitionFunction(object):
                        len(good_results)
         self._logger.debug("Requires %s random_steps", random_steps)
         if random_steps > 0:
-            for i in range(optimization_random_steps):
-                param_dict_eval = self._gen_random_prop(experiment)
-                score = self._compute_minimizing_evaluate(param_dict_eval, gp,
-                                                          experiment)
-                evaluated_params.append((param_dict_eval, score))
+            evaluated_params = self._evaluate_random_props(
+                gp, experiment, optimization_random_steps)
 
         evaluated_params.extend(good_results)
         evaluated_params.sort(key=lambda prop: prop[1])
@@ -357,6 +401,52 @@ class AcquisitionFunction(object):
         self._logger.log(5, "Returning %s", evaluated_params)
         return evaluated_params
 
+    def _evaluate_random_props(self, gp, experiment, number):
+        """
+        Generates and evaluates number random proposals in one batch.
+
+        Parameters
+        ----------
+        gp : GPy gp
+            The gp on which to evaluate
+        experiment : experiment
+            The experiment representing the current state.
+        number : int
+            The number of proposals to generate.
+
+        Returns
+        -------
+        evaluated_params : list of tuples
+            One (param_dict_eval, score) tuple per proposal, with score being
+            the minimizing acquisition value.
+        """
+        X = self._gen_random_matrix(experiment, number)
+        scores = self._compute_minimizing_evaluate_batch(X, gp, experiment)
+        return [(self._translate_vector_dict(X[i, :], experiment),
+                 scores[i]) for i in range(number)]
+
+    def _gen_random_matrix(self, experiment, number):
+        """
+        Generates number random points in the warped hypercube.
+
+        Parameters
+        ----------
+        experiment : experiment
+            The experiment representing the current state.
+        number : int
+            The number of points to generate.
+
+        Returns
+        -------
+        X : np.array
+            An (number x d) matrix, one point per row, with the parameters in
+            order of key.
+        """
+        dimensions = 0
+        for pdef in experiment.parameter_definitions.values():
+            dimensions += pdef.warped_size()
+        return np.random.uniform(0, 1, (number, dimensions))
+
     def _gen_random_prop(self, experiment):
         """
         Generates a single random proposal in accordance to experiment.
@@ -477,6 +567,11 @@ class GradientAcquisitionFunction(AcquisitionFunction):
     It mostly implements the compute_minimizing_gradient and the
     LBFGSB-max-searcher. This allows easily implementing any acquisition
     function with an analytical by implementing the ``gradient`` method.
+
+    If the experiment has nominal (including ordinal and position)
+    parameters and no max_searcher is set in params, the ``mixed``
+    max_searcher is used instead of ``LBFGSB``. It only scores valid
+    configurations instead of the continuous relaxation.
     """
 
     default_max_searcher = "LBFGSB"
@@ -494,6 +589,53 @@ class GradientAcquisitionFunction(AcquisitionFunction):
                                   "GradientAcquisitionFunction must implement"
                                   " the gradient method.")
 
+    def gradient_batch(self, X, gp, experiment):
+        """
+        Computes the gradient at each row of X.
+
+        This implementation calls gradient for each row; subclasses should
+        override it.
+
+        Parameters
+        ----------
+        X : np.array
+            An (n x d) matrix of points, see evaluate_batch.
+        gp : GPy gp
+            The gp on which to evaluate
+        experiment : Experiment
+            The experiment for further information.
+
+        Returns
+        -------
+        gradients : np.array
+            An (n x d) matrix, row i being the gradient at X[i].
+        """
+        gradients = np.zeros(X.shape)
+        for i in range(X.shape[0]):
+            gradients[i, :] = self.gradient(X[i, :], gp, experiment)
+        return gradients
+
+    def _get_max_searcher(self, experiment):
+        """
+        Returns the key of the max_searcher to use for experiment.
+
+        Uses ``mixed`` instead of ``LBFGSB`` as the default if experiment
+        has discrete parameters.
+        """
+        if "max_searcher" in self.params:
+            return self.params["max_searcher"]
+        if (self.default_max_searcher == "LBFGSB" and
+                self._has_discrete_params(experiment)):
+            return "mixed"
+        return self.default_max_searcher
+
+    def _has_discrete_params(self, experiment):
+        """
+        Returns whether experiment has any NominalParamDef.
+        """
+        return any(isinstance(pd, NominalParamDef) for pd in
+                   experiment.parameter_definitions.values())
+
     def _compute_minimizing_gradient(self, x, gp, experiment):
         """
         One problem is that, as a standard, scipy.optimize only searches
@@ -516,7 +658,28 @@ class GradientAcquisitionFunction(AcquisitionFunction):
 
     def max_searcher_LBFGSB(self, gp, experiment, good_results=None):
         """
-        Searches the maximum proposal via L-BFGS-B.
+        Searches the maximum proposal via multi-start L-BFGS-B.
+
+        The starting points are the best points of a batched random sweep
+        and the best finished candidates of experiment. The local searches
+        run in parallel threads, each using its own copy of gp. Optima closer
+        than merge_tolerance to a better one are merged.
+
+        Uses the following entries in self.params:
+        "num_restarts" : int, optional
+            The number of local searches. Default is 10.
+        "num_random_samples" : int, optional
+            The size of the random sweep. Default is 1000.
+        "num_best_seeds" : int, optional
+            The maximum number of best finished candidates used as starting
+            points. Default is 2.
+        "num_threads" : int, optional
+            The number of threads to run the local searches in, at most
+            num_restarts. Default is 1, since optimizers usually run on the
+            workers of an OptimizerPool, which already use the CPUs.
+        "merge_tolerance" : float, optional
+            The maximum difference per dimension in the warped hypercube for
+            two optima to be merged. Default is 1e-4.
 
         For signature see the class docs.
         """
@@ -528,42 +691,34 @@ class GradientAcquisitionFunction(AcquisitionFunction):
             bounds.extend([(0.0, 1.0) for x in range(pd.warped_size())])
         if good_results is None:
             good_results = []
-        random_prop = self._gen_random_prop(experiment)
-        random_prop_result = self._compute_minimizing_evaluate(random_prop,
-                                                               gp, experiment)
-        good_results.append((random_prop, random_prop_result))
-        self._logger.log(5, "Initialized the first good result. Is %s",
-                           good_results)
-        scipy_optimizer_results = []
-
-        random_restarts = self.params.get("num_restarts", 10)
-        self._logger.debug("Doing %s restarts", random_restarts)
-        for i in range(random_restarts):
-            self._logger.log(5, "New restart.")
-            initial_guess = self._translate_dict_vector(
-                self._gen_random_prop(experiment))
-            self._logger.log(5, "Initial guess is %s", initial_guess)
-            result = scipy.optimize.minimize(
-                self._compute_minimizing_evaluate, x0=initial_guess,
-                method="L-BFGS-B", jac=self._compute_minimizing_gradient,
-                options={'disp': False}, bounds=bounds,
-                args=tuple([gp, experiment]))
-            self._logger.log(5, "Result of optimization %s", result)
-            x_min = result.x
-            f_min = result.fun
-            success = result.success
-            self._logger.log(5, "Success: %s", success)
-            if success:
-                x_min_dict = self._translate_vector_dict(x_min, experiment)
-                if self.in_hypercube(x_min):
-                    self._logger.log(5, "Is in hypercube. Appending.")
-                    scipy_optimizer_results.append((x_min_dict, f_min))
-                else:
-                    self._logger.log(5, "Is not in hypercube. Ignoring.")
 
+        num_restarts = self.params.get("num_restarts", 10)
+        num_random_samples = max(self.params.get("num_random_samples", 1000),
+                                 num_restarts, 1)
+        X = self._gen_random_matrix(experiment, num_random_samples)
+        scores = self._compute_minimizing_evaluate_batch(X, gp, experiment)
+        order = np.argsort(scores)
+        self._logger.debug("Evaluated %s random samples.", num_random_samples)
+
+        starting_points = [X[i, :] for i in order[:num_restarts]]
+        for x_best in self._best_candidate_vectors(experiment):
+            starting_points.insert(0, np.array(x_best))
+        starting_points = starting_points[:max(num_restarts, 1)]
+
+        num_threads = min(self.params.get("num_threads", 1),
+                          len(starting_points))
+        scipy_optimizer_results = self._run_local_searches(
+            starting_points, gp, experiment, bounds, num_threads)
+        scipy_optimizer_results = self._merge_optima(
+            scipy_optimizer_results,
+            self.params.get("merge_tolerance", 1e-4))
+
+        # the best random sample is kept in case all local searches failed.
+        best_random = order[0]
+        scipy_optimizer_results.append((self._translate_vector_dict(
+            X[best_random, :], experiment), scores[best_random]))
         scipy_optimizer_results.extend(good_results)
-        best_idx = [x[1] for x in scipy_optimizer_results].index(
-            min([x[1] for x in scipy_optimizer_results]))
+        best_idx = int(np.argmin([x[1] for x in scipy_optimizer_results]))
         max_prop = scipy_optimizer_results[best_idx]
         del scipy_optimizer_results[best_idx]
         self._logger.log(5, "Extracted best. Final is max_prop %s, "
@@ -571,6 +726,304 @@ class GradientAcquisitionFunction(AcquisitionFunction):
                            scipy_optimizer_results)
         return max_prop, scipy_optimizer_results
 
+    def _best_candidate_vectors(self, experiment):
+        """
+        Returns the warped vectors of the best finished candidates.
+
+        At most num_best_seeds (from self.params, default 2) vectors are
+        returned, the best one last.
+        """
+        num_best_seeds = self.params.get("num_best_seeds", 2)
+        finished = [c for c in experiment.candidates_finished
+                    if not c.failed and c.result is not None]
+        finished.sort(key=lambda c: c.result,
+                      reverse=not experiment.minimization_problem)
+        vectors = []
+        for c in finished[:num_best_seeds]:
+            vectors.insert(0, self._translate_dict_vector(
+                experiment.warp_pt_in(c.params)))
+        return vectors
+
+    def _run_local_searches(self, starting_points, gp, experiment, bounds,
+                            num_threads):
+        """
+        Runs one L-BFGS-B search per starting point.
+
+        Parameters
+        ----------
+        starting_points : list of vectors
+            The starting points.
+        gp : GPy gp
+            The gp. Every thread uses its own copy, since predictions modify
+            the gp's caches.
+        experiment : Experiment
+            The experiment.
+        bounds : list of tuples
+            The bounds for each dimension.
+        num_threads : int
+            The number of threads to use. If 1, runs sequentially.
+
+        Returns
+        -------
+        results : list of tuples
+            One (x_min_dict, f_min) tuple per successful search whose result
+            is in the hypercube.
+        """
+        def local_search(initial_guess, thread_gp):
+            return scipy.optimize.minimize(
+                self._compute_minimizing_evaluate, x0=initial_guess,
+                method="L-BFGS-B", jac=self._compute_minimizing_gradient,
+                options={'disp': False}, bounds=bounds,
+                args=tuple([thread_gp, experiment]))
+
+        optimizer_results = self._map_with_gp_copies(
+            local_search, starting_points, gp, num_threads)
+
+        results = []
+        for result in optimizer_results:
+            self._logger.log(5, "Result of optimization %s", result)
+            if result.success and self.in_hypercube(result.x):
+                results.append((self._translate_vector_dict(result.x,
+                                                            experiment),
+                                float(result.fun)))
+        self._logger.debug("%s of %s local searches succeeded.",
+                           len(results), len(starting_points))
+        return results
+
+    def _map_with_gp_copies(self, function, items, gp, num_threads):
+        """
+        Calls function(item, thread_gp) for each of items.
+
+        Parameters
+        ----------
+        function : callable
+            The function to call.
+        items : list
+            The items to call function with.
+        gp : GPy gp
+            The gp. Every thread uses its own copy, since predictions modify
+            the gp's caches.
+        num_threads : int
+            The number of threads to use. If 1, runs sequentially on gp.
+
+        Returns
+        -------
+        results : list
+            The return values of function, in the order of items.
+        """
+        if num_threads <= 1:
+            return [function(item, gp) for item in items]
+        gp_copies = Queue.Queue()
+        for i in range(num_threads):
+            gp_copies.put(gp.copy())
+
+        def call(item):
+            thread_gp = gp_copies.get()
+            try:
+                return function(item, thread_gp)
+            finally:
+                gp_copies.put(thread_gp)
+
+        pool = ThreadPool(num_threads)
+        try:
+            return pool.map(call, items)
+        finally:
+            pool.close()
+            pool.join()
+
+    def max_searcher_mixed(self, gp, experiment, good_results=None):
+        """
+        Searches the maximum proposal over valid configurations only.
+
+        Every point scored is a valid configuration, that is each nominal
+        parameter block is the warped value of one of its values. The
+        starting points are the best of a batched random sweep of snapped
+        points and the best finished candidates. From each, the search
+        alternates L-BFGS-B over the numeric dimensions (with the discrete
+        ones fixed) with a coordinate pass that enumerates all values of
+        each discrete parameter in one batch and keeps the best, until
+        neither improves the acquisition function.
+
+        Uses the parameters of max_searcher_LBFGSB and additionally
+        "num_alternations" : int, optional
+            The maximum number of alternations per starting point. Default
+            is 5.
+
+        For signature see the class docs.
+        """
+        self._logger.debug("Searching maximum via mixed search. gp is %s, "
+                           "experiment is %s, good_results %s", gp,
+                           experiment, good_results)
+        if good_results is None:
+            good_results = []
+        layout = self._discrete_layout(experiment)
+
+        num_restarts = self.params.get("num_restarts", 10)
+        num_random_samples = max(self.params.get("num_random_samples", 1000),
+                                 num_restarts, 1)
+        X = self._snap_to_valid(
+            self._gen_random_matrix(experiment, num_random_samples), layout)
+        scores = self._compute_minimizing_evaluate_batch(X, gp, experiment)
+        order = np.argsort(scores)
+
+        starting_points = [X[i, :] for i in order[:num_restarts]]
+        for x_best in self._best_candidate_vectors(experiment):
+            starting_points.insert(0, np.array(x_best, dtype=float))
+        starting_points = starting_points[:max(num_restarts, 1)]
+
+        num_alternations = self.params.get("num_alternations", 5)
+
+        def local_search(initial_guess, thread_gp):
+            return self._mixed_local_search(initial_guess, thread_gp,
+                                            experiment, layout,
+                                            num_alternations)
+
+        num_threads = min(self.params.get("num_threads", 1),
+                          len(starting_points))
+        results = self._map_with_gp_copies(local_search, starting_points,
+                                           gp, num_threads)
+        results = self._merge_optima(
+            results, self.params.get("merge_tolerance", 1e-4))
+        results.extend(good_results)
+        best_idx = int(np.argmin([x[1] for x in results]))
+        max_prop = results[best_idx]
+        del results[best_idx]
+        return max_prop, results
+
+    def _discrete_layout(self, experiment):
+        """
+        Returns the layout of the discrete parameters in the warped vector.
+
+        Returns
+        -------
+        discrete_blocks : list of tuples
+            One (start, size, valid) tuple per NominalParamDef, with start
+            and size defining its dimensions, and valid being a matrix with
+            the warped values of all its values as rows.
+        continuous : list of ints
+            The indices of all other dimensions.
+        """
+        discrete_blocks = []
+        continuous = []
+        index = 0
+        for pn in sorted(experiment.parameter_definitions.keys()):
+            pd = experiment.parameter_definitions[pn]
+            size = pd.warped_size()
+            if isinstance(pd, NominalParamDef):
+                valid = np.array([pd.warp_in(v) for v in pd.values],
+                                 dtype=float)
+                discrete_blocks.append((index, size, valid))
+            else:
+                continuous.extend(range(index, index + size))
+            index += size
+        return discrete_blocks, continuous
+
+    def _snap_to_valid(self, X, layout):
+        """
+        Replaces each discrete block in the rows of X by its nearest valid
+        value.
+
+        Parameters
+        ----------
+        X : np.array
+            An (n x d) matrix of points.
+        layout : tuple
+            The layout as returned by _discrete_layout.
+
+        Returns
+        -------
+        X : np.array
+            The snapped (n x d) matrix.
+        """
+        X = np.array(X, dtype=float)
+        for start, size, valid in layout[0]:
+            block = X[:, start:start + size]
+            distances = ((block[:, None, :] - valid[None, :, :]) ** 2).sum(
+                axis=2)
+            X[:, start:start + size] = valid[np.argmin(distances, axis=1)]
+        return X
+
+    def _mixed_local_search(self, x0, gp, experiment, layout,
+                            num_alternations):
+        """
+        Alternates continuous and discrete local search from x0.
+
+        Returns
+        -------
+        result : tuple
+            The (x_dict, score) tuple of the local optimum.
+        """
+        discrete_blocks, continuous = layout
+        x = self._snap_to_valid(x0[None, :], layout)[0]
+        score = self._compute_minimizing_evaluate_batch(x[None, :], gp,
+                                                        experiment)[0]
+
+        def evaluate_continuous(z):
+            x_full = x.copy()
+            x_full[continuous] = z
+            return self._compute_minimizing_evaluate(x_full, gp, experiment)
+
+        def gradient_continuous(z):
+            x_full = x.copy()
+            x_full[continuous] = z
+            return np.asarray(self._compute_minimizing_gradient(
+                x_full, gp, experiment), dtype=float)[continuous]
+
+        for i in range(num_alternations):
+            if continuous:
+                result = scipy.optimize.minimize(
+                    evaluate_continuous, x0=x[continuous],
+                    method="L-BFGS-B", jac=gradient_continuous,
+                    options={'disp': False},
+                    bounds=[(0.0, 1.0)] * len(continuous))
+                if result.fun < score:
+                    x[continuous] = np.clip(result.x, 0, 1)
+                    score = float(result.fun)
+            improved = False
+            for start, size, valid in discrete_blocks:
+                neighbours = np.tile(x, (valid.shape[0], 1))
+                neighbours[:, start:start + size] = valid
+                scores = self._compute_minimizing_evaluate_batch(
+                    neighbours, gp, experiment)
+                best = int(np.argmin(scores))
+                if scores[best] < score - 1e-12:
+                    x = neighbours[best]
+                    score = scores[best]
+                    improved = True
+            if not improved:
+                break
+        return self._translate_vector_dict(x, experiment), float(score)
+
+    def _merge_optima(self, results, tolerance):
+        """
+        Merges optima closer than tolerance, keeping the better one.
+
+        Parameters
+        ----------
+        results : list of tuples
+            (x_dict, score) tuples.
+        tolerance : float
+            The maximum difference in any dimension for two optima to be
+            merged.
+
+        Returns
+        -------
+        merged : list of tuples
+            The remaining tuples, sorted by score.
+        """
+        merged = []
+        merged_vectors = []
+        for x_dict, score in sorted(results, key=lambda r: r[1]):
+            x_vec = np.array(self._translate_dict_vector(x_dict))
+            if any(np.max(np.abs(x_vec - v)) <= tolerance
+                   for v in merged_vectors):
+                continue
+            merged.append((x_dict, score))
+            merged_vectors.append(x_vec)
+        self._logger.debug("Merged %s optima into %s.", len(results),
+                           len(merged))
+        return merged
+
 
 class ExpectedImprovement(GradientAcquisitionFunction):
     """
@@ -606,22 +1059,39 @@ class ExpectedImprovement(GradientAcquisitionFunction):
         self._logger.log(5, "evaluating ExpectedImprovement on %s; gp %s,"
                            " experiment %s", x_vec, gp, experiment)
         x_value = self._translate_vector_nd_array(x_vec)
+        ei_values, ei_gradients = self._evaluate_matrix(x_value, gp,
+                                                        experiment)
+        self._logger.log(5, "ei_value, ei_gradient: %s, %s", ei_values[0],
+                           ei_gradients[0])
+        return ei_values[0], ei_gradients[0]
 
-        #mean, variance and their gradients
-        mean, variance = gp.predict(x_value)
-        gradient_mean, gradient_variance = gp.predictive_gradients(x_value)
-        self._logger.log(5, "Predicted mean/variance of %s / %s. Gradients "
-                           "are %s and %s respectively.", mean, variance,
-                           gradient_mean, gradient_variance)
-        #gpy does everythin in matrices
-        gradient_mean = gradient_mean[0]
-        #gpy returns variance in row matrices.
-        gradient_variance = np.transpose(gradient_variance)
-
-        #these values should be real scalars!
-        mean = mean[0][0]
-        variance = variance[0][0]
+    def _evaluate_matrix(self, X, gp, experiment, compute_gradient=True):
+        """
+        Evaluates expected improvement and its gradient on each row of X.
 
+        Parameters
+        ----------
+        X : np.array
+            An (n x d) matrix of points.
+        gp : GPy gp
+            The gp on which to evaluate
+        experiment : experiment
+            The experiment, used for the best result and direction.
+        compute_gradient : bool, optional
+            Whether to compute the gradients. If False, None is returned
+            instead. Default is True.
+
+        Results
+        -------
+        ei_values : np.array
+            The n values of expected improvement.
+        ei_gradients : np.array or None
+            The (n x d) matrix of gradients.
+        """
+        #mean, variance and their gradients
+        mean, variance = gp.predict(X)
+        mean = mean[:, 0]
+        variance = np.maximum(variance[:, 0], 0)
         std_dev = variance ** 0.5
 
         #Formula adopted from the phd thesis of Jasper Snoek page 48 with
@@ -638,31 +1108,77 @@ class ExpectedImprovement(GradientAcquisitionFunction):
         z_numerator = sign * (x_best - mean + self.params.get(
             "exploitation_exploration_tradeoff", 0))
 
-        ei_value = 0
-        ei_gradient = 0
-        if std_dev != 0:
-            z = float(z_numerator) / std_dev
+        nonzero = std_dev != 0
+        z = np.zeros(X.shape[0])
+        z[nonzero] = z_numerator[nonzero] / std_dev[nonzero]
+        cdf_z = scipy.stats.norm.cdf(z)
+        pdf_z = scipy.stats.norm.pdf(z)
+
+        ei_values = np.where(nonzero, z_numerator * cdf_z + std_dev * pdf_z,
+                             0)
+        if not compute_gradient:
+            return ei_values, None
+
+        gradient_mean, gradient_variance = gp.predictive_gradients(X)
+        #gpy returns the mean gradients with an additional output dimension.
+        gradient_mean = gradient_mean[:, :, 0]
+        gradient_variance = gradient_variance.reshape(X.shape)
+
+        #dEI/dmean is -sign * cdf(z), dEI/dstd_dev is pdf(z), and
+        # dstd_dev/dx is dvariance/dx / (2 std_dev).
+        half_inv_std = np.zeros(X.shape[0])
+        half_inv_std[nonzero] = 1. / (2 * std_dev[nonzero])
+        ei_gradients = (-1 * sign * gradient_mean * cdf_z[:, None] +
+                        gradient_variance * (pdf_z * half_inv_std)[:, None])
+        ei_gradients[~nonzero, :] = 0
+        return ei_values, ei_gradients
+
+    def evaluate_batch(self, X, gp, experiment):
+        """
+        Evaluates the expected improvement on each row of X, with a single
+        prediction for all rows.
+
+        Parameters
+        ----------
+        X : np.array
+            An (n x d) matrix of points, see
+            AcquisitionFunction.evaluate_batch.
+        gp : GPy gp
+            The gp on which to evaluate
+        experiment : Experiment
+            The experiment for further information.
 
-            cdf_z = scipy.stats.norm().cdf(z)
-            pdf_z = scipy.stats.norm().pdf(z)
+        Returns
+        -------
+        evals : np.array
+            The vector of the n acquisition function values.
+        """
+        values, _ = self._evaluate_matrix(X, gp, experiment,
+                                          compute_gradient=False)
+        return values
 
-            ei_value = z_numerator * cdf_z + std_dev * pdf_z
+    def gradient_batch(self, X, gp, experiment):
+        """
+        Computes the gradient of the expected improvement at each row of X,
+        with a single prediction for all rows.
 
-            #compute ei gradient
-            #new implementation based on own derivation
-            ei_gradient_part1 = (1/(2*variance)) * ei_value * gradient_variance
-            ei_gradient_part2 = -1 * sign * gradient_mean * cdf_z
-            ei_gradient_part3 = (-1 * gradient_variance * cdf_z * z *
-                                 (1/(2*std_dev)))
-            ei_gradient = (ei_gradient_part1 + ei_gradient_part2 +
-                           ei_gradient_part3)
+        Parameters
+        ----------
+        X : np.array
+            An (n x d) matrix of points, see
+            AcquisitionFunction.evaluate_batch.
+        gp : GPy gp
+            The gp on which to evaluate
+        experiment : Experiment
+            The experiment for further information.
 
-            ei_gradient = np.transpose(ei_gradient)[0]
-        else:
-            self._logger.log(5, "std_dev was 0. Returning 0, 0.")
-        self._logger.log(5, "ei_value, ei_gradient: %s, %s", ei_value,
-                           ei_gradient)
-        return ei_value, ei_gradient
+        Returns
+        -------
+        gradients : np.array
+            An (n x d) matrix, row i being the gradient at X[i].
+        """
+        _, gradients = self._evaluate_matrix(X, gp, experiment)
+        return gradients
 
     def _evaluate_vector_gradient(self, x_vec, gp, experiment):
         """
@@ -730,23 +1246,328 @@ class ProbabilityOfImprovement(AcquisitionFunction):
         """
         self._logger.log(5, "Evaluating probability of improvement. x is %s,"
                            " gp is %s, experiment %s", x, gp, experiment)
-        dimensions = len(experiment.parameter_definitions)
         x_value_vector = self._translate_dict_vector(x)
         x_value = self._translate_vector_nd_array(x_value_vector)
+        result = self.evaluate_batch(x_value, gp, experiment)[0]
+        self._logger.log(5, "Result is %s", result)
+        return result
+
+    def evaluate_batch(self, X, gp, experiment):
+        """
+        Evaluates the probability of improvement on each row of X,
+        with a single prediction for all rows.
+
+        Parameters
+        ----------
+        X : np.array
+            An (n x d) matrix of points, see
+            AcquisitionFunction.evaluate_batch.
+        gp : GPy gp
+            The gp on which to evaluate
+        experiment : Experiment
+            The experiment for further information.
 
-        mean, variance = gp.predict(x_value)
-        self._logger.log(5, "Mean and variance are %s, %s", mean, variance)
+        Returns
+        -------
+        evals : np.array
+            The vector of the n acquisition function values.
+        """
+        mean, variance = gp.predict(X)
         # do not standardize on our own, but use the mean, and covariance
         # we get from the gp
-        stdv = variance ** 0.5
+        stdv = variance[:, 0] ** 0.5
         x_best = experiment.best_candidate.result
-        z = (x_best - mean)/stdv
+        z = (x_best - mean[:, 0])/stdv
 
-        cdf = scipy.stats.norm().cdf(z)
-        result = cdf
-        self._logger.log(5, "Got cdf from scipy.stats. Result is %s", result)
+        result = scipy.stats.norm.cdf(z)
         if not experiment.minimization_problem:
-            result = 1 - cdf
-            self._logger.log(5, "We're changing because we're maximizing. New "
-                               "result is %s", result)
-        return result
\ No newline at end of file
+            result = 1 - result
+        return result
+
+
+class ThompsonSampling(GradientAcquisitionFunction):
+    """
+    Implements Thompson sampling via random Fourier features.
+
+    Instead of an analytical criterion, this acquisition function draws a
+    function from the gp posterior and proposes its optimum. Functions are
+    drawn cheaply by approximating the kernel with random Fourier features
+    (see "Random Features for Large-Scale Kernel Machines", Rahimi and
+    Recht, 2007) and sampling the weights of the resulting Bayesian linear
+    regression, as done in "Predictive Entropy Search for Efficient Global
+    Optimization of Black-box Functions", Hernandez-Lobato et al., 2014.
+    Frequencies are drawn from the kernel's spectral density, a gaussian for
+    the RBF and a student-t with five degrees of freedom for the Matern52
+    kernel.
+
+    Every proposal is the optimum of its own sample, so a batch of proposals
+    is diverse without any further penalization. The ``thompson``
+    multi_searcher maximizes the samples in parallel threads.
+
+    The value of the acquisition function is the sampled function, with its
+    sign flipped for minimization problems so that higher is always better.
+    A sample is kept until a searcher draws a new one or the gp changes.
+
+    Uses the following entries in self.params in addition to those of the
+    L-BFGS-B searcher:
+    "num_features" : int, optional
+        The number of random features. Default is 500.
+    "num_threads" : int, optional
+        The number of threads the thompson multi_searcher uses. Default is
+        1, since optimizers usually run on the workers of an OptimizerPool.
+
+    Attributes
+    ----------
+    _sample : tuple or None
+        The current sample as a tuple of the gp key it has been drawn for,
+        the frequency matrix, the phase vector, the feature scale and the
+        weight vector.
+    """
+
+    minimizes = False
+
+    default_max_searcher = "thompson"
+    default_multi_searcher = "thompson"
+
+    _sample = None
+
+    def max_searcher_thompson(self, gp, experiment, good_results=None):
+        """
+        Draws a new sample and searches its maximum via L-BFGS-B, or via the
+        mixed searcher if experiment has discrete parameters.
+
+        Since the scores of other optima are only valid for this sample, no
+        good results are returned.
+
+        For signature see the class docs.
+        """
+        self._draw_sample(gp)
+        if self._has_discrete_params(experiment):
+            max_prop, _ = self.max_searcher_mixed(gp, experiment)
+        else:
+            max_prop, _ = self.max_searcher_LBFGSB(gp, experiment)
+        return max_prop, None
+
+    def multi_searcher_thompson(self, gp, experiment, good_results=None,
+                                number_proposals=1):
+        """
+        Returns the maxima of number_proposals independent samples.
+
+        Each sample is maximized by a copy of this acquisition function,
+        the copies running in up to num_threads threads. good_results are
+        ignored, since they have been scored on another sample.
+
+        For signature see the class docs.
+        """
+        self._logger.debug("Searching %s thompson samples.", number_proposals)
+        if number_proposals <= 0:
+            return [], None
+        num_threads = min(self.params.get("num_threads", 1),
+                          number_proposals)
+
+        def search_sample(i):
+            sampler = copy.copy(self)
+            sampler.params = dict(self.params)
+            sampler.params["num_threads"] = 1
+            sampler._sample = None
+            max_prop, _ = sampler.max_searcher_thompson(gp, experiment)
+            return max_prop
+
+        if num_threads <= 1:
+            proposals = [search_sample(i) for i in range(number_proposals)]
+        else:
+            pool = ThreadPool(num_threads)
+            try:
+                proposals = pool.map(search_sample, range(number_proposals))
+            finally:
+                pool.close()
+                pool.join()
+        return proposals, None
+
+    def _draw_sample(self, gp):
+        """
+        Draws a new function sample from the posterior of gp.
+
+        Parameters
+        ----------
+        gp : GPy gp
+            The gp to sample from. Its kernel must be a Matern52 or RBF
+            kernel, and its likelihood gaussian.
+
+        Raises
+        ------
+        ValueError
+            Iff the kernel of gp is not supported.
+        """
+        num_features = self.params.get("num_features", 500)
+        X = np.asarray(gp.X)
+        Y = np.asarray(gp.Y)[:, 0]
+        dimensions = X.shape[1]
+        kernel_name = type(gp.kern).__name__
+        lengthscale = np.asarray(gp.kern.lengthscale.values, dtype=float)
+        variance = float(gp.kern.variance.values[0])
+        noise = max(float(gp.likelihood.variance.values[0]), 1e-10)
+
+        W = np.random.normal(0, 1, (num_features, dimensions)) / lengthscale
+        if kernel_name == "Matern52":
+            # A student-t is a gaussian with chi-squared scaled variance.
+            df = 5
+            W *= np.sqrt(df / np.random.chisquare(df, (num_features, 1)))
+        elif kernel_name != "RBF":
+            raise ValueError("ThompsonSampling supports Matern52 and RBF "
+                             "kernels, but the kernel is %s." %kernel_name)
+        b = np.random.uniform(0, 2 * np.pi, num_features)
+        scale = np.sqrt(2. * variance / num_features)
+
+        # Posterior of the weights with a standard normal prior is
+        # N(A^-1 Phi^T y / noise, A^-1) with A = Phi^T Phi / noise + I.
+        phi = scale * np.cos(X.dot(W.T) + b)
+        A = phi.T.dot(phi) / noise + np.eye(num_features)
+        L = scipy.linalg.cholesky(A, lower=True)
+        mean = scipy.linalg.cho_solve((L, True), phi.T.dot(Y) / noise)
+        z = np.random.normal(0, 1, num_features)
+        theta = mean + scipy.linalg.solve_triangular(L, z, lower=True,
+                                                     trans="T")
+        self._sample = (self._gp_key(gp), W, b, scale, theta)
+        self._logger.debug("Drew thompson sample with %s features from a %s "
+                           "kernel.", num_features, kernel_name)
+
+    def _gp_key(self, gp):
+        """
+        Returns a key identifying the data and hyperparameters of gp.
+
+        Copies of a gp share the key, so threads using copies share samples.
+        """
+        return (np.asarray(gp.X).tostring(),
+                np.asarray(gp.param_array).tostring())
+
+    def _get_sample(self, gp):
+        """
+        Returns the current sample, drawing a new one if gp changed.
+        """
+        sample = self._sample
+        if sample is None or sample[0] != self._gp_key(gp):
+            self._draw_sample(gp)
+            sample = self._sample
+        return sample
+
+    def _evaluate_matrix(self, X, gp, experiment, compute_gradient=True):
+        """
+        Evaluates the sample and its gradient on each row of X.
+
+        Parameters
+        ----------
+        X : np.array
+            An (n x d) matrix of points.
+        gp : GPy gp
+            The gp the sample is drawn from.
+        experiment : experiment
+            The experiment, used for the direction.
+        compute_gradient : bool, optional
+            Whether to compute the gradients. If False, None is returned
+            instead. Default is True.
+
+        Results
+        -------
+        values : np.array
+            The n values of the sample, negated for minimization problems.
+        gradients : np.array or None
+            The (n x d) matrix of gradients.
+        """
+        _, W, b, scale, theta = self._get_sample(gp)
+        sign = 1
+        if experiment.minimization_problem:
+            sign = -1
+        projection = X.dot(W.T) + b
+        values = sign * scale * np.cos(projection).dot(theta)
+        if not compute_gradient:
+            return values, None
+        gradients = -sign * scale * (np.sin(projection) * theta).dot(W)
+        return values, gradients
+
+    def evaluate_batch(self, X, gp, experiment):
+        """
+        Evaluates the sampled function on each row of X, with a single
+        prediction for all rows.
+
+        Parameters
+        ----------
+        X : np.array
+            An (n x d) matrix of points, see
+            AcquisitionFunction.evaluate_batch.
+        gp : GPy gp
+            The gp on which to evaluate
+        experiment : Experiment
+            The experiment for further information.
+
+        Returns
+        -------
+        evals : np.array
+            The vector of the n acquisition function values.
+        """
+        values, _ = self._evaluate_matrix(X, gp, experiment,
+                                          compute_gradient=False)
+        return values
+
+    def gradient_batch(self, X, gp, experiment):
+        """
+        Computes the gradient of the sampled function at each row of X,
+        with a single prediction for all rows.
+
+        Parameters
+        ----------
+        X : np.array
+            An (n x d) matrix of points, see
+            AcquisitionFunction.evaluate_batch.
+        gp : GPy gp
+            The gp on which to evaluate
+        experiment : Experiment
+            The experiment for further information.
+
+        Returns
+        -------
+        gradients : np.array
+            An (n x d) matrix, row i being the gradient at X[i].
+        """
+        _, gradients = self._evaluate_matrix(X, gp, experiment)
+        return gradients
+
+    def evaluate(self, x, gp, experiment):
+        """
+        Evaluates the current sample at x.
+
+        Parameters
+        ----------
+        x : dict or vector
+            The point, as a parameter dictionary or a vector in the warped
+            0-1 hypercube.
+        gp : GPy gp
+            The gp on which to evaluate
+        experiment : Experiment
+            The experiment for further information.
+
+        Returns
+        -------
+        eval : float
+            The value of the sampled function at x.
+        """
+        if isinstance(x, dict):
+            x = self._translate_dict_vector(x)
+        x_value = self._translate_vector_nd_array(x)
+        return float(self.evaluate_batch(x_value, gp, experiment)[0])
+
+    def gradient(self, x, gp, experiment):
+        """
+        Computes the gradient of the current sample at x.
+
+        Signature is the same as evaluate.
+
+        Returns
+        -------
+        gradient : vector
+            The gradient of the sampled function at x.
+        """
+        if isinstance(x, dict):
+            x = self._translate_dict_vector(x)
+        x_value = self._translate_vector_nd_array(x)
+        return self.gradient_batch(x_value, gp, experiment)[0]
@@ -7,7 +7,10 @@ from apsis.utilities.randomization import check_random_state
 from apsis.models.candidate import Candidate
 from apsis.optimizers.bayesian.acquisition_functions import *
 from apsis.utilities.acquisition_utils import check_acquisition
+from apsis.utilities.file_utils import write_json_atomic
 import GPy
+import os
+import json
 import apsis.utilities.acquisition_utils as acq_utils
 
 
@@ -41,6 +44,42 @@ class BayesianOptimizer(Optimizer):
     num_gp_restarts : int
         GPy's optimization requires restarts to find a good solution. This
         parameter controls this. Default is 10.
+    warm_start_data : list of tuples
+        One (candidate_matrix, results_vector) tuple per source experiment
+        used for warm starting. These are kept separate from the own
+        experiment's results and only added (each shifted to the mean of the
+        own results) when fitting the gp.
+    warm_start_best : dict or None
+        The parameters of the best source candidate, evaluated first if
+        warm starting. None if not warm starting or once it has been
+        returned.
+    rescore_threshold : float
+        Candidates re-scored after an update are kept iff their acquisition
+        value falls short of the current maximum of the acquisition function
+        by at most (1 - rescore_threshold) times its absolute value. For a
+        positive maximum, that is at least rescore_threshold times the
+        maximum. Default is 0.1.
+    num_precomputed : int
+        The number of proposals kept precomputed in _proposal_pool. If 0
+        (the default), no pool is used.
+    _proposal_pool : list of tuples
+        The precomputed proposals as (warped vector, score) tuples, where the
+        score is the minimizing acquisition value under the current gp. The
+        list is sorted worst first, so that the best proposal can be popped
+        from the end.
+    order_encoded_values : bool
+        Whether to reorder the values of every EncodedNominalParamDef by
+        their mean result before each refit. Default is True.
+    _warm_start_sources : list of Experiments or None
+        The source experiments, kept to recompute warm_start_data when the
+        warping changes.
+    checkpoint_dir : string or None
+        The directory the fitted kernel hyperparameters are written to after
+        each refit, as surrogate_state.json. If None, no checkpoints are
+        written.
+    _checkpoint_loaded : bool
+        Whether the checkpoint has already been looked for. It is only used
+        for the first refit.
     logger: logger
         The logger instance for this object.
     """
@@ -58,6 +97,20 @@ class BayesianOptimizer(Optimizer):
     initial_random_runs = 10
     num_gp_restarts = 10
 
+    warm_start_data = None
+    warm_start_best = None
+
+    rescore_threshold = 0.1
+
+    num_precomputed = 0
+    _proposal_pool = None
+
+    order_encoded_values = True
+    _warm_start_sources = None
+
+    checkpoint_dir = None
+    _checkpoint_loaded = False
+
     name = "BayOpt"
     return_max = True
 
@@ -72,7 +125,7 @@ class BayesianOptimizer(Optimizer):
             Sets the possible arguments for this optimizer. Available are:
             "initial_random_runs" : int, optional
                 The number of initial random runs before using the GP. Default
-                is 10.
+                is 10, or 1 if warm starting.
             "random_state" : scipy random state, optional
                 The scipy random state or object to initialize one. Default is
                 None.
@@ -86,7 +139,25 @@ class BayesianOptimizer(Optimizer):
                 ExpectedImprovement.
             "num_precomputed" : int
                 The number of points that should be kept precomputed for faster
-                multiple workers.
+                multiple workers. On update, these are re-scored under the new
+                gp instead of being discarded. Default is 0.
+            "rescore_threshold" : float, optional
+                The relative acquisition value below which queued
+                candidates are dropped after an update. Default is 0.1.
+            "warm_start_experiments" : list of Experiments, optional
+                Related experiments with the same parameter names and
+                optimization direction whose finished candidates are used to
+                seed the gp. The first candidate is the best source candidate.
+                Set by the ExperimentAssistant, not persisted.
+            "order_encoded_values" : bool, optional
+                Whether to order the values of EncodedNominalParamDefs by
+                their mean result, so that similar values are warped close to
+                each other. Default is True.
+            "checkpoint_dir" : string, optional
+                The directory to checkpoint the fitted kernel hyperparameters
+                to. If a checkpoint exists there, the first refit restores it
+                instead of running all gp restarts. Set by the
+                ExperimentAssistant to its write_dir, not persisted.
         """
         self._logger = get_logger(self)
         self._logger.debug("Initializing bayesian optimizer. Experiment is %s,"
@@ -104,6 +175,14 @@ class BayesianOptimizer(Optimizer):
             'acquisition_hyperparams', None)
         self.num_gp_restarts = optimizer_params.get(
             'num_gp_restarts', self.num_gp_restarts)
+        self.num_precomputed = optimizer_params.get(
+            'num_precomputed', self.num_precomputed)
+        self._proposal_pool = []
+        self.rescore_threshold = optimizer_params.get(
+            'rescore_threshold', self.rescore_threshold)
+        self.order_encoded_values = optimizer_params.get(
+            'order_encoded_values', self.order_encoded_values)
+        self.checkpoint_dir = optimizer_params.get("checkpoint_dir", None)
 
         self._logger.debug("Initialized relevant parameters. "
                            "initial_random_runs is %s, random_state is %s, "
@@ -135,14 +214,28 @@ class BayesianOptimizer(Optimizer):
         self._logger.debug("Initialized required RandomSearcher; is %s",
                            self.random_searcher)
         Optimizer.__init__(self, experiment, optimizer_params)
+        self._init_warm_start(optimizer_params.get("warm_start_experiments",
+                                                   None))
+        if (self.warm_start_data and
+                "initial_random_runs" not in optimizer_params):
+            self.initial_random_runs = 1
         self._logger.debug("Finished initializing bayOpt.")
 
-    def get_next_candidates(self, num_candidates=1):
+    def get_next_candidates(self, num_candidates=1, timeout=None):
         self._logger.debug("Returning next %s candidates", num_candidates)
         if len(self._experiment.candidates_finished) < self.initial_random_runs:
             # we do a random search.
             random_candidates = self.random_searcher.get_next_candidates(
                 num_candidates)
+            if (self.warm_start_best is not None and
+                    not self._experiment.candidates_finished and
+                    not self._experiment.candidates_working and
+                    not self._experiment.candidates_pending):
+                self._logger.debug("Starting with the best source candidate "
+                                   "%s", self.warm_start_best)
+                random_candidates[0] = Candidate(dict(self.warm_start_best))
+                # It is only evaluated once.
+                self.warm_start_best = None
             self._logger.debug("Still in the random run phase. Returning %s",
                                random_candidates)
             return random_candidates
@@ -152,6 +245,9 @@ class BayesianOptimizer(Optimizer):
                                self._experiment)
             self.update(self._experiment)
 
+        if self.num_precomputed > 0:
+            return self._get_candidates_from_pool(num_candidates)
+
         new_candidate_points = self.acquisition_function.compute_proposals(
             self.gp, self._experiment, number_proposals=num_candidates,
             return_max=self.return_max
@@ -178,9 +274,13 @@ class BayesianOptimizer(Optimizer):
             return
 
         self.return_max = True
+        if self.order_encoded_values:
+            self._order_encoded_values()
 
         candidate_matrix, results_vector = acq_utils.create_cand_matrix_vector(
             experiment, self.treat_failed)
+        candidate_matrix, results_vector = self._add_warm_start_data(
+            candidate_matrix, results_vector)
 
         self.kernel = self._check_kernel(self.kernel, candidate_matrix.shape[1],
                                          kernel_params=self.kernel_params)
@@ -192,10 +292,314 @@ class BayesianOptimizer(Optimizer):
                                           self.kernel)
         self.gp.constrain_positive("*")
         self.gp.constrain_bounded(0.1, 1, warning=False)
-        self._logger.debug("Starting gp optimize.")
-        self.gp.optimize_restarts(num_restarts=self.num_gp_restarts,
-                                  verbose=False)
-        self._logger.debug("gp optimize finished.")
+        checkpoint = self._load_checkpoint()
+        if checkpoint is not None and self._restore_checkpoint(checkpoint):
+            if checkpoint["num_data"] != candidate_matrix.shape[0]:
+                self._logger.debug("Data changed since the checkpoint. "
+                                   "Optimizing once from the checkpoint.")
+                self.gp.optimize()
+        else:
+            self._logger.debug("Starting gp optimize.")
+            self.gp.optimize_restarts(num_restarts=self.num_gp_restarts,
+                                      verbose=False)
+            self._logger.debug("gp optimize finished.")
+        self._write_checkpoint(candidate_matrix.shape[0])
+        self._rescore_proposal_pool()
+
+    def _checkpoint_file(self):
+        """
+        Returns the path of the checkpoint file.
+        """
+        return os.path.join(self.checkpoint_dir, "surrogate_state.json")
+
+    def _load_checkpoint(self):
+        """
+        Loads the checkpoint on the first call only.
+
+        Returns
+        -------
+        checkpoint : dict or None
+            The checkpoint, or None if there is none, it is unreadable or
+            this is not the first call.
+        """
+        if self._checkpoint_loaded or self.checkpoint_dir is None:
+            return None
+        self._checkpoint_loaded = True
+        if not os.path.isfile(self._checkpoint_file()):
+            return None
+        try:
+            with open(self._checkpoint_file(), "r") as infile:
+                checkpoint = json.load(infile)
+        except (IOError, ValueError) as e:
+            self._logger.warning("Could not load checkpoint %s: %s",
+                                 self._checkpoint_file(), e)
+            return None
+        self._logger.debug("Loaded checkpoint %s", checkpoint)
+        return checkpoint
+
+    def _restore_checkpoint(self, checkpoint):
+        """
+        Sets the gp's hyperparameters to those of checkpoint.
+
+        Returns
+        -------
+        restored : bool
+            False iff the checkpoint does not fit the kernel of the gp.
+        """
+        param_array = np.array(checkpoint.get("param_array", []))
+        if (checkpoint.get("kernel") != type(self.gp.kern).__name__ or
+                param_array.shape != self.gp.param_array.shape):
+            self._logger.debug("Checkpoint does not match the gp. Ignoring.")
+            return False
+        self.gp[:] = param_array
+        return True
+
+    def _write_checkpoint(self, num_data):
+        """
+        Atomically writes the gp's hyperparameters to the checkpoint file.
+
+        Parameters
+        ----------
+        num_data : int
+            The number of data points the gp has been fitted on.
+        """
+        if self.checkpoint_dir is None:
+            return
+        self._checkpoint_loaded = True
+        checkpoint = {
+            "kernel": type(self.gp.kern).__name__,
+            "param_array": [float(p) for p in self.gp.param_array],
+            "num_data": num_data
+        }
+        write_json_atomic(self._checkpoint_file(), checkpoint)
+
+    def _get_candidates_from_pool(self, num_candidates):
+        """
+        Returns num_candidates candidates from the proposal pool.
+
+        The pool is refilled if it contains fewer than num_candidates
+        proposals, or if the maximum of the acquisition function has not
+        been searched for since the last update.
+
+        Parameters
+        ----------
+        num_candidates : int
+            The number of candidates to return.
+
+        Returns
+        -------
+        candidates : list of Candidates
+            The best proposals of the pool.
+        """
+        if self.return_max or len(self._proposal_pool) < num_candidates:
+            number_proposals = max(self.num_precomputed + num_candidates -
+                                   len(self._proposal_pool), 1)
+            new_proposals = self.acquisition_function.compute_proposals(
+                self.gp, self._experiment, number_proposals=number_proposals,
+                return_max=True)
+            self.return_max = False
+            for x_dict, score in new_proposals:
+                self._proposal_pool.append((np.array(
+                    self.acquisition_function._translate_dict_vector(x_dict)),
+                    float(score)))
+            self._proposal_pool.sort(key=lambda p: p[1], reverse=True)
+            self._logger.debug("Refilled proposal pool with %s proposals.",
+                               len(new_proposals))
+        candidates = []
+        while self._proposal_pool and len(candidates) < num_candidates:
+            x_vec, score = self._proposal_pool.pop()
+            candidates.append(Candidate(self._experiment.warp_pt_out(
+                self.acquisition_function._translate_vector_dict(
+                    x_vec, self._experiment))))
+        # Keep only the best num_precomputed proposals.
+        del self._proposal_pool[:-self.num_precomputed]
+        self._logger.debug("Returning %s candidates from the pool; %s remain.",
+                           len(candidates), len(self._proposal_pool))
+        return candidates
+
+    def _rescore_proposal_pool(self):
+        """
+        Re-scores the proposal pool under the current gp in one batch.
+        """
+        if not self._proposal_pool:
+            return
+        X = np.vstack([p[0] for p in self._proposal_pool])
+        scores = self.acquisition_function._compute_minimizing_evaluate_batch(
+            X, self.gp, self._experiment)
+        self._proposal_pool = [(X[i, :], float(scores[i]))
+                               for i in range(X.shape[0])]
+        self._proposal_pool.sort(key=lambda p: p[1], reverse=True)
+        self._logger.debug("Re-scored %s pooled proposals.",
+                           len(self._proposal_pool))
+
+    def rescore_candidates(self, candidates):
+        """
+        Re-scores candidates under the current gp in one batch.
+
+        The candidates are compared to the current maximum of the
+        acquisition function (see _current_max_value), and kept iff they
+        fall short of it by at most (1 - rescore_threshold) times its
+        absolute value. They are returned best first. Before the gp is used,
+        all random candidates are kept.
+        """
+        if (self.gp is None or len(self._experiment.candidates_finished) <
+                self.initial_random_runs):
+            return list(candidates)
+        if not candidates:
+            return []
+        X = np.array([self.acquisition_function._translate_dict_vector(
+            self._experiment.warp_pt_in(c.params)) for c in candidates])
+        values = -self.acquisition_function._compute_minimizing_evaluate_batch(
+            X, self.gp, self._experiment).flatten()
+        order = np.argsort(-values)
+        best = self._current_max_value()
+        if best is None:
+            return [candidates[i] for i in order]
+        threshold = best - (1 - self.rescore_threshold) * abs(best)
+        kept = []
+        for i in order:
+            if values[i] < threshold:
+                break
+            kept.append(candidates[i])
+        self._logger.debug("Re-scored %s candidates; current maximum is %s, "
+                           "kept %s.", len(candidates), best, len(kept))
+        return kept
+
+    def _current_max_value(self):
+        """
+        Returns the maximum of the acquisition function under the current gp.
+
+        This is the value of the best pooled proposal, which has been
+        re-scored on update. Without a pool, the maximum is searched for
+        once.
+
+        Returns
+        -------
+        max_value : float or None
+            The maximum acquisition value found, or None if no proposal could
+            be computed.
+        """
+        if self._proposal_pool:
+            return -self._proposal_pool[-1][1]
+        proposals = self.acquisition_function.compute_proposals(
+            self.gp, self._experiment, number_proposals=1, return_max=True)
+        if not proposals:
+            return None
+        x_dict, score = proposals[0]
+        if self.num_precomputed > 0:
+            # Keep the search's result for the next candidates.
+            self._proposal_pool.append((np.array(
+                self.acquisition_function._translate_dict_vector(x_dict)),
+                float(score)))
+        return -float(score)
+
+    def _init_warm_start(self, source_experiments):
+        """
+        Extracts the warm start data from source_experiments.
+
+        Parameters
+        ----------
+        source_experiments : list of Experiments or None
+            The experiments to warm start from.
+        """
+        self.warm_start_data = []
+        self.warm_start_best = None
+        self._warm_start_sources = source_experiments
+        if not source_experiments:
+            return
+        best_result = None
+        for source in source_experiments:
+            cand_matrix, results_vector = \
+                acq_utils.create_warm_start_matrix_vector(self._experiment,
+                                                          source)
+            if cand_matrix.shape[0] == 0:
+                self._logger.debug("Source %s has no usable candidates.",
+                                   source.exp_id)
+                continue
+            self.warm_start_data.append((cand_matrix, results_vector))
+            if self._experiment.minimization_problem:
+                idx = np.argmin(results_vector)
+            else:
+                idx = np.argmax(results_vector)
+            result = results_vector[idx, 0]
+            if (best_result is None or
+                    (self._experiment.minimization_problem and
+                     result < best_result) or
+                    (not self._experiment.minimization_problem and
+                     result > best_result)):
+                best_result = result
+                vector = cand_matrix[idx, :]
+                self.warm_start_best = self._experiment.warp_pt_out(
+                    self.acquisition_function._translate_vector_dict(
+                        vector, self._experiment))
+        self._logger.debug("Initialized warm start from %s source experiments "
+                           "with %s candidates. Best is %s",
+                           len(self.warm_start_data),
+                           sum(d[0].shape[0] for d in self.warm_start_data),
+                           self.warm_start_best)
+
+    def _order_encoded_values(self):
+        """
+        Orders the values of each EncodedNominalParamDef by mean result.
+
+        Values are ordered best first. Values without a finished, successful
+        candidate keep their relative order after those with one. If any
+        order changes, the warped proposal pool and warm start data are
+        invalid and are discarded and recomputed respectively.
+        """
+        changed = False
+        finished = [c for c in self._experiment.candidates_finished
+                    if not c.failed and c.result is not None]
+        for name, pd in self._experiment.parameter_definitions.iteritems():
+            if not isinstance(pd, EncodedNominalParamDef):
+                continue
+            results = {}
+            for c in finished:
+                results.setdefault(c.params[name], []).append(c.result)
+            means = dict((v, np.mean(r)) for v, r in results.iteritems())
+            ordered = sorted([v for v in pd.value_order if v in means],
+                             key=lambda v: means[v],
+                             reverse=not self._experiment.minimization_problem)
+            ordered.extend(v for v in pd.value_order if v not in means)
+            if ordered != pd.value_order:
+                self._logger.debug("Reordering values of %s to %s", name,
+                                   ordered)
+                pd.set_value_order(ordered)
+                changed = True
+        if changed:
+            self._proposal_pool = []
+            if self._warm_start_sources:
+                self._init_warm_start(self._warm_start_sources)
+
+    def _add_warm_start_data(self, candidate_matrix, results_vector):
+        """
+        Stacks the warm start data below the own candidates and results.
+
+        Every source's results are shifted so that their mean equals the mean
+        of the own results. This is a per-experiment offset, which transfers
+        the shape of the response surface instead of its absolute values.
+
+        Parameters
+        ----------
+        candidate_matrix : np.array
+            The own candidates, one row each. Must have at least one row.
+        results_vector : np.array
+            The own results.
+
+        Returns
+        -------
+        candidate_matrix, results_vector : np.arrays
+            The stacked candidates and results.
+        """
+        if not self.warm_start_data:
+            return candidate_matrix, results_vector
+        own_mean = np.mean(results_vector)
+        matrices = [candidate_matrix]
+        vectors = [results_vector]
+        for source_matrix, source_vector in self.warm_start_data:
+            matrices.append(source_matrix)
+            vectors.append(source_vector - np.mean(source_vector) + own_mean)
+        return np.vstack(matrices), np.vstack(vectors)
 
     def _check_kernel(self, kernel, dimension, kernel_params):
         """
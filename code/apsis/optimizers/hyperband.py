@@ -0,0 +1,333 @@
+__author__ = 'Frederik Diehl'
+
+from apsis.optimizers.optimizer import Optimizer
+from apsis.optimizers.random_search import RandomSearch
+from apsis.models.parameter_definition import *
+from apsis.models.candidate import Candidate
+from apsis.utilities.logging_utils import get_logger
+import numpy as np
+import math
+
+
+class Hyperband(Optimizer):
+    """
+    This implements an asynchronous variant of Hyperband.
+
+    Hyperband (see "Hyperband: A Novel Bandit-Based Approach to
+    Hyperparameter Optimization", Li et al., 2016) runs several brackets of
+    successive halving. Each bracket starts its configurations at a different
+    rung, that is with a different resource budget, and promotes the best
+    1/eta of each rung to the next rung, whose budget is eta times larger.
+    Promotions happen asynchronously (as in "Massively Parallel
+    Hyperparameter Tuning", Li et al., 2018) as soon as a candidate belongs
+    to the top 1/eta of the results reported for its rung, so no worker has
+    to wait for a rung to be complete.
+
+    Candidates are handed out with their budget set. A worker evaluates a
+    candidate up to candidate.budget, then reports the result with a
+    "pausing" update (storing whatever it needs for resuming in
+    worker_information) or, if the budget is max_budget, with a "finished"
+    update. Promoted candidates are handed out again with the same cand_id,
+    params and worker_information, but a larger budget. Candidates paused
+    before reaching their budget are resumed with the same budget.
+
+    The result at a rung is the intermediate result reported at the rung's
+    budget (see ExperimentAssistant.update). A candidate belongs to the
+    bracket of the smallest rung it reported a result at.
+
+    Attributes
+    ----------
+    SUPPORTED_PARAM_TYPES : list of ParamDefs
+        The supported parameter types. Supports every type RandomSearch
+        supports.
+    handles_pausing : bool
+        True, since paused candidates must only be resumed when promoted.
+    min_budget : float
+        The smallest budget a candidate is evaluated with.
+    max_budget : float
+        The largest budget a candidate is evaluated with.
+    eta : float
+        The factor between the budgets of subsequent rungs. Also, 1/eta of
+        each rung is promoted.
+    rung_budgets : list of floats
+        The budgets of all rungs, in increasing order. The last one is
+        max_budget.
+    random_searcher : RandomSearch
+        The random search used to generate new configurations.
+    _issued : set of strings
+        The cand_ids of paused candidates issued which the experiment does
+        not show as working or finished yet. Used to avoid issuing the same
+        candidate twice.
+    """
+    SUPPORTED_PARAM_TYPES = [NominalParamDef, NumericParamDef]
+
+    name = "Hyperband"
+    handles_pausing = True
+
+    min_budget = None
+    max_budget = None
+    eta = None
+    rung_budgets = None
+
+    random_searcher = None
+    _issued = None
+
+    def __init__(self, experiment, optimizer_params=None):
+        """
+        Initializes the Hyperband optimizer.
+
+        Parameters
+        ----------
+        experiment : Experiment
+            The experiment representing the current state of the execution.
+        optimizer_params : dict, optional
+            Dictionary of the optimizer parameters. If None, some standard
+            parameters will be assumed.
+            Available parameters are
+            "min_budget" : float, optional
+                The smallest budget. Default is 1.
+            "max_budget" : float, optional
+                The largest budget. Default is 81.
+            "eta" : float, optional
+                The reduction factor between rungs. Default is 3.
+            "random_state" : randomstate, optional
+                The random state to use. See numpy random states.
+
+        Raises
+        ------
+        ValueError
+            Iff the experiment is not supported, or the budgets or eta are
+            invalid.
+        """
+        self._logger = get_logger(self)
+        self._logger.debug("Initializing hyperband. experiment is %s, "
+                           "optimizer_params %s", experiment, optimizer_params)
+        if optimizer_params is None:
+            optimizer_params = {}
+        self.min_budget = optimizer_params.get("min_budget", 1)
+        self.max_budget = optimizer_params.get("max_budget", 81)
+        self.eta = optimizer_params.get("eta", 3)
+        if not 0 < self.min_budget <= self.max_budget:
+            raise ValueError("Budgets must fulfill 0 < min_budget <= "
+                             "max_budget, but min_budget is %s and max_budget "
+                             "%s." %(self.min_budget, self.max_budget))
+        if not self.eta > 1:
+            raise ValueError("eta must be greater than 1, but is %s."
+                             %self.eta)
+        num_rungs = int(math.floor(
+            math.log(float(self.max_budget) / self.min_budget) /
+            math.log(self.eta) + 1e-9)) + 1
+        self.rung_budgets = [self.max_budget * float(self.eta) **
+                             (k - num_rungs + 1) for k in range(num_rungs)]
+        self._issued = set()
+        self._logger.debug("Rung budgets are %s", self.rung_budgets)
+
+        self.random_searcher = RandomSearch(experiment, optimizer_params)
+        Optimizer.__init__(self, experiment, optimizer_params)
+        self._logger.debug("Finished initializing hyperband.")
+
+    def update(self, experiment):
+        """
+        Updates the experiment.
+
+        Issued candidates which the new experiment shows as working or
+        finished are removed from the record of issued candidates. The
+        others may not have reached the experiment yet, and stay recorded.
+        """
+        Optimizer.update(self, experiment)
+        self.random_searcher.update(experiment)
+        self._issued.difference_update(
+            c.cand_id for c in experiment.candidates_working +
+            experiment.candidates_finished)
+
+    def rescore_candidates(self, candidates):
+        """
+        Discards all candidates, which may be issued again.
+        """
+        for c in candidates:
+            self._issued.discard(c.cand_id)
+        return []
+
+    def get_next_candidates(self, num_candidates=1, timeout=None):
+        """
+        Returns up to num_candidates candidates.
+
+        Resumptions of interrupted candidates are returned first, then
+        promotions of paused candidates, best first. The remaining candidates
+        are new configurations, each assigned to the bracket with the fewest
+        started configurations relative to its size.
+        """
+        self._logger.debug("Returning next %s candidates", num_candidates)
+        started = self._started_per_bracket()
+        candidates = self._get_resumptions(num_candidates, started)
+        candidates.extend(self._get_promotions(
+            num_candidates - len(candidates)))
+        while len(candidates) < num_candidates:
+            bracket = self._choose_bracket(started)
+            started[bracket] += 1
+            new_cand = self.random_searcher.get_next_candidates(1)[0]
+            new_cand.budget = self.rung_budgets[bracket]
+            candidates.append(new_cand)
+        self._logger.debug("Generated candidates %s", candidates)
+        return candidates
+
+    def _rung_index(self, budget):
+        """
+        Returns the index of the rung with budget, or None if there is none.
+        """
+        if budget is None:
+            return None
+        for k, b in enumerate(self.rung_budgets):
+            if np.isclose(b, budget):
+                return k
+        return None
+
+    def _bracket(self, candidate):
+        """
+        Returns the bracket of candidate, that is the index of its first rung.
+
+        This is the rung of the first intermediate result reported at a rung
+        budget or, if there is none, the rung of the current budget.
+        """
+        for step, _ in candidate.intermediate_results:
+            k = self._rung_index(step)
+            if k is not None:
+                return k
+        return self._rung_index(candidate.budget)
+
+    def _rung_result(self, candidate, k):
+        """
+        Returns the result candidate reported at rung k, or None.
+        """
+        for step, result in candidate.intermediate_results:
+            if self._rung_index(step) == k:
+                return result
+        if k == len(self.rung_budgets) - 1 and not candidate.failed:
+            return candidate.result
+        return None
+
+    def _bracket_size(self, bracket):
+        """
+        Returns the number of configurations the bracket starts with.
+        """
+        s = len(self.rung_budgets) - 1 - bracket
+        return int(math.ceil(float(len(self.rung_budgets)) / (s + 1) *
+                             self.eta ** s))
+
+    def _started_per_bracket(self):
+        """
+        Returns the number of configurations started in each bracket.
+        """
+        started = [0] * len(self.rung_budgets)
+        for c in (self._experiment.candidates_pending +
+                  self._experiment.candidates_working +
+                  self._experiment.candidates_finished):
+            bracket = self._bracket(c)
+            if bracket is not None:
+                started[bracket] += 1
+        return started
+
+    def _choose_bracket(self, started):
+        """
+        Returns the bracket which is least full relative to its size.
+        """
+        fill = [float(started[b]) / self._bracket_size(b)
+                for b in range(len(self.rung_budgets))]
+        return int(np.argmin(fill))
+
+    def _reached_budget(self, candidate):
+        """
+        Returns whether candidate has reported a result at its budget.
+        """
+        for step, _ in candidate.intermediate_results:
+            if np.isclose(step, candidate.budget):
+                return True
+        return False
+
+    def _get_resumptions(self, num_candidates, started):
+        """
+        Returns up to num_candidates paused candidates to resume unchanged.
+
+        These are candidates whose evaluation has been paused before reaching
+        their budget, which are resumed with the same budget, and pending
+        candidates without budget (for example added by the user), which are
+        assigned to a bracket like new configurations.
+        """
+        resumptions = []
+        for c in self._experiment.candidates_pending:
+            if len(resumptions) >= num_candidates:
+                break
+            if c.cand_id in self._issued:
+                continue
+            if c.budget is None:
+                bracket = self._choose_bracket(started)
+                started[bracket] += 1
+                budget = self.rung_budgets[bracket]
+            elif not self._reached_budget(c):
+                budget = c.budget
+            else:
+                continue
+            resumptions.append(self._reissue(c, budget))
+        return resumptions
+
+    def _reissue(self, candidate, budget):
+        """
+        Returns a copy of candidate with budget, marking it as issued.
+        """
+        reissued = Candidate(dict(candidate.params), cand_id=candidate.cand_id,
+                             worker_information=candidate.worker_information)
+        reissued.intermediate_results = [list(e) for e in
+                                         candidate.intermediate_results]
+        reissued.budget = budget
+        reissued.generated_time = candidate.generated_time
+        self._issued.add(candidate.cand_id)
+        self._logger.debug("Issuing %s with budget %s (was %s).",
+                           candidate.cand_id, budget, candidate.budget)
+        return reissued
+
+    def _get_promotions(self, num_candidates):
+        """
+        Returns up to num_candidates promoted candidates.
+
+        A paused candidate at rung k is promotable iff its result at rung k is
+        among the best 1/eta of all results reported at rung k in its bracket
+        and it has neither been promoted nor issued yet.
+
+        Returns
+        -------
+        promotions : list of Candidates
+            New Candidate instances with the same cand_id, params,
+            worker_information and intermediate results as the promoted
+            candidates, but the budget of the next rung.
+        """
+        if num_candidates <= 0:
+            return []
+        paused = dict((c.cand_id, c) for c in
+                      self._experiment.candidates_pending
+                      if c.cand_id not in self._issued)
+        if not paused:
+            return []
+        all_cands = (self._experiment.candidates_pending +
+                     self._experiment.candidates_working +
+                     self._experiment.candidates_finished)
+        promotable = []
+        for k in range(len(self.rung_budgets) - 1):
+            rungs = {}
+            for c in all_cands:
+                result = self._rung_result(c, k)
+                if result is None:
+                    continue
+                rungs.setdefault(self._bracket(c), []).append((result, c))
+            for entries in rungs.values():
+                entries.sort(key=lambda e: e[0],
+                             reverse=not self._experiment.minimization_problem)
+                for result, c in entries[:int(len(entries) / self.eta)]:
+                    if (c.cand_id in paused and
+                            self._rung_index(c.budget) == k):
+                        promotable.append((result, k, c))
+        promotable.sort(key=lambda e: e[0],
+                        reverse=not self._experiment.minimization_problem)
+        promotions = []
+        for result, k, c in promotable[:num_candidates]:
+            promotions.append(self._reissue(c, self.rung_budgets[k + 1]))
+        return promotions
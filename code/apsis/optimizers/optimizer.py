@@ -1,19 +1,23 @@
 __author__ = 'Frederik Diehl'
 
 from abc import ABCMeta, abstractmethod
-from time import sleep
 from apsis.utilities import logging_utils
 import threading
+import multiprocessing
 import Queue
+import copy
+import collections
+import math
+import time
 
 class Optimizer(object):
     """
     This defines a basic Optimizer interface.
 
     An optimizer contains an _experiment, which represents the last known state
-     of the experiment. It can be updated using update, while the next
-     candidates can be generated with get_next_candidates, which represent the
-     actual work of the optimizer.
+     of the experiment. It can be updated using update, or incrementally
+     using update_delta, while the next candidates can be generated with
+     get_next_candidates, which represent the actual work of the optimizer.
     Additionally, it contains an exit function, which can be used to cleanly
     exit the optimizer. Since the optimizer may well implement multicore or
     distributed architectures, it is necessary to cleanly exit.
@@ -26,10 +30,19 @@ class Optimizer(object):
     _experiment : Experiment
         The current state of the experiment. Is used as a base for the the
         optimization.
+    handles_pausing : bool
+        If False (the default), paused candidates are resumed by the
+        experiment assistant before asking the optimizer for new candidates.
+        If True, the optimizer decides when (and with which budget) paused
+        candidates are resumed by returning them from get_next_candidates,
+        and is updated on pausing updates, too.
+    _delta_seq : int
+        The sequence number of the last delta applied by update_delta.
     """
     __metaclass__ = ABCMeta
 
     SUPPORTED_PARAM_TYPES = []
+    handles_pausing = False
 
     _experiment = None
     name = None
@@ -37,6 +50,8 @@ class Optimizer(object):
 
     treat_failed = None
 
+    _delta_seq = 0
+
     def __init__(self, experiment, optimizer_params):
         """
         Initializes the optimizer.
@@ -116,9 +131,54 @@ class Optimizer(object):
                                          experiment.parameter_definitions))
         self._experiment = experiment
 
+    def update_delta(self, deltas):
+        """
+        Updates the experiment incrementally.
+
+        Each delta is applied to _experiment, which is the optimizer's mirror
+        of the experiment, then update is called with the mirror. Deltas
+        whose sequence number is not larger than the last one applied are
+        duplicates and ignored. The candidates are added as they are;
+        QueueBasedOptimizer copies them, so that the mirror of its backend
+        does not share candidates with the live experiment. If _experiment
+        is the live experiment itself, as without multiprocessing, a delta
+        whose candidate is already in the list of its status is skipped.
+        Re-adding it would only touch the experiment, for example forcing
+        the result series to be recomputed.
+
+        Parameters
+        ----------
+        deltas : list of tuples
+            (seq, status, candidate) tuples, ordered by the increasing
+            sequence number seq. status is one of "finished", "working" and
+            "pausing".
+        """
+        add_functions = {
+            "finished": self._experiment.add_finished,
+            "working": self._experiment.add_working,
+            "pausing": self._experiment.add_pausing
+        }
+        status_lists = {
+            "finished": self._experiment.candidates_finished,
+            "working": self._experiment.candidates_working,
+            "pausing": self._experiment.candidates_pending
+        }
+        applied = 0
+        for seq, status, candidate in deltas:
+            if seq <= self._delta_seq:
+                continue
+            self._delta_seq = seq
+            # The most recently changed candidates are at the ends.
+            if any(c is candidate for c in reversed(status_lists[status])):
+                continue
+            add_functions[status](candidate)
+            applied += 1
+        self._logger.debug("Applied %s of %s deltas, up to seq %s.", applied,
+                           len(deltas), self._delta_seq)
+        self.update(self._experiment)
 
     @abstractmethod
-    def get_next_candidates(self, num_candidates=1):
+    def get_next_candidates(self, num_candidates=1, timeout=None):
         """
         Returns a number of candidates.
 
@@ -127,6 +187,10 @@ class Optimizer(object):
         num_candidates : strictly positive int, optional
             The maximum number of candidates returned. Note that there may
             be less than that in the list.
+        timeout : float, optional
+            The maximum number of seconds to wait for the first candidate if
+            none is available right away. If None (the default), does not
+            wait. Optimizers generating candidates synchronously ignore it.
 
         Returns
         -------
@@ -137,6 +201,28 @@ class Optimizer(object):
         """
         pass
 
+    def rescore_candidates(self, candidates):
+        """
+        Returns which of the candidates proposed before an update to keep.
+
+        Queue-based backends call this after each update with the
+        candidates still waiting to be handed out. By default, all of them
+        are discarded, since they may not be valid under the new state.
+        Optimizers whose proposals can be judged under the updated model
+        should override this.
+
+        Parameters
+        ----------
+        candidates : list of Candidates
+            The candidates proposed before the last update.
+
+        Returns
+        -------
+        kept : list of Candidates
+            The candidates still worth evaluating, best first.
+        """
+        return []
+
     def exit(self):
         """
         Cleanly exits this optimizer.
@@ -207,14 +293,21 @@ class QueueBasedOptimizer(Optimizer):
     This implements a queue-based optimizer.
 
     A queue-based optimizer is an abstraction of another optimizer. It works by
-     putting the other optimizer into another process, then communicating
+     putting the other optimizer into another thread, then communicating
      with it via queues and a QueueBackend instance. This means easy
-     deployability without having to change code.
+     deployability without having to change code. Since the backend shares
+     the GIL, see ProcessBasedOptimizer for a backend in its own process.
 
     Internally, the QueueBackend puts new candidates onto the
-    optimizer_out_queue, keeping it at min_candidates, until it receives a
-    new update. In that case, all current candidates in the out_queue are
-    deleted.
+    optimizer_out_queue, keeping enough of them ready for the current demand
+    (see QueueBackend), until it receives a new update. In that case, the
+    current candidates in the out_queue are re-scored by the optimizer (see
+    Optimizer.rescore_candidates), and only those it keeps remain. The
+    backend sleeps until it receives a message on the optimizer_in_queue: a
+    new experiment, a ("deltas", deltas) tuple (see Optimizer.update_delta),
+    "exit", or a ("demand", num_candidates, time) tuple, which is sent
+    whenever candidates have been requested. Only the changes travel as
+    deltas, so their cost does not grow with the experiment's history.
 
     Parameters
     ----------
@@ -222,6 +315,8 @@ class QueueBasedOptimizer(Optimizer):
         The queue with which you can send data (experiments) to the optimizer.
     _optimizer_out_queue : Queue
         The queue on which you can receive data.
+    _optimizer_process : Thread or Process
+        The thread or process running the QueueBackend.
     """
     _optimizer_in_queue = None
     _optimizer_out_queue = None
@@ -248,36 +343,54 @@ class QueueBasedOptimizer(Optimizer):
             parameters will be assumed.
             Supports the parameter "min_candidates", which sets the number
             of candidates that should be kept ready. Default is 5.
-            Supports the parameter "update_time", which sets the minimum time
-            in seconds between checking for updates. Default is 0.1s
         """
         self._logger = logging_utils.get_logger(self)
         self._logger.debug("Initializing new QueueBasedLogger. "
                            "optimizer_class is %s, experiment %s, "
                            "optimizer_params %s", optimizer_class,
                            experiment, optimizer_params)
-        self._optimizer_in_queue = Queue.Queue()
-        self._optimizer_out_queue = Queue.Queue()
         self._optimizer_class = optimizer_class
         self.SUPPORTED_PARAM_TYPES = optimizer_class.SUPPORTED_PARAM_TYPES
+        self.handles_pausing = optimizer_class.handles_pausing
+        self._start_backend(optimizer_class, experiment, optimizer_params)
+        super(QueueBasedOptimizer, self).__init__(experiment, optimizer_params)
 
+    def _start_backend(self, optimizer_class, experiment, optimizer_params):
+        """
+        Creates the queues and starts the QueueBackend in a thread.
+
+        Parameters are as for __init__.
+        """
+        self._optimizer_in_queue = Queue.Queue()
+        self._optimizer_out_queue = Queue.Queue()
         self._logger.debug("Initialized queues. in_queue is %s, out_queue %s",
                            self._optimizer_in_queue, self._optimizer_out_queue)
 
-        p = threading.Thread(target=dispatch_queue_backend,
-                                    args=(optimizer_class, optimizer_params,
-                                          experiment,
-                                          self._optimizer_out_queue,
-                                          self._optimizer_in_queue))
-        p.start()
+        self._optimizer_process = threading.Thread(
+            target=dispatch_queue_backend,
+            args=(optimizer_class, optimizer_params, experiment,
+                  self._optimizer_out_queue, self._optimizer_in_queue))
+        self._optimizer_process.start()
         self._logger.debug("Started thread.")
-        super(QueueBasedOptimizer, self).__init__(experiment, optimizer_params)
 
-    def get_next_candidates(self, num_candidates=1):
-        self._logger.debug("Returning next %s candidates", num_candidates)
+    def get_next_candidates(self, num_candidates=1, timeout=None):
+        """
+        Returns up to num_candidates candidates from the out_queue.
+
+        If timeout is given and no candidate is ready, this waits until the
+        backend produces the first one, but at most timeout seconds.
+        """
+        self._logger.debug("Returning next %s candidates, timeout %s",
+                           num_candidates, timeout)
         next_candidates = []
+        # Wakes the backend up to refill the out_queue, and tells it about
+        # the demand.
+        self._optimizer_in_queue.put(("demand", num_candidates, time.time()))
         try:
-            for i in range(num_candidates):
+            if timeout is not None and timeout > 0:
+                next_candidates.append(self._optimizer_out_queue.get(
+                    timeout=timeout))
+            while len(next_candidates) < num_candidates:
                 new_candidate = self._optimizer_out_queue.get_nowait()
                 next_candidates.append(new_candidate)
         except Queue.Empty:
@@ -298,6 +411,12 @@ class QueueBasedOptimizer(Optimizer):
                            experiment)
         self._optimizer_in_queue.put(experiment)
 
+    def update_delta(self, deltas):
+        # The backend must not see later changes of the live candidates.
+        deltas = copy.deepcopy(deltas)
+        self._logger.debug("Putting %s deltas into the queue", len(deltas))
+        self._optimizer_in_queue.put(("deltas", deltas))
+
     def exit(self):
         """
         Also closes the optimizer.
@@ -310,16 +429,105 @@ class QueueBasedOptimizer(Optimizer):
             self._optimizer_in_queue.put("exit")
 
 
+class ProcessBasedOptimizer(QueueBasedOptimizer):
+    """
+    This implements a queue-based optimizer whose backend runs in its own
+    process.
+
+    It works exactly like QueueBasedOptimizer, but the QueueBackend and with
+    it the abstracted optimizer run in a separate process, communicating via
+    multiprocessing queues. GP refits and acquisition searches therefore do
+    not hold the GIL of the process serving requests. Experiments and
+    candidates are pickled when they pass the queues. Since a
+    multiprocessing queue pickles in a background thread, update puts a
+    copy taken at the time of the call onto it, as update_delta does for
+    every QueueBasedOptimizer.
+
+    The process is a daemon, so it does not outlive its parent. exit()
+    asks it to stop, waits up to exit_timeout seconds for it and terminates
+    it otherwise.
+
+    Attributes
+    ----------
+    exit_timeout : float
+        The number of seconds to wait for the process to exit before
+        terminating it.
+    """
+    exit_timeout = 5
+
+    def __init__(self, optimizer_class, experiment, optimizer_params=None):
+        """
+        Initializes a new ProcessBasedOptimizer.
+
+        Parameters are as for QueueBasedOptimizer. Additionally supports the
+        parameter "exit_timeout", see the class attributes.
+        """
+        if optimizer_params is not None:
+            self.exit_timeout = optimizer_params.get("exit_timeout",
+                                                     self.exit_timeout)
+        super(ProcessBasedOptimizer, self).__init__(optimizer_class,
+                                                    experiment,
+                                                    optimizer_params)
+
+    def _start_backend(self, optimizer_class, experiment, optimizer_params):
+        """
+        Creates the queues and starts the QueueBackend in a process.
+
+        Parameters are as for __init__.
+        """
+        self._optimizer_in_queue = multiprocessing.Queue()
+        self._optimizer_out_queue = multiprocessing.Queue()
+        self._optimizer_process = multiprocessing.Process(
+            target=dispatch_queue_backend,
+            args=(optimizer_class, optimizer_params, experiment,
+                  self._optimizer_out_queue, self._optimizer_in_queue))
+        self._optimizer_process.daemon = True
+        self._optimizer_process.start()
+        self._logger.debug("Started process %s.",
+                           self._optimizer_process.pid)
+
+    def update(self, experiment):
+        # The experiment may change before the queue's feeder thread has
+        # pickled it.
+        super(ProcessBasedOptimizer, self).update(copy.deepcopy(experiment))
+
+    def exit(self):
+        """
+        Also closes the optimizer, terminating its process if necessary.
+        """
+        super(ProcessBasedOptimizer, self).exit()
+        if self._optimizer_process is None:
+            return
+        self._optimizer_process.join(self.exit_timeout)
+        if self._optimizer_process.is_alive():
+            self._logger.warning("Optimizer process did not exit within %s "
+                                 "seconds. Terminating it.",
+                                 self.exit_timeout)
+            self._optimizer_process.terminate()
+            self._optimizer_process.join()
+        self._optimizer_process = None
+
+
 class QueueBackend(object):
     """
     This is the backend for QueueBasedOptimizer.
 
     It ensures there's a compatible request to the stored optimizer.
 
+    The number of candidates kept ready in the out_queue adapts to the
+    demand. The backend tracks the rate at which candidates are requested
+    (over the last DEMAND_WINDOW requests) and the time the optimizer needs
+    per proposal. It then keeps enough candidates to serve the requests
+    expected while a batch of min_candidates proposals is generated, times
+    prefetch_factor. This is at least min_candidates and at most
+    max_candidates, since all ready candidates are discarded, that is go
+    stale, on every update.
+
     Parameters
     ----------
     _experiment : Experiment
-        The current state of the experiment.
+        The current state of the experiment. This is a copy of the received
+        experiments, since deltas are applied to it by the backend.
     _out_queue : Queue
         The queue on which to put the candidates.
     _in_queue : Queue
@@ -328,9 +536,21 @@ class QueueBackend(object):
         The optimizer this abstracts from
     _min_candidates : int
         The minimum numbers of candidates to keep ready.
+    _max_candidates : int
+        The maximum numbers of candidates to keep ready.
+    _prefetch_factor : float
+        The safety factor for the demand expected during a generation.
+    _demands : collections.deque
+        The (time, num_candidates) tuples of the last DEMAND_WINDOW requests.
+    _proposal_time : float or None
+        The moving average of the time needed for one proposal, or None if
+        nothing has been generated yet.
     _exited : bool
         Whether this process should exit (has seen the exit signal).
     """
+    DEMAND_WINDOW = 50
+    PROPOSAL_TIME_DECAY = 0.3
+
     _experiment = None
     _out_queue = None
     _in_queue = None
@@ -338,8 +558,11 @@ class QueueBackend(object):
     _optimizer = None
 
     _min_candidates = None
+    _max_candidates = None
+    _prefetch_factor = None
+    _demands = None
+    _proposal_time = None
     _exited = None
-    _update_time = None
 
     _logger = None
 
@@ -358,8 +581,10 @@ class QueueBackend(object):
         optimizer_params : dict, optional
             Dictionary of the optimizer parameters. If None, some standard
             parameters will be assumed.
-            Supports the parameter "min_candidates", which sets the number
-            of candidates that should be kept ready.
+            Supports the parameters "min_candidates" (default 5) and
+            "max_candidates" (default 50), which bound the number of
+            candidates that should be kept ready, and "prefetch_factor"
+            (default 2), see the class documentation.
         out_queue : Queue
             The queue on which to put the candidates.
         in_queue : Queue
@@ -377,16 +602,21 @@ class QueueBackend(object):
         if optimizer_params is None:
             optimizer_params = {}
         self._min_candidates = optimizer_params.get("min_candidates", 5)
-        self._update_time = optimizer_params.get("update_time", 0.1)
+        self._max_candidates = max(self._min_candidates,
+                                   optimizer_params.get("max_candidates", 50))
+        self._prefetch_factor = optimizer_params.get("prefetch_factor", 2)
+        self._demands = collections.deque(maxlen=self.DEMAND_WINDOW)
+        # With thread queues, the experiment is shared with the frontend.
+        experiment = copy.deepcopy(experiment)
         self._optimizer = optimizer_class(experiment, optimizer_params)
         self._exited = False
         self._experiment = experiment
         self._logger.debug("Had set the parameters to: out_queue is %s, "
                            "in_queue %s, optimizer_params %s, "
-                           "min_candidates %s, update_time %s,"
+                           "min_candidates %s,"
                            " optimizer %s, exited %s, experiment %s",
                            out_queue, in_queue, optimizer_params,
-                           self._min_candidates, self._update_time,
+                           self._min_candidates,
                            self._optimizer, self._exited, self._experiment)
         #multiprocessing.Process.__init__(self)
 
@@ -394,77 +624,200 @@ class QueueBackend(object):
         """
         The run function of this process, checking for new updates.
 
-        Every _update_time seconds, it checks both the necessity of a new
-        generation of candidates, and whether an update is necessary.
+        It refills the out_queue if necessary, then blocks until at least one
+        message arrives on the in_queue and handles all available messages.
+        This repeats until it receives "exit".
+        """
+        while not self._exited:
+            self._check_generation()
+            self._check_update(block=True)
 
-        It also makes sure all queues will be closed.
+    def step(self):
         """
-        try:
-            while not self._exited:
-                self._check_generation()
-                self._check_update()
-                sleep(0.1)
-        finally:
-            pass
+        Handles all available messages and refills the out_queue, without
+        blocking.
 
-    def _check_update(self):
+        This is the unit of work used by an OptimizerPool instead of run.
+        """
+        self._check_update()
+        if not self._exited:
+            self._check_generation()
+
+    @property
+    def exited(self):
+        """
+        Whether this backend has seen the exit signal.
+        """
+        return self._exited
+
+    def _check_update(self, block=False):
         """
         This checks for the availability of updates.
 
         Specifically, it does the following:
-        If the in_queue is not empty (that is, there are one or more
-        experiments available) it takes the last, most recently added. If
-        one of the elements is "exit", it will exit instead.
+        It takes all messages from the in_queue. Experiments are updates, of
+        which only the last, most recently added one is used. The deltas of
+        all ("deltas", deltas) messages after it are concatenated. If one of
+        the messages is "exit", it will exit instead. ("demand",
+        num_candidates, time) messages are recorded for the demand rate and
+        wake the backend up.
         The latest experiment is then used to call the update function of the
-        abstracted optimizer.
-        Additionally, it will empty the out_queue, since we assume it has more,
-        better information available.
+        abstracted optimizer, and the deltas to call its update_delta
+        function.
+        Additionally, it will re-score the out_queue, since we assume the
+        optimizer has more, better information available.
+
+        Parameters
+        ----------
+        block : bool, optional
+            If True, waits for at least one message. Default is False.
         """
-        new_update = None
-        while not self._in_queue.empty():
-            try:
-                new_update = self._in_queue.get_nowait()
-                self._logger.debug("Received new update: %s", new_update)
-            except Queue.Empty:
-                pass
-            if new_update == "exit":
-                self._logger.debug("Update received was exit.")
-                self._exited = True
-                return
-        if new_update is not None:
-            # clear the out queue. We'll soon have new information.
+        messages = []
+        if block:
+            messages.append(self._in_queue.get())
+        while True:
             try:
-                while not self._out_queue.empty():
-                    self._out_queue.get_nowait()
-                self._logger.debug("Cleared out the update queue.")
+                messages.append(self._in_queue.get_nowait())
             except Queue.Empty:
-                pass
-            self._experiment = new_update
-            self._optimizer.update(self._experiment)
+                break
+        new_update = None
+        deltas = []
+        for message in messages:
+            self._logger.debug("Received message: %s", message)
+            if isinstance(message, basestring):
+                if message == "exit":
+                    self._logger.debug("Update received was exit.")
+                    self._exited = True
+                    return
+                continue
+            if isinstance(message, tuple) and message[0] == "deltas":
+                deltas.extend(message[1])
+                continue
+            if isinstance(message, tuple) and message[0] == "demand":
+                self._demands.append((message[2], message[1]))
+                continue
+            new_update = message
+            # The full state already contains all earlier deltas.
+            deltas = []
+        if new_update is not None or deltas:
+            if new_update is not None:
+                self._experiment = copy.deepcopy(new_update)
+                self._optimizer.update(self._experiment)
+            if deltas:
+                self._optimizer.update_delta(deltas)
             self._logger.debug("Finished updating.")
+            self._rescore_out_queue()
+
+    def _rescore_out_queue(self):
+        """
+        Replaces the candidates in the out_queue by those the optimizer keeps.
+
+        Until the optimizer has been updated, the old candidates can still be
+        handed out, so workers are not starved during long refits.
+        """
+        stale = []
+        try:
+            while not self._out_queue.empty():
+                stale.append(self._out_queue.get_nowait())
+        except Queue.Empty:
+            pass
+        if not stale:
+            return
+        kept = self._optimizer.rescore_candidates(stale)
+        self._logger.debug("Kept %s of %s candidates after the update.",
+                           len(kept), len(stale))
+        try:
+            for c in kept:
+                self._out_queue.put_nowait(c)
+        except Queue.Full:
+            return
 
     def _check_generation(self):
         """
         This checks whether new candidates should be generated.
 
-        Specifically, it tests whether less than min_candidates are available
-        in the out_queue. If so, it will (via optimizer.get_next_candidates)
-        try to add min_candidates candidates.
+        Specifically, it tests whether less than _target_candidates() are
+        available in the out_queue. If so, it will (via
+        optimizer.get_next_candidates) try to add the missing candidates,
+        and update the time needed per proposal.
         """
+        target = self._target_candidates()
+        available = self._available_candidates(target)
+        if available >= target:
+            return
+        start_time = time.time()
+        new_candidates = self._optimizer.get_next_candidates(
+            num_candidates=target - available)
+        self._logger.debug("Needed to generate %s new candidates. "
+                           "Generated %s", target - available, new_candidates)
+        if not new_candidates:
+            return
+        proposal_time = (time.time() - start_time) / len(new_candidates)
+        if self._proposal_time is None:
+            self._proposal_time = proposal_time
+        else:
+            self._proposal_time += self.PROPOSAL_TIME_DECAY * (
+                proposal_time - self._proposal_time)
         try:
-            if (self._out_queue.empty() or
-                           self._out_queue.qsize < self._min_candidates):
-                new_candidates = self._optimizer.get_next_candidates(
-                    num_candidates=self._min_candidates)
-                self._logger.debug("Needed to generate new candidates. "
-                                   "Generated %s", new_candidates)
-                if new_candidates is None:
-                    return
-                for c in new_candidates:
-                    self._out_queue.put_nowait(c)
+            for c in new_candidates:
+                self._out_queue.put_nowait(c)
         except Queue.Full:
             return
 
+    def _available_candidates(self, target):
+        """
+        Returns the number of candidates in the out_queue.
+
+        Where multiprocessing queues do not implement qsize (for example on
+        Mac OS X), this only distinguishes an empty queue (0) from a
+        non-empty one (target).
+        """
+        try:
+            return self._out_queue.qsize()
+        except NotImplementedError:
+            if self._out_queue.empty():
+                return 0
+            return target
+
+    def _demand_rate(self, now=None):
+        """
+        Returns the number of candidates requested per second.
+
+        It is computed over the recorded requests, excluding the first one,
+        whose candidates have been requested before the window started. The
+        window lasts until now, so that the rate decays once the requests
+        stop. 0 if there are not enough requests.
+
+        Parameters
+        ----------
+        now : float, optional
+            The current time. Default is time.time().
+        """
+        if len(self._demands) < 2:
+            return 0.
+        if now is None:
+            now = time.time()
+        span = now - self._demands[0][0]
+        if span <= 0:
+            return 0.
+        requested = sum(num for _, num in self._demands) - self._demands[0][1]
+        return requested / span
+
+    def _target_candidates(self):
+        """
+        Returns the number of candidates which should be ready.
+
+        This is the number of candidates expected to be requested while a
+        batch of min_candidates is generated, times prefetch_factor, and
+        bounded by min_candidates and max_candidates.
+        """
+        if self._proposal_time is None:
+            return self._min_candidates
+        expected = (self._demand_rate() * self._proposal_time *
+                    self._min_candidates * self._prefetch_factor)
+        target = int(math.ceil(expected))
+        return max(self._min_candidates, min(self._max_candidates, target))
+
 
 def dispatch_queue_backend(optimizer_class, optimizer_params, experiment,
                            out_queue, in_queue):
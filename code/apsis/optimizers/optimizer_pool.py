@@ -0,0 +1,279 @@
+__author__ = 'Frederik Diehl'
+
+from apsis.optimizers.optimizer import QueueBasedOptimizer, QueueBackend
+from apsis.utilities import logging_utils
+from multiprocessing import cpu_count
+import threading
+import itertools
+import Queue
+
+
+class OptimizerPool(object):
+    """
+    A fixed pool of worker threads shared by several optimizers.
+
+    Instead of every QueueBasedOptimizer running its own backend thread,
+    PooledOptimizers schedule their QueueBackend on the pool whenever there
+    is work for it (an update, a demand for candidates or an exit). The
+    workers then step the scheduled backends in order of priority:
+    PRIORITY_WAITING for backends which could not serve all requested
+    candidates, that is with workers waiting, before PRIORITY_UPDATE for new
+    experiment states, before PRIORITY_DEMAND for refilling candidates.
+
+    A backend is never stepped by two workers at once. If it is scheduled
+    while running, it is rescheduled once it is finished.
+
+    Additionally, the number of threads used by BLAS libraries (and
+    therefore by GP fits) is limited via threadpoolctl, if available, so
+    that num_workers concurrent fits do not oversubscribe the cores.
+
+    Attributes
+    ----------
+    num_workers : int
+        The number of worker threads.
+    blas_threads : int or None
+        The maximum number of BLAS threads. If None, BLAS is not limited.
+    _queue : Queue.PriorityQueue
+        The queue of (priority, seq, backend) tuples to step.
+    _pending : dict
+        Maps each queued backend to the seq of its valid queue entry.
+        Entries with other seqs are outdated and skipped.
+    _running : set
+        The backends currently being stepped.
+    _rerun : dict
+        Maps backends scheduled while running to their best priority.
+    _lock : threading.Lock
+        Guards _pending, _running and _rerun.
+    _workers : list of threads
+        The worker threads.
+    _blas_limiter : threadpoolctl.threadpool_limits or None
+        The active BLAS limits, restored on exit.
+    """
+    PRIORITY_WAITING = 0
+    PRIORITY_UPDATE = 1
+    PRIORITY_DEMAND = 2
+
+    num_workers = None
+    blas_threads = None
+
+    _queue = None
+    _pending = None
+    _running = None
+    _rerun = None
+    _lock = None
+    _seq = None
+    _workers = None
+    _blas_limiter = None
+
+    _logger = None
+
+    def __init__(self, num_workers=None, blas_threads=1):
+        """
+        Initializes the pool and starts its workers.
+
+        Parameters
+        ----------
+        num_workers : int, optional
+            The number of worker threads. Default is the number of CPUs.
+        blas_threads : int or None, optional
+            The maximum number of threads per BLAS call. Default is 1. If
+            None, BLAS is not limited.
+
+        Raises
+        ------
+        ValueError
+            Iff num_workers is smaller than 1.
+        """
+        self._logger = logging_utils.get_logger(self)
+        if num_workers is None:
+            num_workers = cpu_count()
+        if num_workers < 1:
+            raise ValueError("num_workers must be at least 1, is %s."
+                             %num_workers)
+        self.num_workers = num_workers
+        self.blas_threads = blas_threads
+        self._queue = Queue.PriorityQueue()
+        self._pending = {}
+        self._running = set()
+        self._rerun = {}
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self._limit_blas_threads()
+
+        self._workers = []
+        for i in range(num_workers):
+            worker = threading.Thread(target=self._run_worker)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+        self._logger.debug("Started optimizer pool with %s workers.",
+                           num_workers)
+
+    def _limit_blas_threads(self):
+        """
+        Limits the BLAS threads of this process if threadpoolctl exists.
+        """
+        if self.blas_threads is None:
+            return
+        # Imported here, since import_utils initializes logging on import.
+        from apsis.utilities.import_utils import import_if_exists
+        success, threadpoolctl = import_if_exists("threadpoolctl")
+        if not success:
+            self._logger.debug("threadpoolctl not available. Not limiting "
+                               "BLAS threads.")
+            return
+        self._blas_limiter = threadpoolctl.threadpool_limits(
+            limits=self.blas_threads)
+        self._logger.debug("Limited BLAS to %s threads.", self.blas_threads)
+
+    def schedule(self, backend, priority):
+        """
+        Schedules backend to be stepped with priority.
+
+        If backend is already queued with the same or a better (smaller)
+        priority, nothing changes.
+
+        Parameters
+        ----------
+        backend : QueueBackend
+            The backend to step.
+        priority : int
+            The priority, smaller is more urgent. See the class constants.
+        """
+        with self._lock:
+            if backend in self._running:
+                self._rerun[backend] = min(priority,
+                                           self._rerun.get(backend, priority))
+                return
+            self._push(backend, priority)
+
+    def _push(self, backend, priority):
+        """
+        Queues backend unless it is queued with a better priority. Must be
+        called with _lock held.
+        """
+        current = self._pending.get(backend)
+        if current is not None and current[0] <= priority:
+            return
+        seq = next(self._seq)
+        self._pending[backend] = (priority, seq)
+        self._queue.put((priority, seq, backend))
+
+    def _run_worker(self):
+        """
+        Steps scheduled backends until receiving the exit signal, a None
+        backend.
+        """
+        while True:
+            priority, seq, backend = self._queue.get()
+            if backend is None:
+                return
+            with self._lock:
+                if self._pending.get(backend) != (priority, seq):
+                    continue
+                del self._pending[backend]
+                self._running.add(backend)
+            try:
+                backend.step()
+            except Exception:
+                self._logger.exception("Stepping %s failed.", backend)
+            finally:
+                with self._lock:
+                    self._running.discard(backend)
+                    rerun = self._rerun.pop(backend, None)
+                    if rerun is not None and not backend.exited:
+                        self._push(backend, rerun)
+
+    def exit(self):
+        """
+        Stops all workers and restores the BLAS limits.
+
+        Workers finish their current step; queued work is dropped.
+        """
+        self._logger.debug("Exiting optimizer pool.")
+        for worker in self._workers:
+            self._queue.put((-1, next(self._seq), None))
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+        if self._blas_limiter is not None:
+            self._blas_limiter.restore_original_limits()
+            self._blas_limiter = None
+
+
+class PooledOptimizer(QueueBasedOptimizer):
+    """
+    A queue-based optimizer whose backend is stepped by an OptimizerPool.
+
+    It works like QueueBasedOptimizer, but has no thread of its own. Every
+    message put onto the in_queue also schedules the backend on the pool,
+    with PRIORITY_WAITING if fewer candidates were available than requested.
+
+    Attributes
+    ----------
+    _pool : OptimizerPool
+        The pool stepping the backend.
+    _backend : QueueBackend
+        The backend.
+    """
+    _pool = None
+    _backend = None
+
+    def __init__(self, optimizer_class, experiment, optimizer_params=None):
+        """
+        Initializes a new PooledOptimizer.
+
+        Parameters are as for QueueBasedOptimizer. optimizer_params must
+        contain the OptimizerPool to use as "optimizer_pool".
+
+        Raises
+        ------
+        ValueError
+            Iff no optimizer_pool is given.
+        """
+        if optimizer_params is None:
+            optimizer_params = {}
+        self._pool = optimizer_params.get("optimizer_pool", None)
+        if not isinstance(self._pool, OptimizerPool):
+            raise ValueError("PooledOptimizer requires an OptimizerPool as "
+                             "optimizer_pool, but got %s." %self._pool)
+        super(PooledOptimizer, self).__init__(optimizer_class, experiment,
+                                              optimizer_params)
+
+    def _start_backend(self, optimizer_class, experiment, optimizer_params):
+        """
+        Creates the queues and backend, and schedules the first generation.
+
+        Parameters are as for __init__.
+        """
+        self._optimizer_in_queue = Queue.Queue()
+        self._optimizer_out_queue = Queue.Queue()
+        self._backend = QueueBackend(optimizer_class, experiment,
+                                     self._optimizer_out_queue,
+                                     self._optimizer_in_queue,
+                                     optimizer_params)
+        self._pool.schedule(self._backend, OptimizerPool.PRIORITY_DEMAND)
+
+    def get_next_candidates(self, num_candidates=1, timeout=None):
+        if timeout is not None and timeout > 0:
+            # The backend has to be stepped while we are waiting for it.
+            self._pool.schedule(self._backend, OptimizerPool.PRIORITY_WAITING)
+        next_candidates = super(PooledOptimizer, self).get_next_candidates(
+            num_candidates, timeout)
+        if len(next_candidates) < num_candidates:
+            self._pool.schedule(self._backend, OptimizerPool.PRIORITY_WAITING)
+        else:
+            self._pool.schedule(self._backend, OptimizerPool.PRIORITY_DEMAND)
+        return next_candidates
+
+    def update(self, experiment):
+        super(PooledOptimizer, self).update(experiment)
+        self._pool.schedule(self._backend, OptimizerPool.PRIORITY_UPDATE)
+
+    def update_delta(self, deltas):
+        super(PooledOptimizer, self).update_delta(deltas)
+        self._pool.schedule(self._backend, OptimizerPool.PRIORITY_UPDATE)
+
+    def exit(self):
+        super(PooledOptimizer, self).exit()
+        self._pool.schedule(self._backend, OptimizerPool.PRIORITY_UPDATE)
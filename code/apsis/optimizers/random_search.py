@@ -54,7 +54,7 @@ class RandomSearch(Optimizer):
         self._logger.debug("Initialized random state to %s", self.random_state)
         Optimizer.__init__(self, experiment, optimizer_params)
 
-    def get_next_candidates(self, num_candidates=1):
+    def get_next_candidates(self, num_candidates=1, timeout=None):
         self._logger.debug("Returning next %s candidates", num_candidates)
         candidate_list = []
         for i in range(num_candidates):
@@ -62,6 +62,13 @@ class RandomSearch(Optimizer):
         self._logger.debug("Generated candidates: %s", candidate_list)
         return candidate_list
 
+    def rescore_candidates(self, candidates):
+        """
+        Keeps all candidates, since random proposals do not depend on the
+        results.
+        """
+        return list(candidates)
+
     def _gen_one_candidate(self):
         """
         Generates a single candidate.
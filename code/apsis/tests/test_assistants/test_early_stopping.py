@@ -0,0 +1,61 @@
+__author__ = 'Frederik Diehl'
+
+from apsis.assistants.early_stopping import MedianStoppingRule, \
+    CurveExtrapolationRule
+from apsis.utilities.early_stopping_utils import check_early_stopping
+from apsis.models.experiment import Experiment
+from apsis.models.candidate import Candidate
+from apsis.models.parameter_definition import MinMaxNumericParamDef
+from nose.tools import assert_true, assert_false, assert_is_none, \
+    assert_is_instance, assert_raises
+
+
+class TestEarlyStopping(object):
+    exp = None
+
+    def setup(self):
+        self.exp = Experiment("test_early_stopping",
+                              {"x": MinMaxNumericParamDef(0, 1)})
+        for i in range(3):
+            cand = Candidate({"x": i / 3.})
+            for step in range(10):
+                cand.add_intermediate_result(1. / (step + 1))
+            cand.result = 0.1
+            self.exp.add_finished(cand)
+
+    def _running_candidate(self, values):
+        cand = Candidate({"x": 0.5})
+        for v in values:
+            cand.add_intermediate_result(v)
+        return cand
+
+    def test_median_rule(self):
+        rule = MedianStoppingRule()
+        bad = self._running_candidate([2, 2, 2, 2])
+        good = self._running_candidate([0.5, 0.3, 0.2, 0.1])
+        too_short = self._running_candidate([2, 2])
+        assert_true(rule.should_stop(bad, self.exp))
+        assert_false(rule.should_stop(good, self.exp))
+        assert_false(rule.should_stop(too_short, self.exp))
+        assert_false(MedianStoppingRule({"grace_period": 5}).should_stop(
+            bad, self.exp))
+        assert_false(MedianStoppingRule({"min_finished": 4}).should_stop(
+            bad, self.exp))
+
+    def test_curve_extrapolation_rule(self):
+        rule = CurveExtrapolationRule()
+        flat = self._running_candidate([1, 1, 1, 1])
+        improving = self._running_candidate([1, 0.5, 0.2, 0.05])
+        assert_true(rule.should_stop(flat, self.exp))
+        assert_false(rule.should_stop(improving, self.exp))
+
+    def test_check_early_stopping(self):
+        assert_is_none(check_early_stopping(None))
+        assert_is_instance(check_early_stopping("MedianStoppingRule"),
+                           MedianStoppingRule)
+        rule = CurveExtrapolationRule()
+        assert_true(check_early_stopping(rule) is rule)
+        with assert_raises(ValueError):
+            check_early_stopping("fails")
+        with assert_raises(ValueError):
+            check_early_stopping(Candidate)
@@ -5,12 +5,18 @@ logging_utils.logging_tests()
 
 
 from apsis.assistants.experiment_assistant import ExperimentAssistant
+import apsis.assistants.experiment_assistant as experiment_assistant
 from nose.tools import assert_equal, assert_items_equal, assert_dict_equal, \
     assert_is_none, assert_raises, raises, assert_greater_equal, \
     assert_less_equal, assert_in, assert_true, assert_false, with_setup
 from apsis.models.parameter_definition import *
 import time
-from apsis.models import experiment
+import threading
+import tempfile
+import shutil
+import os
+from apsis.utilities.state_writer import StateWriter
+from apsis.models import experiment, candidate
 
 
 class TestExperimentAssistant(object):
@@ -83,6 +89,203 @@ class TestExperimentAssistant(object):
             raise Exception("Received no result in the first 2 seconds.")
         assert_equal(new_cand, cand)
 
+    def test_get_next_candidates(self):
+        cand = self.EAss.get_next_candidate()
+        self.EAss.update(cand, "pausing")
+        cands = self.EAss.get_next_candidates(num_candidates=4)
+        assert_equal(len(cands), 4)
+        # The pending candidate is resumed first.
+        assert_equal(cands[0], cand)
+        assert_equal(len(set(c.cand_id for c in cands)), 4)
+        assert_items_equal(self.EAss._experiment.candidates_working, cands)
+        assert_equal(self.EAss._experiment.candidates_pending, [])
+
+    def test_update_many(self):
+        cands = self.EAss.get_next_candidates(num_candidates=3)
+        for i, c in enumerate(cands):
+            c.result = i
+        updates = [(cands[0], "finished", None), (cands[1], "pausing", None),
+                   (cands[2], "working", 1)]
+        calls = []
+        self.EAss._update_optimizer = lambda: calls.append(True)
+        stops = self.EAss.update_many(updates)
+        assert_equal(stops, [False, False, False])
+        # A single optimizer update for all of them.
+        assert_equal(len(calls), 1)
+        assert_equal(self.EAss._experiment.candidates_finished, [cands[0]])
+        assert_equal(self.EAss._experiment.candidates_pending, [cands[1]])
+        assert_equal(self.EAss._experiment.candidates_working, [cands[2]])
+        with assert_raises(ValueError):
+            self.EAss.update_many([(cands[1], "finished", None),
+                                   (cands[2], "no status", None)])
+        # Nothing has been applied.
+        assert_equal(self.EAss._experiment.candidates_pending, [cands[1]])
+
+    def test_leases(self):
+        exp = experiment.Experiment("test_leases", self.param_defs)
+        with assert_raises(ValueError):
+            ExperimentAssistant("RandomSearch", exp,
+                                optimizer_arguments={"lease_duration": 0})
+        EAss = ExperimentAssistant("RandomSearch", exp, optimizer_arguments={
+            "multiprocessing": "none", "lease_duration": 10,
+            "max_lease_expiries": 2})
+        try:
+            cand = EAss.get_next_candidate()
+            assert_equal(EAss.reap_expired_leases(time.time() + 5), [])
+            # A heartbeat renews the lease.
+            EAss._leases[cand.cand_id] = time.time() - 1
+            EAss.update(cand, "working")
+            assert_equal(EAss.reap_expired_leases(time.time() + 5), [])
+
+            assert_equal(EAss.reap_expired_leases(time.time() + 11), [cand])
+            assert_equal(exp.candidates_pending, [cand])
+            assert_equal(exp.candidates_working, [])
+            # The expired candidate is handed out again.
+            assert_equal(EAss.get_next_candidate(), cand)
+            # After the second expiry, it is marked as failed.
+            assert_equal(EAss.reap_expired_leases(time.time() + 11), [cand])
+            assert_equal(exp.candidates_finished, [cand])
+            assert_true(cand.failed)
+            assert_equal(EAss._leases, {})
+        finally:
+            EAss.set_exit()
+
+    def test_stale_lease(self):
+        exp = experiment.Experiment("test_stale_lease", self.param_defs)
+        EAss = ExperimentAssistant("RandomSearch", exp, optimizer_arguments={
+            "multiprocessing": "none", "lease_duration": 10})
+        try:
+            cand = EAss.get_next_candidate()
+            # The worker holds a copy, as when talking to the server.
+            reaped_worker = candidate.from_dict(cand.to_dict())
+            assert_true(reaped_worker.lease_token is not None)
+            assert_equal(EAss.reap_expired_leases(time.time() + 11), [cand])
+            new_worker = candidate.from_dict(
+                EAss.get_next_candidate().to_dict())
+            assert_true(new_worker.lease_token !=
+                        reaped_worker.lease_token)
+            # Late updates of the reaped worker are ignored.
+            assert_true(EAss.update(reaped_worker, "working"))
+            reaped_worker.result = 1
+            EAss.update(reaped_worker, "finished")
+            assert_equal(exp.candidates_finished, [])
+            assert_equal(exp.candidates_working, [cand])
+            new_worker.result = 2
+            EAss.update(new_worker, "finished")
+            assert_equal(exp.candidates_finished[0].result, 2)
+            # Once finished, the reaped worker's result is ignored, too.
+            EAss.update(reaped_worker, "finished")
+            assert_equal(exp.candidates_finished[0].result, 2)
+        finally:
+            EAss.set_exit()
+
+    def test_reaped_worker_finishing(self):
+        exp = experiment.Experiment("test_reaped_worker", self.param_defs)
+        EAss = ExperimentAssistant("RandomSearch", exp, optimizer_arguments={
+            "multiprocessing": "none", "lease_duration": 10})
+        try:
+            cand = EAss.get_next_candidate()
+            worker = candidate.from_dict(cand.to_dict())
+            assert_equal(EAss.reap_expired_leases(time.time() + 11), [cand])
+            assert_equal(exp.candidates_pending, [cand])
+            # The candidate has not been handed out again, so the result of
+            # the original worker is still accepted.
+            worker.result = 1
+            EAss.update(worker, "finished")
+            assert_equal(exp.candidates_pending, [])
+            assert_equal(exp.candidates_finished, [cand])
+            assert_equal(exp.candidates_finished[0].result, 1)
+        finally:
+            EAss.set_exit()
+
+    def test_leases_after_reload(self):
+        exp = experiment.Experiment("test_reload_leases", self.param_defs)
+        args = {"multiprocessing": "none", "lease_duration": 10}
+        EAss = ExperimentAssistant("RandomSearch", exp,
+                                   optimizer_arguments=args)
+        try:
+            worker = candidate.from_dict(EAss.get_next_candidate().to_dict())
+        finally:
+            EAss.set_exit()
+        exp = experiment.from_dict(exp.to_dict())
+        EAss = ExperimentAssistant("RandomSearch", exp,
+                                   optimizer_arguments=args)
+        try:
+            # The working candidate is leased anew, keeping its token.
+            assert_equal(exp.candidates_working, [worker])
+            assert_equal(EAss._leases.keys(), [worker.cand_id])
+            assert_true(EAss.update(worker, "working") is False)
+            worker.result = 1
+            EAss.update(worker, "finished")
+            assert_equal(exp.candidates_finished, [worker])
+        finally:
+            EAss.set_exit()
+
+    def test_concurrent_access(self):
+        # Several workers leasing, pausing and finishing candidates at once.
+        finished = []
+        errors = []
+
+        def work():
+            try:
+                for i in range(20):
+                    cand = self.EAss.get_next_candidate()
+                    if i % 3 == 0:
+                        self.EAss.update(cand, "pausing")
+                        continue
+                    cand.result = i
+                    self.EAss.update(cand)
+                    finished.append(cand)
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=work) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert_equal(errors, [])
+        # No candidate has been handed out to two workers, or lost.
+        assert_equal(len(set(c.cand_id for c in finished)), len(finished))
+        assert_items_equal(self.EAss._experiment.candidates_finished,
+                           finished)
+        assert_equal(self.EAss._experiment.candidates_working, [])
+
+    def test_concurrent_fsync(self):
+        # Two experiments sharing a synchronous state writer.
+        write_dir = tempfile.mkdtemp()
+        writer = StateWriter("fsync")
+        assistants = []
+        for i in range(2):
+            exp_dir = os.path.join(write_dir, str(i))
+            os.mkdir(exp_dir)
+            exp = experiment.Experiment("test_fsync", self.param_defs)
+            assistants.append(ExperimentAssistant(
+                "RandomSearch", exp, write_dir=exp_dir,
+                optimizer_arguments={"multiprocessing": "none"},
+                state_writer=writer))
+
+        def work(exp_ass):
+            for i in range(20):
+                cand = exp_ass.get_next_candidate()
+                cand.result = i
+                exp_ass.update(cand)
+        threads = [threading.Thread(target=work, args=(assistants[i % 2],))
+                   for i in range(4)]
+        try:
+            for t in threads:
+                t.daemon = True
+                t.start()
+            for t in threads:
+                t.join(30)
+            assert_false(any(t.is_alive() for t in threads))
+            for exp_ass in assistants:
+                assert_equal(
+                    len(exp_ass._experiment.candidates_finished), 40)
+        finally:
+            for exp_ass in assistants:
+                exp_ass.set_exit()
+            writer.exit()
+            shutil.rmtree(write_dir)
 
     def test_update(self):
         """
@@ -106,6 +309,61 @@ class TestExperimentAssistant(object):
         with assert_raises(ValueError):
             self.EAss.update(False)
 
+    def test_intermediate_results(self):
+        """
+        Tests whether working updates record intermediate results and signal
+        early stopping.
+        """
+        exp = experiment.Experiment("test_intermediate", self.param_defs)
+        eass = ExperimentAssistant("RandomSearch", exp,
+                                   optimizer_arguments={
+                                       "multiprocessing": "none",
+                                       "early_stopping": "MedianStoppingRule"
+                                   })
+        for i in range(3):
+            cand = eass.get_next_candidate()
+            for step in range(5):
+                cand.result = 1
+                assert_false(eass.update(cand, "working", step=step))
+            cand.result = 1
+            eass.update(cand, "finished")
+        assert_equal(len(cand.intermediate_results), 5)
+
+        cand = eass.get_next_candidate()
+        stop = False
+        for step in range(5):
+            cand.result = 2
+            stop = eass.update(cand, "working")
+        assert_true(stop)
+        eass.set_exit()
+
+    def test_assistant_arguments_not_passed_on(self):
+        passed = []
+        check_optimizer = experiment_assistant.check_optimizer
+
+        def recording_check_optimizer(optimizer, experiment,
+                                      optimizer_arguments=None):
+            passed.append(optimizer_arguments)
+            return check_optimizer(optimizer, experiment, optimizer_arguments)
+        experiment_assistant.check_optimizer = recording_check_optimizer
+        try:
+            exp = experiment.Experiment("test_arguments", self.param_defs)
+            eass = ExperimentAssistant("RandomSearch", exp,
+                                       optimizer_arguments={
+                                           "multiprocessing": "none",
+                                           "early_stopping":
+                                               "MedianStoppingRule",
+                                           "early_stopping_params": {},
+                                           "lease_duration": 10
+                                       })
+            eass.set_exit()
+        finally:
+            experiment_assistant.check_optimizer = check_optimizer
+        assert_equal(passed, [{"multiprocessing": "none"}])
+        # The assistant's own arguments are still stored.
+        assert_equal(eass._optimizer_arguments["early_stopping"],
+                     "MedianStoppingRule")
+
     def test_get_best_candidate(self):
         """
         Tests whether get_best_candidate works.
@@ -3,10 +3,14 @@ __author__ = 'Frederik Diehl'
 from apsis.assistants.lab_assistant import *
 from nose.tools import assert_equal, assert_items_equal, assert_dict_equal, \
     assert_is_none, assert_raises, raises, assert_greater_equal, \
-    assert_less_equal, assert_in
+    assert_less_equal, assert_in, assert_true, assert_almost_equal
 from apsis.utilities.logging_utils import get_logger
 from apsis.models.parameter_definition import *
 import matplotlib.pyplot as plt
+import tempfile
+import time
+import shutil
+import threading
 
 class TestLabAssistant(object):
     """
@@ -74,6 +78,57 @@ class TestLabAssistant(object):
 
 
 
+    def test_warm_start(self):
+        """
+        Tests warm starting from another experiment.
+            - Incompatible sources are rejected
+            - The first candidate is the best source candidate
+            - The source data is kept out of the new experiment
+        """
+        param_defs = {"x": MinMaxNumericParamDef(0, 1)}
+        optimizer_arguments = {"multiprocessing": "none"}
+        source_id = self.LAss.init_experiment(
+            "source", "RandomSearch", param_defs,
+            optimizer_arguments=optimizer_arguments)
+        for i in range(5):
+            cand = self.LAss.get_next_candidate(source_id)
+            cand.result = (cand.params["x"] - 0.3)**2
+            self.LAss.update(source_id, "finished", cand)
+        best_source = self.LAss.get_best_candidate(source_id)
+
+        with assert_raises(ValueError):
+            self.LAss.init_experiment("target", "BayOpt", param_defs,
+                                      optimizer_arguments=optimizer_arguments,
+                                      source_exp_ids=["no_such_id"])
+        with assert_raises(ValueError):
+            self.LAss.init_experiment("target", "BayOpt",
+                                      {"y": MinMaxNumericParamDef(0, 1)},
+                                      optimizer_arguments=optimizer_arguments,
+                                      source_exp_ids=[source_id])
+        with assert_raises(ValueError):
+            self.LAss.init_experiment("target", "BayOpt", param_defs,
+                                      optimizer_arguments=optimizer_arguments,
+                                      minimization=False,
+                                      source_exp_ids=[source_id])
+
+        target_id = self.LAss.init_experiment(
+            "target", "BayOpt", param_defs,
+            optimizer_arguments=optimizer_arguments,
+            source_exp_ids=[source_id])
+        exp_ass = self.LAss._exp_assistants[target_id]
+        assert_equal(exp_ass._optimizer.initial_random_runs, 1)
+        assert_true("warm_start_experiments" not in
+                    (exp_ass._optimizer_arguments or {}))
+        cand = self.LAss.get_next_candidate(target_id)
+        assert_almost_equal(cand.params["x"], best_source.params["x"])
+        # The best source candidate is only handed out once.
+        assert_is_none(exp_ass._optimizer.warm_start_best)
+        cand.result = 1
+        self.LAss.update(target_id, "finished", cand)
+        cand = self.LAss.get_next_candidate(target_id)
+        assert_equal(exp_ass._optimizer.gp.X.shape[0], 6)
+        assert_equal(len(exp_ass._experiment.candidates_finished), 1)
+
     def test_get_next_candidate(self):
         """
         Tests the get next candidate function.
@@ -101,6 +156,132 @@ class TestLabAssistant(object):
         assert_items_equal(self.LAss._exp_assistants[exp_id]._experiment.candidates_finished, [cand])
         assert_equal(self.LAss._exp_assistants[exp_id]._experiment.candidates_finished[0].result, 1)
 
+    def test_reap_expired_leases(self):
+        param_defs = {"x": MinMaxNumericParamDef(0, 1)}
+        exp_id = self.LAss.init_experiment(
+            "test_leases", "RandomSearch", param_defs,
+            optimizer_arguments={"multiprocessing": "none",
+                                 "lease_duration": 10})
+        cand = self.LAss.get_next_candidate(exp_id)
+        assert_equal(self.LAss.reap_expired_leases(), {})
+        self.LAss._exp_assistants[exp_id]._leases[cand.cand_id] = 0
+        assert_equal(self.LAss.reap_expired_leases(), {exp_id: [cand]})
+        assert_equal(self.LAss.get_candidates(exp_id)["pending"], [cand])
+
+    def test_lazy_loading_and_hibernation(self):
+        write_dir = tempfile.mkdtemp()
+        try:
+            LAss = LabAssistant(write_dir=write_dir, hibernate_after=10)
+            param_defs = {"x": MinMaxNumericParamDef(0, 1)}
+            exp_ids = [LAss.init_experiment(
+                "test_hibernation", "RandomSearch", param_defs,
+                optimizer_arguments={"multiprocessing": "none"})
+                for i in range(3)]
+            cand = LAss.get_next_candidate(exp_ids[0])
+            cand.result = 1
+            LAss.update(exp_ids[0], "finished", cand)
+            assert_equal(LAss.hibernate_idle(), [])
+            assert_items_equal(LAss.hibernate_idle(time.time() + 11),
+                               exp_ids)
+            assert_equal(LAss._exp_assistants, {})
+            assert_items_equal(LAss.get_ids(), exp_ids)
+            # Reloaded on access.
+            assert_equal(LAss.get_best_candidate(exp_ids[0]), cand)
+            assert_equal(LAss._exp_assistants.keys(), [exp_ids[0]])
+            LAss.set_exit()
+
+            LAss = LabAssistant(write_dir=write_dir)
+            assert_equal(LAss._exp_assistants, {})
+            assert_true(LAss.contains_id(exp_ids[1]))
+            assert_items_equal(LAss.activate(exp_ids[:2]), exp_ids[:2])
+            assert_items_equal(LAss.activate(), [exp_ids[2]])
+            assert_equal(LAss.get_best_candidate(exp_ids[0]), cand)
+            LAss.set_exit()
+        finally:
+            shutil.rmtree(write_dir)
+
+    def test_last_update_time_without_loading(self):
+        write_dir = tempfile.mkdtemp()
+        try:
+            hibernated = []
+            LAss = LabAssistant(write_dir=write_dir, hibernate_after=10,
+                                on_hibernate=hibernated.append)
+            param_defs = {"x": MinMaxNumericParamDef(0, 1)}
+            exp_id = LAss.init_experiment(
+                "test_hibernation", "RandomSearch", param_defs,
+                optimizer_arguments={"multiprocessing": "none"})
+            cand = LAss.get_next_candidate(exp_id)
+            cand.result = 1
+            LAss.update(exp_id, "finished", cand)
+            last_update_time = LAss.get_last_update_time(exp_id)
+            assert_equal(LAss.hibernate_idle(time.time() + 11), [exp_id])
+            assert_equal(hibernated, [exp_id])
+            assert_equal(LAss.get_last_update_time(exp_id), last_update_time)
+            assert_equal(LAss._exp_assistants, {})
+            LAss.set_exit()
+
+            LAss = LabAssistant(write_dir=write_dir)
+            assert_equal(LAss.get_last_update_time(exp_id), last_update_time)
+            assert_equal(LAss._exp_assistants, {})
+            with assert_raises(KeyError):
+                LAss.get_last_update_time("no_experiment")
+            LAss.set_exit()
+        finally:
+            shutil.rmtree(write_dir)
+
+    def test_hibernation_keeps_working_candidates(self):
+        write_dir = tempfile.mkdtemp()
+        try:
+            LAss = LabAssistant(write_dir=write_dir, hibernate_after=10)
+            param_defs = {"x": MinMaxNumericParamDef(0, 1)}
+            exp_id = LAss.init_experiment(
+                "test_hibernation", "RandomSearch", param_defs,
+                optimizer_arguments={"multiprocessing": "none"})
+            cand = LAss.get_next_candidate(exp_id)
+            # Experiments with working candidates are not idle.
+            assert_equal(LAss.hibernate_idle(time.time() + 11), [])
+            assert_true(LAss.hibernate(exp_id))
+            assert_equal(LAss.get_candidates(exp_id)["working"], [cand])
+            cand.result = 1
+            LAss.update(exp_id, "finished", cand)
+            assert_equal(LAss.get_candidates(exp_id)["working"], [])
+            assert_equal(LAss.hibernate_idle(time.time() + 11), [exp_id])
+            LAss.set_exit()
+        finally:
+            shutil.rmtree(write_dir)
+
+    def test_concurrent_hibernation(self):
+        write_dir = tempfile.mkdtemp()
+        try:
+            LAss = LabAssistant(write_dir=write_dir, durability="periodic",
+                                write_interval=100, hibernate_after=10)
+            param_defs = {"x": MinMaxNumericParamDef(0, 1)}
+            exp_id = LAss.init_experiment(
+                "test_hibernation", "RandomSearch", param_defs,
+                optimizer_arguments={"multiprocessing": "none"})
+            cand = LAss.get_next_candidate(exp_id)
+            cand.result = 1
+            LAss.update(exp_id, "finished", cand)
+            exp_ass = LAss._exp_assistants[exp_id]
+            results = []
+            accessor = threading.Thread(target=lambda: results.append(
+                LAss.get_best_candidate(exp_id)))
+            set_exit = exp_ass.set_exit
+
+            def delayed_set_exit():
+                # Access the experiment while it is being hibernated.
+                accessor.start()
+                time.sleep(0.3)
+                set_exit()
+            exp_ass.set_exit = delayed_set_exit
+            assert_equal(LAss.hibernate_idle(time.time() + 11), [exp_id])
+            accessor.join(10)
+            # The reload has to see the state written during hibernation.
+            assert_equal(results, [cand])
+            LAss.set_exit()
+        finally:
+            shutil.rmtree(write_dir)
+
     def test_get_best_candidate(self):
         """
         Tests whether get_best_candidate works.
@@ -81,8 +81,36 @@ class TestCandidate(object):
              "worker_information": None,
              "failed": False,
              "generated_time": cand1.generated_time,
-             "cand_id": cand1.cand_id}
+             "cand_id": cand1.cand_id,
+             "intermediate_results": [],
+             "budget": None,
+             "lease_token": None}
         assert_dict_equal(entry, d)
 
         cand2 = from_dict(entry)
-        assert_equal(cand1, cand2)
\ No newline at end of file
+        assert_equal(cand1, cand2)
+
+    def test_intermediate_results(self):
+        """
+        Tests the intermediate result series.
+            - Default steps are consecutive
+            - The series is append-only
+            - Merging restores earlier entries
+            - The series survives to_dict and from_dict
+        """
+        cand = Candidate({"x": 1})
+        assert_true(cand.add_intermediate_result(0.5))
+        assert_true(cand.add_intermediate_result(0.4))
+        assert_true(cand.add_intermediate_result(0.3, step=5))
+        assert_false(cand.add_intermediate_result(0.2, step=5))
+        assert_equal(cand.intermediate_results, [[0, 0.5], [1, 0.4], [5, 0.3]])
+
+        reported = Candidate({"x": 1}, cand_id=cand.cand_id)
+        reported.add_intermediate_result(0.1, step=6)
+        reported.merge_intermediate_results(cand)
+        assert_equal(reported.intermediate_results,
+                     [[0, 0.5], [1, 0.4], [5, 0.3], [6, 0.1]])
+
+        restored = from_dict(reported.to_dict())
+        assert_equal(restored.intermediate_results,
+                     reported.intermediate_results)
\ No newline at end of file
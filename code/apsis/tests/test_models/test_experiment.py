@@ -5,6 +5,7 @@ from nose.tools import assert_equal, assert_raises, assert_dict_equal, \
     assert_true, assert_false
 from apsis.models.candidate import Candidate
 from apsis.models.parameter_definition import *
+import pickle
 
 class TestExperiment(object):
     exp = None
@@ -75,6 +76,62 @@ class TestExperiment(object):
         with assert_raises(ValueError):
             self.exp.add_finished(False)
 
+    def test_ordered_by_generated_time(self):
+        cands = [Candidate({"x": 1, "name": "A"}) for i in range(3)]
+        for i, c in enumerate(cands):
+            c.generated_time = i
+        for c in cands[1:]:
+            self.exp.add_working(c)
+        self.exp.add_working(cands[0])
+        assert_equal(self.exp.candidates_working, cands)
+        self.exp.add_pausing(cands[2])
+        self.exp.add_pausing(cands[0])
+        assert_equal(self.exp.candidates_pending, [cands[0], cands[2]])
+
+    def test_best_candidate(self):
+        cand = Candidate({"x": 1, "name": "A"})
+        cand2 = Candidate({"x": 0, "name": "B"})
+        cand.result = 1
+        cand2.result = 2
+        self.exp.add_finished(cand)
+        self.exp.add_finished(cand2)
+        assert_equal(self.exp.best_candidate, cand)
+        # The best candidate getting worse or leaving requires a rescan.
+        cand.result = 3
+        self.exp.add_finished(cand)
+        assert_equal(self.exp.best_candidate, cand2)
+        self.exp.add_working(cand2)
+        assert_equal(self.exp.best_candidate, cand)
+        self.exp.add_pausing(cand)
+        assert_equal(self.exp.best_candidate, None)
+
+    def test_result_series(self):
+        cands = [Candidate({"x": 1, "name": "A"}) for i in range(4)]
+        for c, r in zip(cands, [2, None, 1, 3]):
+            c.result = r
+        cands[1].failed = True
+        for c in cands[:2]:
+            self.exp.add_finished(c)
+        step_results, step_best, num_steps = self.exp.get_result_series()
+        assert_equal(num_steps, 2)
+        assert_equal(step_results[0], 2)
+        assert_true(step_results[1] != step_results[1])
+        assert_equal(list(step_best), [2, 2])
+        for c in cands[2:]:
+            self.exp.add_finished(c)
+        # Only extended while candidates are only appended.
+        assert_true(self.exp.get_result_series()[1] is step_best)
+        assert_equal(list(step_best), [2, 2, 1, 1])
+        assert_equal(self.exp.get_result_series(up_to=1)[2], 1)
+        # Removing a finished candidate recomputes the series, leaving the
+        # returned arrays unchanged.
+        self.exp.add_working(cands[2])
+        step_results, new_best, num_steps = self.exp.get_result_series()
+        assert_equal(list(new_best), [2, 2, 2])
+        assert_equal(list(step_best), [2, 2, 1, 1])
+        self.exp.candidates_finished = []
+        assert_equal(self.exp.get_result_series()[2], 0)
+
     def test_better_cand(self):
         cand = Candidate({"x": 1, "name": "B"})
         cand2 = Candidate({"x": 0, "name": "A"})
@@ -119,4 +176,16 @@ class TestExperiment(object):
 
         param_dict = {"x": 1,
                       "name": "A"}
-        assert_true(self.exp._check_param_dict(param_dict))
\ No newline at end of file
+        assert_true(self.exp._check_param_dict(param_dict))
+
+    def test_pickle(self):
+        cand = Candidate({"x": 1, "name": "A"})
+        cand.result = 2
+        self.exp.add_finished(cand)
+        unpickled = pickle.loads(pickle.dumps(self.exp))
+        assert_equal(unpickled.to_dict(), self.exp.to_dict())
+        assert_equal(unpickled.candidates_finished[0], cand)
+        # Loggers are recreated.
+        assert_true(unpickled._logger is not None)
+        assert_true(unpickled.candidates_finished[0]._logger is not None)
+        assert_true(unpickled.parameter_definitions["x"]._logger is not None)
@@ -5,6 +5,8 @@ from nose.tools import assert_equal, assert_raises, assert_items_equal, \
     assert_true, assert_false, assert_almost_equal, assert_less_equal, \
     assert_greater_equal
 import random
+from apsis.utilities.param_def_utilities import dict_to_param_defs, \
+    param_defs_to_dict
 
 class TestParameterDefinitions(object):
 
@@ -198,4 +200,39 @@ class TestParameterDefinitions(object):
         assert_equal(pd.warp_in(-1), [1])
         assert_equal(pd.warp_in(2), [0])
         assert_equal(pd.warp_out([-1]), border)
-        assert_equal(pd.warp_out([1.5]), asymptotic)
\ No newline at end of file
+        assert_equal(pd.warp_out([1.5]), asymptotic)
+
+    def test_encoded_nominal_def(self):
+        values = ["v%s" %i for i in range(10)]
+        with assert_raises(ValueError):
+            EncodedNominalParamDef(values, encoding="embedding")
+        with assert_raises(ValueError):
+            EncodedNominalParamDef(values, value_order=values[:-1])
+
+        pd = EncodedNominalParamDef(values)
+        assert_equal(pd.warped_size(), 1)
+        assert_equal(pd.warp_in("v0"), [0])
+        assert_equal(pd.warp_in("v9"), [1])
+        for v in values:
+            assert_equal(v, pd.warp_out(pd.warp_in(v)))
+        assert_equal(pd.warp_out([0.52]), "v5")
+
+        pd = EncodedNominalParamDef(values, encoding="binary")
+        assert_equal(pd.warped_size(), 4)
+        for i, v in enumerate(values):
+            assert_equal(v, pd.warp_out(pd.warp_in(v)))
+            if i > 0:
+                # Gray codes of neighbouring ranks differ in one bit.
+                diff = sum(abs(a - b) for a, b in
+                           zip(pd.warp_in(v), pd.warp_in(values[i-1])))
+                assert_equal(diff, 1)
+        # Invalid codes are warped out to the nearest valid one.
+        assert_true(pd.is_in_parameter_domain(pd.warp_out([1, 1, 1, 1])))
+
+        pd.set_value_order(list(reversed(values)))
+        assert_equal(pd.warp_in("v9"), [0, 0, 0, 0])
+        for v in values:
+            assert_equal(v, pd.warp_out(pd.warp_in(v)))
+        rebuilt = dict_to_param_defs(param_defs_to_dict({"x": pd}))["x"]
+        assert_equal(rebuilt.value_order, pd.value_order)
+        assert_equal(rebuilt.encoding, "binary")
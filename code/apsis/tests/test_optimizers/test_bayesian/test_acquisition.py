@@ -2,11 +2,14 @@ __author__ = 'Frederik Diehl'
 
 from apsis.optimizers.bayesian_optimization import BayesianOptimizer
 from nose.tools import assert_is_none, assert_equal, assert_dict_equal, \
-    assert_true, assert_false
-from apsis.optimizers.bayesian.acquisition_functions import ExpectedImprovement, ProbabilityOfImprovement
+    assert_true, assert_false, assert_almost_equal
+from apsis.optimizers.bayesian.acquisition_functions import ExpectedImprovement, ProbabilityOfImprovement, \
+    ThompsonSampling
 from apsis.models.experiment import Experiment
-from apsis.models.parameter_definition import MinMaxNumericParamDef
+from apsis.models.parameter_definition import MinMaxNumericParamDef, \
+    NominalParamDef, RangeParamDef
 from apsis.models.candidate import Candidate
+import numpy as np
 
 class testAcquisitionFunction(object):
 
@@ -51,4 +54,117 @@ class testAcquisitionFunction(object):
             exp.add_finished(cand_two)
             opt.update(exp)
         cands = opt.get_next_candidates(num_candidates=3)
-        assert_equal(len(cands), 3)
\ No newline at end of file
+        assert_equal(len(cands), 3)
+
+    def test_evaluate_batch(self):
+        exp = Experiment("test", {"x": MinMaxNumericParamDef(0, 1),
+                                  "y": MinMaxNumericParamDef(0, 1)})
+        opt = BayesianOptimizer(exp, {"initial_random_runs": 3})
+        for i in range(5):
+            cand = opt.get_next_candidates(1)[0]
+            cand.result = cand.params["x"]**2 + cand.params["y"]
+            exp.add_finished(cand)
+            opt.update(exp)
+        for acq in [ExpectedImprovement(), ProbabilityOfImprovement()]:
+            X = acq._gen_random_matrix(exp, 20)
+            batch = acq.evaluate_batch(X, opt.gp, exp)
+            assert_equal(batch.shape, (20,))
+            for i in range(20):
+                single = acq.evaluate(acq._translate_vector_dict(X[i], exp),
+                                      opt.gp, exp)
+                assert_almost_equal(float(single), batch[i])
+        acq = ExpectedImprovement()
+        X = acq._gen_random_matrix(exp, 20)
+        gradients = acq.gradient_batch(X, opt.gp, exp)
+        assert_equal(gradients.shape, (20, 2))
+        for i in range(20):
+            single = acq.gradient(X[i], opt.gp, exp)
+            for j in range(2):
+                assert_almost_equal(single[j], gradients[i, j])
+
+    def test_LBFGSB_multi_start(self):
+        exp = Experiment("test", {"x": MinMaxNumericParamDef(0, 1),
+                                  "y": MinMaxNumericParamDef(0, 1)})
+        opt = BayesianOptimizer(exp, {"initial_random_runs": 3})
+        for i in range(5):
+            cand = opt.get_next_candidates(1)[0]
+            cand.result = cand.params["x"]**2 + cand.params["y"]
+            exp.add_finished(cand)
+            opt.update(exp)
+        acq = ExpectedImprovement({"num_restarts": 4, "num_threads": 2,
+                                   "num_random_samples": 100})
+        max_prop, others = acq.max_searcher_LBFGSB(opt.gp, exp)
+        assert_true(acq.in_hypercube(acq._translate_dict_vector(max_prop[0])))
+        for prop in others:
+            assert_true(max_prop[1] <= prop[1])
+
+        merged = acq._merge_optima([({"x": [0.5], "y": [0.5]}, -1),
+                                    ({"x": [0.5], "y": [0.50001]}, -0.5),
+                                    ({"x": [0.2], "y": [0.5]}, -0.7)], 1e-4)
+        assert_equal([m[1] for m in merged], [-1, -0.7])
+
+    def test_thompson_sampling(self):
+        exp = Experiment("test", {"x": MinMaxNumericParamDef(0, 1),
+                                  "y": MinMaxNumericParamDef(0, 1)})
+        opt = BayesianOptimizer(exp, {"initial_random_runs": 3,
+                                      "acquisition": "ThompsonSampling",
+                                      "acquisition_hyperparams": {
+                                          "num_restarts": 2,
+                                          "num_random_samples": 100}})
+        assert_true(isinstance(opt.acquisition_function, ThompsonSampling))
+        for i in range(5):
+            cand = opt.get_next_candidates(1)[0]
+            cand.result = cand.params["x"]**2 + cand.params["y"]
+            exp.add_finished(cand)
+            opt.update(exp)
+        acq = opt.acquisition_function
+        acq._draw_sample(opt.gp)
+        X = acq._gen_random_matrix(exp, 10)
+        batch = acq.evaluate_batch(X, opt.gp, exp)
+        gradients = acq.gradient_batch(X, opt.gp, exp)
+        eps = 1e-6
+        for i in range(10):
+            assert_almost_equal(acq.evaluate(X[i], opt.gp, exp), batch[i])
+            for j in range(2):
+                x_eps = X[i].copy()
+                x_eps[j] += eps
+                numeric = (acq.evaluate(x_eps, opt.gp, exp) - batch[i]) / eps
+                assert_almost_equal(numeric, gradients[i, j], places=3)
+        # The sample is kept for copies of the gp.
+        assert_almost_equal(acq.evaluate_batch(X, opt.gp.copy(), exp)[0],
+                            batch[0])
+
+        # A new sample is a different function.
+        acq._draw_sample(opt.gp)
+        assert_false(np.allclose(acq.evaluate_batch(X, opt.gp, exp), batch))
+
+        cands = opt.get_next_candidates(4)
+        assert_equal(len(cands), 4)
+
+    def test_mixed_searcher(self):
+        exp = Experiment("test", {"x": MinMaxNumericParamDef(0, 1),
+                                  "kind": NominalParamDef(["a", "b", "c"]),
+                                  "n": RangeParamDef(0, 5)})
+        opt = BayesianOptimizer(exp, {"initial_random_runs": 3})
+        for i in range(6):
+            cand = opt.get_next_candidates(1)[0]
+            offset = {"a": 0, "b": 1, "c": 0.5}[cand.params["kind"]]
+            cand.result = (cand.params["x"] - 0.3)**2 + offset + \
+                          cand.params["n"]
+            exp.add_finished(cand)
+            opt.update(exp)
+        acq = opt.acquisition_function
+        assert_equal(acq._get_max_searcher(exp), "mixed")
+        acq.params["num_random_samples"] = 50
+        acq.params["num_restarts"] = 3
+        max_prop, others = acq.max_searcher_mixed(opt.gp, exp)
+        for x_dict, score in [max_prop] + others:
+            assert_true(sorted(x_dict["kind"]) in [[0, 0, 1]])
+            assert_true(x_dict["n"][0] in [0, 0.25, 0.5, 0.75, 1])
+            # The score is that of the valid configuration.
+            assert_almost_equal(
+                acq._compute_minimizing_evaluate_batch(
+                    np.array([acq._translate_dict_vector(x_dict)]),
+                    opt.gp, exp)[0], score)
+        acq.params["max_searcher"] = "LBFGSB"
+        assert_equal(acq._get_max_searcher(exp), "LBFGSB")
@@ -5,9 +5,14 @@ from nose.tools import assert_is_none, assert_equal, assert_dict_equal, \
     assert_true, assert_false, assert_less_equal
 from apsis.optimizers.bayesian.acquisition_functions import ExpectedImprovement, ProbabilityOfImprovement
 from apsis.models.experiment import Experiment
-from apsis.models.parameter_definition import MinMaxNumericParamDef, NominalParamDef
+from apsis.models.parameter_definition import MinMaxNumericParamDef, \
+    NominalParamDef, EncodedNominalParamDef
 from apsis.models.candidate import Candidate
 from apsis.utilities.import_utils import import_if_exists
+import numpy as np
+import tempfile
+import shutil
+import os
 
 class testBayesianOptimization(object):
 
@@ -53,4 +58,96 @@ class testBayesianOptimization(object):
             exp.add_finished(cand)
             opt.update(exp)
         cands = opt.get_next_candidates(num_candidates=3)
-        assert_less_equal(len(cands), 3)
\ No newline at end of file
+        assert_less_equal(len(cands), 3)
+
+    def test_num_precomputed(self):
+        exp = Experiment("test", {"x": MinMaxNumericParamDef(0, 1)})
+        opt = BayesianOptimizer(exp, {"initial_random_runs": 3,
+                                      "num_precomputed": 5})
+        for i in range(4):
+            cand = opt.get_next_candidates()[0]
+            assert_true(isinstance(cand, Candidate))
+            cand.result = (cand.params["x"] - 0.5)**2
+            exp.add_finished(cand)
+            opt.update(exp)
+        assert_equal(len(opt._proposal_pool), 5)
+        scores = [p[1] for p in opt._proposal_pool]
+        assert_equal(scores, sorted(scores, reverse=True))
+        # After an update, the maximum is searched for again.
+        cands = opt.get_next_candidates(num_candidates=2)
+        assert_equal(len(cands), 2)
+        assert_equal(len(opt._proposal_pool), 5)
+        # Without a new update, candidates are popped from the pool.
+        cands = opt.get_next_candidates(num_candidates=2)
+        assert_equal(len(cands), 2)
+        assert_equal(len(opt._proposal_pool), 3)
+
+    def test_rescore_candidates(self):
+        exp = Experiment("test", {"x": MinMaxNumericParamDef(0, 1)})
+        opt = BayesianOptimizer(exp, {"initial_random_runs": 3,
+                                      "num_gp_restarts": 1,
+                                      "rescore_threshold": 0.5})
+        stale = [Candidate({"x": x}) for x in [0, 1]]
+        # Random candidates are kept before the gp is used.
+        assert_equal(opt.rescore_candidates(stale), stale)
+        for x in [0, 0.1, 0.2, 0.45, 0.55, 0.8, 0.9, 1]:
+            cand = Candidate({"x": x})
+            cand.result = np.sin(6 * x)
+            exp.add_finished(cand)
+        opt.update(exp)
+        # The candidate far from the minimum is dropped.
+        kept = opt.rescore_candidates(stale)
+        assert_equal(kept, [stale[1]])
+        assert_equal(opt.rescore_candidates([]), [])
+        # Poor candidates are dropped even if all of them are poor.
+        poor = [Candidate({"x": x}) for x in [0, 0.1, 0.2]]
+        assert_equal(opt.rescore_candidates(poor), [])
+
+    def test_order_encoded_values(self):
+        values = ["v%s" %i for i in range(20)]
+        exp = Experiment("test", {"x": MinMaxNumericParamDef(0, 1),
+                                  "c": EncodedNominalParamDef(values)})
+        opt = BayesianOptimizer(exp, {"initial_random_runs": 3,
+                                      "num_gp_restarts": 1})
+        for i in range(5):
+            cand = opt.get_next_candidates()[0]
+            assert_true(cand.params["c"] in values)
+            cand.result = -values.index(cand.params["c"]) + cand.params["x"]
+            exp.add_finished(cand)
+            opt.update(exp)
+        assert_equal(opt.gp.X.shape[1], 2)
+        order = exp.parameter_definitions["c"].value_order
+        seen = [v for v in order if v in
+                [c.params["c"] for c in exp.candidates_finished]]
+        # Seen values come first, the best (highest index) first.
+        assert_equal(order[:len(seen)], seen)
+        assert_equal(seen, sorted(seen, key=lambda v: -values.index(v)))
+
+    def test_checkpoint(self):
+        checkpoint_dir = tempfile.mkdtemp()
+        try:
+            exp = Experiment("test", {"x": MinMaxNumericParamDef(0, 1)})
+            opt = BayesianOptimizer(exp, {"initial_random_runs": 3,
+                                          "checkpoint_dir": checkpoint_dir})
+            for i in range(4):
+                cand = opt.get_next_candidates()[0]
+                cand.result = (cand.params["x"] - 0.5)**2
+                exp.add_finished(cand)
+                opt.update(exp)
+            checkpoint_file = os.path.join(checkpoint_dir,
+                                           "surrogate_state.json")
+            assert_true(os.path.isfile(checkpoint_file))
+
+            # A restarted optimizer restores the hyperparameters without
+            # refitting, since the data is unchanged.
+            restarted = BayesianOptimizer(exp, {
+                "initial_random_runs": 3, "checkpoint_dir": checkpoint_dir,
+                "num_gp_restarts": 0})
+            restarted.gp = None
+            restarted.update(exp)
+            assert_true(np.allclose(restarted.gp.param_array,
+                                    opt.gp.param_array))
+            # Only the first refit uses the checkpoint.
+            assert_true(restarted._load_checkpoint() is None)
+        finally:
+            shutil.rmtree(checkpoint_dir)
@@ -0,0 +1,84 @@
+__author__ = 'Frederik Diehl'
+
+from apsis.optimizers.hyperband import Hyperband
+from apsis.assistants.experiment_assistant import ExperimentAssistant
+from nose.tools import assert_equal, assert_true, assert_false, \
+    assert_raises, assert_almost_equal
+from apsis.models.experiment import Experiment
+from apsis.models.parameter_definition import MinMaxNumericParamDef
+from apsis.models.candidate import Candidate
+
+
+class test_Hyperband(object):
+    def test_init(self):
+        exp = Experiment("test", {"x": MinMaxNumericParamDef(0, 1)})
+        opt = Hyperband(exp, {"min_budget": 1, "max_budget": 27, "eta": 3})
+        assert_equal(len(opt.rung_budgets), 4)
+        for b, expected in zip(opt.rung_budgets, [1, 3, 9, 27]):
+            assert_almost_equal(b, expected)
+        with assert_raises(ValueError):
+            Hyperband(exp, {"min_budget": 10, "max_budget": 1})
+        with assert_raises(ValueError):
+            Hyperband(exp, {"eta": 1})
+
+    def test_get_next_candidates(self):
+        exp = Experiment("test", {"x": MinMaxNumericParamDef(0, 1)})
+        opt = Hyperband(exp, {"min_budget": 1, "max_budget": 9, "eta": 3})
+        cands = opt.get_next_candidates(num_candidates=6)
+        assert_equal(len(cands), 6)
+        for c in cands:
+            assert_true(isinstance(c, Candidate))
+            assert_true(c.budget in opt.rung_budgets)
+        # The most aggressive bracket is the largest.
+        assert_true(sum(c.budget == opt.rung_budgets[0] for c in cands) >= 3)
+
+    def test_promotion(self):
+        exp = Experiment("test", {"x": MinMaxNumericParamDef(0, 1)})
+        eass = ExperimentAssistant("Hyperband", exp, optimizer_arguments={
+            "multiprocessing": "none", "min_budget": 1, "max_budget": 9,
+            "eta": 3, "random_state": 42})
+        budgets_seen = set()
+        for i in range(60):
+            cand = eass.get_next_candidate()
+            assert_false(cand is None)
+            budgets_seen.add(cand.budget)
+            cand.result = cand.params["x"] / cand.budget
+            if cand.budget == 9:
+                eass.update(cand, "finished")
+            else:
+                eass.update(cand, "pausing")
+                assert_true(cand.intermediate_results[-1][0] == cand.budget)
+        assert_equal(budgets_seen, set([1, 3, 9]))
+        for c in exp.candidates_finished:
+            # Promoted candidates keep their series.
+            if c.intermediate_results:
+                assert_true(c.intermediate_results[0][0] < 9)
+        eass.set_exit()
+
+    def test_resume_interrupted(self):
+        exp = Experiment("test", {"x": MinMaxNumericParamDef(0, 1)})
+        eass = ExperimentAssistant("Hyperband", exp, optimizer_arguments={
+            "multiprocessing": "none", "max_budget": 9})
+        cand = eass.get_next_candidate()
+        # Pausing without a result, so the budget has not been reached.
+        eass.update(cand, "pausing")
+        resumed = eass.get_next_candidate()
+        assert_equal(resumed.cand_id, cand.cand_id)
+        assert_equal(resumed.budget, cand.budget)
+        eass.set_exit()
+
+    def test_issued_until_working(self):
+        exp = Experiment("test", {"x": MinMaxNumericParamDef(0, 1)})
+        opt = Hyperband(exp, {"min_budget": 1, "max_budget": 9, "eta": 3})
+        paused = Candidate({"x": 0.5})
+        exp.add_pausing(paused)
+        opt.update(exp)
+        cands = opt.get_next_candidates()
+        assert_equal(cands[0].cand_id, paused.cand_id)
+        # An update before the candidate is working keeps it issued.
+        opt.update(exp)
+        cands = opt.get_next_candidates()
+        assert_true(cands[0].cand_id != paused.cand_id)
+        exp.add_working(paused)
+        opt.update(exp)
+        assert_false(paused.cand_id in opt._issued)
@@ -1,13 +1,17 @@
 __author__ = 'Frederik Diehl'
 
 from apsis.optimizers.optimizer import Optimizer, QueueBasedOptimizer, \
-    QueueBackend
+    QueueBackend, ProcessBasedOptimizer
 from apsis.models.experiment import Experiment
+from apsis.models.candidate import Candidate
 from apsis.models.parameter_definition import *
-from nose.tools import assert_raises
+from nose.tools import assert_raises, assert_false, assert_true, \
+    assert_equal, assert_almost_equal
 from apsis.optimizers.random_search import RandomSearch
 from multiprocessing import Queue
 import time
+import threading
+import Queue as thread_queue
 
 class TestOptimizer(object):
     optimizer = None
@@ -46,6 +50,40 @@ class TestOptimizer(object):
                                 parameter_definitions=param_def)
         assert_raises(ValueError, self.optimizer.update, experiment)
 
+    def test_update_delta(self):
+        cand_1 = Candidate({"x": 0.1})
+        cand_2 = Candidate({"x": 0.2})
+        cand_1.result = 1
+        self.optimizer.update_delta([(1, "working", cand_1),
+                                     (2, "working", cand_2),
+                                     (3, "finished", cand_1)])
+        mirror = self.optimizer._experiment
+        assert_equal(mirror.candidates_finished, [cand_1])
+        assert_equal(mirror.candidates_working, [cand_2])
+        # Already applied deltas are ignored.
+        self.optimizer.update_delta([(2, "working", cand_2),
+                                     (4, "pausing", cand_2)])
+        assert_equal(mirror.candidates_working, [])
+        assert_equal(mirror.candidates_pending, [cand_2])
+        self.optimizer.update_delta([(3, "working", cand_1)])
+        assert_equal(mirror.candidates_finished, [cand_1])
+        assert_equal(self.optimizer._delta_seq, 4)
+
+    def test_update_delta_shared_experiment(self):
+        experiment = self.optimizer._experiment
+        cand = Candidate({"x": 0.1})
+        cand.result = 1
+        experiment.add_finished(cand)
+        experiment.get_result_series()
+        last_update_time = experiment.last_update_time
+        # Deltas already applied to the shared experiment are skipped.
+        self.optimizer.update_delta([(1, "finished", cand)])
+        assert_equal(self.optimizer._delta_seq, 1)
+        assert_equal(experiment.candidates_finished, [cand])
+        assert_true(experiment._series_source is
+                    experiment.candidates_finished)
+        assert_equal(experiment.last_update_time, last_update_time)
+
 class TestQueueOptimizer(object):
     optimizer = None
 
@@ -61,6 +99,11 @@ class TestQueueOptimizer(object):
     def test_get_next_candidate(self):
         self.optimizer.get_next_candidates()
 
+    def test_get_next_candidate_timeout(self):
+        # Waits for the backend instead of returning an empty list.
+        candidates = self.optimizer.get_next_candidates(timeout=5)
+        assert_equal(len(candidates), 1)
+
     def test_update(self):
         param_def = {
             "x": MinMaxNumericParamDef(0, 1)
@@ -69,6 +112,24 @@ class TestQueueOptimizer(object):
                                 parameter_definitions=param_def)
         self.optimizer.update(experiment)
 
+    def test_update_delta_copies(self):
+        in_queue = self.optimizer._optimizer_in_queue
+        sent = []
+        put = in_queue.put
+
+        def record_put(item):
+            sent.append(item)
+            put(item)
+        in_queue.put = record_put
+        cand = Candidate({"x": 0.1})
+        self.optimizer.update_delta([(1, "working", cand)])
+        # The backend gets a copy, unaffected by later changes.
+        cand.result = 1
+        sent_cand = sent[0][1][0][2]
+        assert_true(sent_cand is not cand)
+        assert_equal(sent_cand, cand)
+        assert_equal(sent_cand.result, None)
+
     def teardown(self):
         self.optimizer.exit()
 
@@ -105,4 +166,92 @@ class TestQueueBackend(object):
         self.backend._check_update()
 
     def test_check_generation(self):
-        self.backend._check_generation()
\ No newline at end of file
+        self.backend._check_generation()
+
+    def test_target_candidates(self):
+        backend = QueueBackend(RandomSearch, self.experiment,
+                               thread_queue.Queue(), thread_queue.Queue(),
+                               {"min_candidates": 2, "max_candidates": 20})
+        assert_equal(backend._target_candidates(), 2)
+        backend._check_generation()
+        assert_equal(backend._out_queue.qsize(), 2)
+        assert_true(backend._proposal_time is not None)
+        # 10 candidates per second, each taking 0.2 seconds to generate.
+        now = time.time()
+        for i in range(11):
+            backend._in_queue.put(("demand", 10, now - 10 + i))
+        backend._check_update()
+        assert_almost_equal(backend._demand_rate(now), 10)
+        # Without further requests, the rate decays.
+        assert_almost_equal(backend._demand_rate(now + 90), 1)
+        backend._proposal_time = 0.2
+        assert_equal(backend._target_candidates(), 8)
+        backend._proposal_time = 10
+        assert_equal(backend._target_candidates(), 20)
+        backend._proposal_time = 0.2
+        backend._check_generation()
+        assert_equal(backend._out_queue.qsize(), 8)
+
+    def test_rescore_out_queue(self):
+        backend = QueueBackend(RandomSearch, self.experiment,
+                               thread_queue.Queue(), thread_queue.Queue())
+        backend._check_generation()
+        num_ready = backend._out_queue.qsize()
+        assert_true(num_ready > 0)
+        # Random candidates stay valid after an update.
+        backend._in_queue.put(self.experiment)
+        backend._check_update()
+        assert_equal(backend._out_queue.qsize(), num_ready)
+
+    def test_event_driven(self):
+        # Candidates hold loggers, so use thread queues as the
+        # QueueBasedOptimizer does.
+        backend = QueueBackend(RandomSearch, self.experiment,
+                               thread_queue.Queue(), thread_queue.Queue())
+        thread = threading.Thread(target=backend.run)
+        thread.start()
+        try:
+            # Candidates are generated without waiting for a message.
+            backend._out_queue.get(timeout=1)
+            while not backend._out_queue.empty():
+                backend._out_queue.get(timeout=1)
+            backend._in_queue.put("demand")
+            backend._out_queue.get(timeout=1)
+        finally:
+            backend._in_queue.put("exit")
+        thread.join(1)
+        assert_false(thread.is_alive())
+
+
+class TestProcessOptimizer(object):
+
+    def test_process(self):
+        param_def = {
+            "x": MinMaxNumericParamDef(0, 1)
+        }
+        experiment = Experiment(name="test_optimizer_experiment",
+                                parameter_definitions=param_def)
+        optimizer = ProcessBasedOptimizer(RandomSearch, experiment)
+        try:
+            assert_true(optimizer._optimizer_process.is_alive())
+            candidates = []
+            for i in range(50):
+                candidates = optimizer.get_next_candidates()
+                if candidates:
+                    break
+                time.sleep(0.1)
+            assert_equal(len(candidates), 1)
+            candidates[0].result = 1
+            experiment.add_finished(candidates[0])
+            optimizer.update(experiment)
+            # Later changes must not reach the queued experiment.
+            queued = []
+            optimizer._optimizer_in_queue.put = queued.append
+            optimizer.update(experiment)
+            del optimizer._optimizer_in_queue.put
+            experiment.candidates_finished[0].result = 2
+            assert_equal(queued[0].candidates_finished[0].result, 1)
+        finally:
+            process = optimizer._optimizer_process
+            optimizer.exit()
+        assert_false(process.is_alive())
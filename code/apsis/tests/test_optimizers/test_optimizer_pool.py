@@ -0,0 +1,78 @@
+__author__ = 'Frederik Diehl'
+
+from apsis.optimizers.optimizer_pool import OptimizerPool, PooledOptimizer
+from apsis.optimizers.random_search import RandomSearch
+from apsis.models.experiment import Experiment
+from apsis.models.parameter_definition import MinMaxNumericParamDef
+from nose.tools import assert_equal, assert_raises
+import threading
+import time
+
+
+class BackendStub(object):
+    exited = False
+
+    def __init__(self, name, steps, release=None):
+        self.name = name
+        self.steps = steps
+        self.release = release
+
+    def step(self):
+        if self.release is not None:
+            self.release.wait(1)
+        self.steps.append(self.name)
+
+
+class TestOptimizerPool(object):
+
+    def test_priorities(self):
+        pool = OptimizerPool(num_workers=1)
+        try:
+            steps = []
+            release = threading.Event()
+            blocker = BackendStub("blocker", steps, release)
+            pool.schedule(blocker, OptimizerPool.PRIORITY_DEMAND)
+            time.sleep(0.1)
+            # Scheduled while running, so it is rerun once afterwards.
+            pool.schedule(blocker, OptimizerPool.PRIORITY_DEMAND)
+            pool.schedule(blocker, OptimizerPool.PRIORITY_DEMAND)
+            demand = BackendStub("demand", steps)
+            waiting = BackendStub("waiting", steps)
+            update = BackendStub("update", steps)
+            pool.schedule(demand, OptimizerPool.PRIORITY_DEMAND)
+            pool.schedule(update, OptimizerPool.PRIORITY_UPDATE)
+            pool.schedule(waiting, OptimizerPool.PRIORITY_DEMAND)
+            # A better priority replaces the queued one.
+            pool.schedule(waiting, OptimizerPool.PRIORITY_WAITING)
+            release.set()
+            for i in range(50):
+                if len(steps) == 5:
+                    break
+                time.sleep(0.02)
+            assert_equal(steps[:4], ["blocker", "waiting", "update", "demand"])
+            assert_equal(steps[4], "blocker")
+        finally:
+            pool.exit()
+
+    def test_pooled_optimizer(self):
+        pool = OptimizerPool(num_workers=2)
+        exp = Experiment("test", {"x": MinMaxNumericParamDef(0, 1)})
+        with assert_raises(ValueError):
+            PooledOptimizer(RandomSearch, exp, {})
+        optimizers = [PooledOptimizer(RandomSearch, exp,
+                                      {"optimizer_pool": pool})
+                      for i in range(3)]
+        try:
+            for opt in optimizers:
+                cands = []
+                for i in range(50):
+                    cands = opt.get_next_candidates()
+                    if cands:
+                        break
+                    time.sleep(0.02)
+                assert_equal(len(cands), 1)
+                opt.update(exp)
+        finally:
+            for opt in optimizers:
+                opt.exit()
+            pool.exit()
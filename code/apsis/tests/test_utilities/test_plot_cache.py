@@ -0,0 +1,82 @@
+__author__ = 'Frederik Diehl'
+
+from apsis.utilities.plot_cache import PlotCache
+from nose.tools import assert_raises, assert_equal, assert_true
+import time
+
+
+class TestPlotCache(object):
+    cache = None
+
+    def setup(self):
+        self.cache = PlotCache()
+
+    def teardown(self):
+        self.cache.exit()
+
+    def _data_function(self, calls):
+        def data_function():
+            calls.append(True)
+            plots = [{"x": [1, 2, 3], "y": [3, 1, 2], "label": "result",
+                      "color": "b"}]
+            return plots, {"title": "test"}
+        return data_function
+
+    def test_init(self):
+        with assert_raises(ValueError):
+            PlotCache(num_processes=0)
+
+    def test_get_png(self):
+        calls = []
+        version, png = self.cache.get_png("a", 1, self._data_function(calls))
+        assert_equal(version, 1)
+        assert_true(png.startswith("\x89PNG"))
+        # The same version is only rendered once.
+        assert_equal(self.cache.get_png("a", 1, self._data_function(calls)),
+                     (1, png))
+        assert_equal(len(calls), 1)
+        self.cache.invalidate("a")
+        assert_equal(self.cache.get_png("a", 2,
+                                        self._data_function(calls))[0], 2)
+        assert_equal(len(calls), 2)
+
+    def test_stale_png(self):
+        calls = []
+        version, png = self.cache.get_png("a", 1, self._data_function(calls))
+        # A new version is rendered in the background, while the old one is
+        # returned.
+        assert_equal(self.cache.get_png("a", 2, self._data_function(calls)),
+                     (1, png))
+        rendering = self.cache._rendering["a"]
+        assert_equal(self.cache.get_png("a", 2, self._data_function(calls)),
+                     (1, png))
+        assert_equal(len(calls), 2)
+        rendering[1].wait(10)
+        time.sleep(0.1)
+        assert_equal(self.cache.get_png("a", 2,
+                                        self._data_function(calls))[0], 2)
+        assert_equal(len(calls), 2)
+        assert_equal(self.cache._rendering, {})
+
+    def test_failed_rendering(self):
+        def data_function():
+            return [{"x": [1, 2], "y": [1]}], {}
+        with assert_raises(Exception):
+            self.cache.get_png("a", 1, data_function)
+        # The failed rendering is not reused.
+        assert_equal(self.cache._rendering, {})
+        calls = []
+        version, png = self.cache.get_png("a", 1, self._data_function(calls))
+        assert_true(png.startswith("\x89PNG"))
+
+    def test_failed_background_rendering(self):
+        def data_function():
+            return [{"x": [1, 2], "y": [1]}], {}
+        calls = []
+        version, png = self.cache.get_png("a", 1, self._data_function(calls))
+        assert_equal(self.cache.get_png("a", 2, data_function), (1, png))
+        self.cache._rendering["a"][1].wait(10)
+        # The failed rendering is replaced by a new one.
+        assert_equal(self.cache.get_png("a", 2, self._data_function(calls)),
+                     (1, png))
+        assert_equal(len(calls), 2)
@@ -0,0 +1,71 @@
+__author__ = 'Frederik Diehl'
+
+from apsis.utilities.state_writer import StateWriter
+from nose.tools import assert_raises, assert_equal, assert_true, \
+    assert_false
+import tempfile
+import shutil
+import json
+import os
+import time
+
+
+class TestStateWriter(object):
+    directory = None
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def _state_function(self, value, calls):
+        def state_function():
+            calls.append(value)
+            return [(os.path.join(self.directory, "state.json"),
+                     {"value": value})]
+        return state_function
+
+    def _read(self):
+        with open(os.path.join(self.directory, "state.json"), "r") as infile:
+            return json.load(infile)["value"]
+
+    def test_init(self):
+        with assert_raises(ValueError):
+            StateWriter("never")
+        with assert_raises(ValueError):
+            StateWriter("periodic", interval=0)
+
+    def test_fsync(self):
+        writer = StateWriter("fsync")
+        calls = []
+        writer.mark_dirty("a", self._state_function(1, calls))
+        assert_equal(self._read(), 1)
+        writer.exit()
+
+    def test_periodic_coalesces(self):
+        writer = StateWriter("periodic", interval=100)
+        calls = []
+        for i in range(5):
+            writer.mark_dirty("a", self._state_function(i, calls))
+        assert_false(os.path.isfile(os.path.join(self.directory,
+                                                 "state.json")))
+        # Only the last state is written, once.
+        writer.exit()
+        assert_equal(calls, [4])
+        assert_equal(self._read(), 4)
+
+    def test_batched(self):
+        writer = StateWriter("batched")
+        calls = []
+        writer.mark_dirty("a", self._state_function(1, calls))
+        # The file is replaced atomically, so it is complete once it exists.
+        for i in range(50):
+            if os.path.isfile(os.path.join(self.directory, "state.json")):
+                break
+            time.sleep(0.1)
+        assert_equal(self._read(), 1)
+        writer.exit()
+        # After exit, states are written immediately.
+        writer.mark_dirty("a", self._state_function(2, calls))
+        assert_equal(self._read(), 2)
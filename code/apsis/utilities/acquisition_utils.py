@@ -5,7 +5,8 @@ import numpy as np
 
 AVAILABLE_ACQUISITIONS = {
     "ExpectedImprovement": acquisition_functions.ExpectedImprovement,
-    "ProbabilityOfImprovement": acquisition_functions.ProbabilityOfImprovement
+    "ProbabilityOfImprovement": acquisition_functions.ProbabilityOfImprovement,
+    "ThompsonSampling": acquisition_functions.ThompsonSampling
 }
 
 
@@ -106,4 +107,54 @@ def create_cand_matrix_vector(experiment, failed_treat):
             results_vector[i] = failed_value
         else:
             results_vector[i] = c.result
-    return candidate_matrix, results_vector
\ No newline at end of file
+    return candidate_matrix, results_vector
+
+def create_warm_start_matrix_vector(experiment, source_experiment):
+    """
+    Creates the candidate matrix and result vector of a source experiment.
+
+    The source candidates are warped with the parameter definitions of
+    experiment, so that the matrix is compatible with the one returned by
+    create_cand_matrix_vector for experiment. Failed candidates and
+    candidates outside of experiment's parameter domain are ignored.
+
+    Parameters
+    ----------
+    experiment : Experiment
+        The experiment whose parameter definitions to use.
+    source_experiment : Experiment
+        The experiment whose finished candidates to use. Must have the same
+        parameter names as experiment.
+
+    Returns
+    -------
+    candidate_matrix : np.array
+        The warped candidates, one row per candidate. May have zero rows.
+    results_vector : np.array
+        The column vector of the corresponding results.
+    """
+    parameter_warped_size = 0
+    for p in experiment.parameter_definitions.values():
+        parameter_warped_size += p.warped_size()
+    param_names = sorted(experiment.parameter_definitions.keys())
+
+    rows = []
+    results = []
+    for c in source_experiment.candidates_finished:
+        if c.failed or c.result is None:
+            continue
+        if not experiment._check_param_dict(c.params):
+            continue
+        warped_in = experiment.warp_pt_in(c.params)
+        param_values = []
+        for pn in param_names:
+            param_values.extend(warped_in[pn])
+        rows.append(param_values)
+        results.append([c.result])
+
+    candidate_matrix = np.zeros((len(rows), parameter_warped_size))
+    results_vector = np.zeros((len(rows), 1))
+    if rows:
+        candidate_matrix[:, :] = rows
+        results_vector[:, :] = results
+    return candidate_matrix, results_vector
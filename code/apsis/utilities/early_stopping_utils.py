@@ -0,0 +1,53 @@
+__author__ = 'Frederik Diehl'
+
+from apsis.assistants import early_stopping
+
+AVAILABLE_STOPPING_RULES = {
+    "MedianStoppingRule": early_stopping.MedianStoppingRule,
+    "CurveExtrapolationRule": early_stopping.CurveExtrapolationRule
+}
+
+
+def check_early_stopping(rule, rule_params=None):
+    """
+    Checks whether rule is an early stopping rule or builds one.
+
+    Parameters
+    ----------
+    rule : None, string, EarlyStoppingRule instance or class
+        The early stopping rule to initialize. If None, no rule is used and
+        None is returned. If instance, the other parameters will be ignored.
+    rule_params : dict, optional
+        The parameters governing the behaviour of the rule. If None, default
+        values are used.
+
+    Returns
+    -------
+    rule : EarlyStoppingRule instance or None
+        An initialized rule instance, or None if rule was None.
+
+    Raises
+    ------
+    ValueError
+        If the rule is a string, and one cannot find it in
+        AVAILABLE_STOPPING_RULES. If not an EarlyStoppingRule subclass.
+    """
+    if rule is None:
+        return None
+
+    if isinstance(rule, early_stopping.EarlyStoppingRule):
+        return rule
+
+    if isinstance(rule, basestring):
+        try:
+            rule = AVAILABLE_STOPPING_RULES[rule]
+        except KeyError:
+            raise ValueError("No corresponding early stopping rule found for "
+                             "%s. Rule must be in %s" %(
+                str(rule), AVAILABLE_STOPPING_RULES.keys()))
+
+    if not isinstance(rule, type) or \
+            not issubclass(rule, early_stopping.EarlyStoppingRule):
+        raise ValueError("%s is of type %s, not EarlyStoppingRule type."
+                         %(rule, type(rule)))
+    return rule(rule_params)
@@ -1,4 +1,5 @@
 import os
+import json
 
 def ensure_directory_exists(directory):
         """
@@ -10,4 +11,31 @@ def ensure_directory_exists(directory):
             The name of the directory that shall be created if not exists.
         """
         if not os.path.exists(directory):
-                os.makedirs(directory)
\ No newline at end of file
+                os.makedirs(directory)
+
+def write_json_atomic(filename, obj):
+        """
+        Writes obj as json to filename, replacing the file atomically.
+
+        The json is first written to a temporary file in the same directory,
+        which is then renamed to filename. Readers therefore see either the
+        old or the new file, never a partially written one.
+
+        Parameters
+        ----------
+        filename : String
+            The file to write.
+        obj : json-serializable object
+            The object to write.
+        """
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, "w") as outfile:
+                json.dump(obj, outfile)
+                outfile.flush()
+                os.fsync(outfile.fileno())
+        try:
+                os.rename(tmp_filename, filename)
+        except OSError:
+                # Windows does not replace existing files on rename.
+                os.remove(filename)
+                os.rename(tmp_filename, filename)
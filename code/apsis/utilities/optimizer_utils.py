@@ -1,12 +1,16 @@
 __author__ = 'Frederik Diehl'
 
 from apsis.optimizers.random_search import RandomSearch
-from apsis.optimizers.optimizer import Optimizer, QueueBasedOptimizer
+from apsis.optimizers.optimizer import Optimizer, QueueBasedOptimizer, \
+    ProcessBasedOptimizer
 from apsis.optimizers.bayesian_optimization import BayesianOptimizer
+from apsis.optimizers.hyperband import Hyperband
+from apsis.optimizers.optimizer_pool import PooledOptimizer
 import numpy as np
 
 AVAILABLE_OPTIMIZERS = {"RandomSearch": RandomSearch,
-                        "BayOpt": BayesianOptimizer}
+                        "BayOpt": BayesianOptimizer,
+                        "Hyperband": Hyperband}
 
 def check_optimizer(optimizer, experiment, optimizer_arguments=None):
     """
@@ -30,7 +34,12 @@ def check_optimizer(optimizer, experiment, optimizer_arguments=None):
         default values are used.
         This class introduces an additional parameter, called multiprocessing.
         If "queue", the default, it will initialize the optimizer abstracted by
-        a QueueBasedOptimizer. If "none", it will initialize it directly.
+        a QueueBasedOptimizer running in a thread. If "process", it will
+        initialize it abstracted by a ProcessBasedOptimizer, running in its
+        own process. If "pool", it will initialize it abstracted by a
+        PooledOptimizer, whose backend runs on the OptimizerPool given as
+        optimizer_arguments["optimizer_pool"]. If "none", it will initialize
+        it directly.
 
     Returns
     -------
@@ -65,9 +74,14 @@ def check_optimizer(optimizer, experiment, optimizer_arguments=None):
 
     if multi_architecture == "queue":
         return QueueBasedOptimizer(optimizer, experiment, optimizer_arguments)
+    elif multi_architecture == "process":
+        return ProcessBasedOptimizer(optimizer, experiment,
+                                     optimizer_arguments)
+    elif multi_architecture == "pool":
+        return PooledOptimizer(optimizer, experiment, optimizer_arguments)
     elif multi_architecture == "none":
         return optimizer(experiment, optimizer_arguments)
     else:
         raise ValueError("%s is not supported as a multi-architecture "
                          "parameter. Currently supported are %s" %(
-            multi_architecture, ["none", "queue"]))
\ No newline at end of file
+            multi_architecture, ["none", "queue", "process", "pool"]))
\ No newline at end of file
@@ -0,0 +1,200 @@
+__author__ = 'Frederik Diehl'
+
+from apsis.utilities import logging_utils
+from apsis.utilities.plot_utils import render_png
+import multiprocessing
+import threading
+
+
+class PlotCache(object):
+    """
+    Caches rendered PNG plots, rendering them in a process pool.
+
+    Every plot is identified by a key (for example an experiment's id) and a
+    version (for example its last_update_time). A plot is only rendered again
+    once its version changes. Rendering happens in separate processes, so
+    that it does not hold the GIL of the requesting threads. Once a plot has
+    been rendered, requests for a new version start its rendering in the
+    background and get the last rendered plot until it is finished; only
+    the first request for a plot waits for its rendering. There is at most
+    one rendering per key. A failed or timed out rendering is forgotten, so
+    that the next request renders again.
+
+    Attributes
+    ----------
+    timeout : float
+        The maximum number of seconds to wait for a rendering.
+    _pool : multiprocessing.Pool
+        The processes rendering the plots.
+    _cache : dict
+        Maps each key to the (version, png) tuple last rendered.
+    _rendering : dict
+        Maps keys to the (version, AsyncResult) tuple of their current
+        rendering. It is removed once the rendering finished.
+    _lock : threading.Lock
+        Guards _cache and _rendering.
+    """
+    timeout = None
+
+    _pool = None
+    _cache = None
+    _rendering = None
+    _lock = None
+
+    _logger = None
+
+    def __init__(self, num_processes=1, timeout=60.):
+        """
+        Initializes the cache and starts its processes.
+
+        Since the processes are forked, the cache should be created before
+        starting other threads.
+
+        Parameters
+        ----------
+        num_processes : int, optional
+            The number of rendering processes. Default is 1.
+        timeout : float, optional
+            The maximum number of seconds to wait for a rendering. Default
+            is 60.
+
+        Raises
+        ------
+        ValueError
+            Iff num_processes is smaller than 1.
+        """
+        self._logger = logging_utils.get_logger(self)
+        if num_processes < 1:
+            raise ValueError("num_processes must be at least 1, is %s."
+                             %num_processes)
+        self.timeout = timeout
+        self._pool = multiprocessing.Pool(num_processes)
+        self._cache = {}
+        self._rendering = {}
+        self._lock = threading.Lock()
+        self._logger.debug("Started plot cache with %s processes.",
+                           num_processes)
+
+    def get_png(self, key, version, data_function):
+        """
+        Returns the PNG of the plot identified by key, in version if possible.
+
+        If the cached plot has another version, the rendering of version is
+        started and the cached plot returned. Only if no plot is cached, this
+        waits for the rendering.
+
+        Parameters
+        ----------
+        key : hashable
+            Identifies the plot.
+        version : hashable
+            The current version of the plot.
+        data_function : function
+            Called without arguments if the plot has to be rendered. Returns
+            the (to_plot_list, fig_options) tuple for plot_utils.render_png.
+
+        Returns
+        -------
+        png_version : hashable
+            The version of the returned plot.
+        png : string
+            The PNG image.
+
+        Raises
+        ------
+        multiprocessing.TimeoutError
+            Iff no plot was cached and rendering took longer than timeout
+            seconds.
+        Exception
+            Any exception raised by data_function, or by the rendering if no
+            plot was cached.
+        """
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and cached[0] == version:
+                self._logger.debug("Returning cached plot %s.", key)
+                return cached
+            rendering = self._rendering.get(key)
+            if (rendering is not None and rendering[1].ready() and
+                    not rendering[1].successful()):
+                self._logger.warning("Rendering plot %s in version %s "
+                                     "failed.", key, rendering[0])
+                del self._rendering[key]
+                rendering = None
+        if rendering is None or rendering[0] != version:
+            # data_function may take the locks of an assistant, so it is
+            # not called with _lock held.
+            plot_data = data_function()
+            rendering = self._start_rendering(key, version, plot_data)
+        if cached is not None:
+            self._logger.debug("Returning plot %s in version %s while "
+                               "rendering version %s.", key, cached[0],
+                               version)
+            return cached
+        try:
+            png = rendering[1].get(self.timeout)
+        except Exception:
+            self._logger.warning("Rendering plot %s in version %s failed.",
+                                 key, version)
+            with self._lock:
+                if self._rendering.get(key) is rendering:
+                    del self._rendering[key]
+            raise
+        self._store(key, rendering, png)
+        return version, png
+
+    def _start_rendering(self, key, version, plot_data):
+        """
+        Starts rendering plot_data as version of key, unless that rendering
+        has already been started.
+
+        A rendering of another version is replaced; its result is dropped.
+
+        Returns
+        -------
+        rendering : tuple
+            The (version, AsyncResult) tuple of the rendering.
+        """
+        with self._lock:
+            rendering = self._rendering.get(key)
+            if rendering is not None and rendering[0] == version:
+                return rendering
+            self._logger.debug("Rendering plot %s in version %s.", key,
+                               version)
+            started = []
+            # The callback runs in the pool's result thread, and waits for
+            # _lock until started has been filled.
+            result = self._pool.apply_async(
+                render_png, plot_data,
+                callback=lambda png: self._store(key, started[0], png))
+            rendering = (version, result)
+            started.append(rendering)
+            self._rendering[key] = rendering
+        return rendering
+
+    def _store(self, key, rendering, png):
+        """
+        Caches png as the result of rendering, if it is still the current
+        rendering of key.
+        """
+        with self._lock:
+            if self._rendering.get(key) is rendering:
+                del self._rendering[key]
+                self._cache[key] = (rendering[0], png)
+
+    def invalidate(self, key):
+        """
+        Removes the plot identified by key from the cache, and drops its
+        current rendering.
+        """
+        with self._lock:
+            self._cache.pop(key, None)
+            self._rendering.pop(key, None)
+
+    def exit(self):
+        """
+        Stops the rendering processes.
+        """
+        self._logger.debug("Exiting plot cache.")
+        self._pool.terminate()
+        self._pool.join()
@@ -3,7 +3,10 @@ import matplotlib.pyplot as plt
 plt.ioff()
 import random
 import os
+import StringIO
 from matplotlib.colors import colorConverter
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 
 
 def plot_lists(to_plot_list, fig_options=None, ax=None, plot_min=None,
@@ -86,6 +89,39 @@ def plot_lists(to_plot_list, fig_options=None, ax=None, plot_min=None,
         return fig, ax
 
 
+def render_png(to_plot_list, fig_options=None, plot_min=None,
+               plot_max=None):
+    """
+    Plots several functions as plot_lists does and renders them as PNG.
+
+    The figure is drawn on an Agg canvas without pyplot, so this works
+    whatever pyplot's backend is and leaves its state untouched. Since this
+    is a module-level function, it can be run in a multiprocessing.Pool.
+
+    Parameters
+    ----------
+    to_plot_list, fig_options, plot_min, plot_max
+        See plot_lists.
+
+    Returns
+    -------
+    png : string
+        The PNG image.
+    """
+    if fig_options is None:
+        fig_options = {}
+    fig = Figure()
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    _label_axes(ax, fig_options)
+    plot_lists(to_plot_list, fig_options=fig_options, ax=ax,
+               plot_min=plot_min, plot_max=plot_max)
+    fig.autofmt_xdate()
+    png_output = StringIO.StringIO()
+    canvas.print_png(png_output)
+    return png_output.getvalue()
+
+
 def _plot_lists_ax(to_plot_list, ax, plot_min=None, plot_max=None):
     """
     Plots several functions.
@@ -312,10 +348,24 @@ def create_figure(fig_options=None):
     if fig_options is None:
         fig_options = {}
     fig, ax = plt.subplots()
+    _label_axes(ax, fig_options)
+    return fig, ax
+
+
+def _label_axes(ax, fig_options):
+    """
+    Sets the labels and the title of ax as specified in fig_options.
+
+    Parameters
+    ----------
+    ax : matplotlib.Axes
+        The ax to label.
+    fig_options : dict
+        See create_figure.
+    """
     ax.set_xlabel(fig_options.get("x_label", ""))
     ax.set_ylabel(fig_options.get("y_label", ""))
     ax.set_title(fig_options.get("title", ""))
-    return fig, ax
 
 
 def _polish_figure(ax, fig_options=None):
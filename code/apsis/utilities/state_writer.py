@@ -0,0 +1,207 @@
+__author__ = 'Frederik Diehl'
+
+from apsis.utilities import logging_utils
+from apsis.utilities.file_utils import write_json_atomic
+import threading
+import time
+
+AVAILABLE_DURABILITIES = ["fsync", "batched", "periodic"]
+
+
+class StateWriter(object):
+    """
+    Writes the state of several assistants in the background.
+
+    Assistants mark themselves as dirty with a function returning the files
+    to write, instead of writing them during request handling. Every file is
+    replaced atomically (see file_utils.write_json_atomic), and each dirty
+    key is written once per flush, however often it has been marked.
+
+    State functions may take their assistant's lock, and assistants mark
+    themselves while holding it. State functions are therefore never called
+    while holding _write_lock, and a marking thread only ever calls its own
+    state function. A state older than the one already written for its key
+    is discarded.
+
+    The durability decides when the dirty states are written:
+    - "fsync": Immediately, by the marking thread. The state is on disk when
+        mark_dirty returns, as without a StateWriter.
+    - "batched": As soon as possible by the writer thread. Every state
+        marked while a flush runs is coalesced into the next one.
+    - "periodic": Every interval seconds by the writer thread. Up to
+        interval seconds of changes may be lost on a crash.
+    All pending states are written by flush and exit.
+
+    Attributes
+    ----------
+    durability : string
+        One of AVAILABLE_DURABILITIES.
+    interval : float
+        The number of seconds between flushes for "periodic" durability.
+    _dirty : dict
+        Maps each dirty key to its (seq, state function) tuple.
+    _seq : int
+        The sequence number of the last mark.
+    _written : dict
+        Maps keys to the seq of the last state written for them.
+    _lock : threading.Lock
+        Guards _dirty and _seq.
+    _write_lock : threading.Lock
+        Guards _written and ensures only one flush writes at a time, so that
+        an older state never overwrites a newer one.
+    _flush_lock : threading.Lock
+        Serializes flushes of all keys, so that flush only returns once a
+        concurrent flush of the writer thread has been written, too.
+    _wakeup : threading.Event
+        Set to wake the writer thread up.
+    _exited : bool
+        Whether exit has been called.
+    _thread : threading.Thread or None
+        The writer thread. None for "fsync" durability.
+    """
+    durability = None
+    interval = None
+
+    _dirty = None
+    _seq = None
+    _written = None
+    _lock = None
+    _write_lock = None
+    _flush_lock = None
+    _wakeup = None
+    _exited = None
+    _thread = None
+
+    _logger = None
+
+    def __init__(self, durability="batched", interval=1.):
+        """
+        Initializes the writer and starts its thread.
+
+        Parameters
+        ----------
+        durability : string, optional
+            One of AVAILABLE_DURABILITIES, see the class documentation.
+            Default is "batched".
+        interval : float, optional
+            The number of seconds between flushes for "periodic" durability.
+            Default is 1.
+
+        Raises
+        ------
+        ValueError
+            Iff durability is unknown or interval is not positive.
+        """
+        self._logger = logging_utils.get_logger(self)
+        if durability not in AVAILABLE_DURABILITIES:
+            raise ValueError("durability must be in %s, but is %s."
+                             %(AVAILABLE_DURABILITIES, durability))
+        if not interval > 0:
+            raise ValueError("interval must be positive, but is %s."
+                             %interval)
+        self.durability = durability
+        self.interval = interval
+        self._dirty = {}
+        self._seq = 0
+        self._written = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._exited = False
+        if durability != "fsync":
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+        self._logger.debug("Initialized state writer with durability %s, "
+                           "interval %s", durability, interval)
+
+    def mark_dirty(self, key, state_function):
+        """
+        Marks the state identified by key as changed.
+
+        Parameters
+        ----------
+        key : hashable
+            Identifies the state, for example the directory written to. A
+            later mark with the same key replaces an unwritten one.
+        state_function : function
+            Called without arguments when the state is written. Returns a
+            list of (filename, json-serializable object) tuples.
+        """
+        with self._lock:
+            self._seq += 1
+            self._dirty[key] = (self._seq, state_function)
+        if self.durability == "fsync" or self._exited:
+            self._flush([key])
+        elif self.durability == "batched":
+            self._wakeup.set()
+
+    def flush(self):
+        """
+        Writes all dirty states now.
+
+        When this returns, every state marked before has been written.
+        """
+        with self._flush_lock:
+            self._flush(None)
+
+    def _flush(self, keys):
+        """
+        Writes the dirty states of keys, or of all keys if keys is None.
+        """
+        with self._lock:
+            if keys is None:
+                keys = self._dirty.keys()
+            dirty = [(key, ) + self._dirty.pop(key) for key in keys
+                     if key in self._dirty]
+        states = []
+        for key, seq, state_function in dirty:
+            try:
+                states.append((key, seq, state_function()))
+            except Exception:
+                self._logger.exception("Getting the state of %s failed.", key)
+        with self._write_lock:
+            for key, seq, files in states:
+                if seq <= self._written.get(key, 0):
+                    # A newer state has already been written.
+                    continue
+                try:
+                    for filename, obj in files:
+                        write_json_atomic(filename, obj)
+                    self._written[key] = seq
+                except Exception:
+                    self._logger.exception("Writing the state of %s failed.",
+                                           key)
+        if states:
+            self._logger.debug("Wrote %s states.", len(states))
+
+    def exit(self):
+        """
+        Stops the writer thread and writes all dirty states.
+
+        Later marks are written immediately.
+        """
+        self._logger.debug("Exiting state writer.")
+        self._exited = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        """
+        Flushes whenever woken up ("batched") or every interval seconds
+        ("periodic"), until exit is called.
+        """
+        while not self._exited:
+            if self.durability == "periodic":
+                next_flush = time.time() + self.interval
+                while not self._exited and time.time() < next_flush:
+                    self._wakeup.wait(next_flush - time.time())
+                    self._wakeup.clear()
+            else:
+                self._wakeup.wait()
+                self._wakeup.clear()
+            self.flush()
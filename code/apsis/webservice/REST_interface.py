@@ -4,7 +4,8 @@ import matplotlib
 
 matplotlib.use('Agg')
 
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, url_for, \
+    make_response
 from apsis.assistants.lab_assistant import LabAssistant
 from apsis.models.candidate import from_dict
 from functools import wraps
@@ -12,11 +13,13 @@ from apsis.utilities.param_def_utilities import dict_to_param_defs
 import sys
 import signal
 import time
-import urllib
-import StringIO
-from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from apsis.utilities import file_utils
 from apsis.utilities import logging_utils
+from apsis.utilities.plot_cache import PlotCache
+import tornado
+from tornado import escape, httputil
 from tornado.wsgi import WSGIContainer
 from tornado.httpserver import HTTPServer
 from tornado.ioloop import IOLoop
@@ -31,9 +34,17 @@ exited = False
 http_server = None
 
 lAss = None
+request_executor = None
+plot_cache = None
 
 should_fail_deadly = False
 
+# The maximum number of seconds a request may wait for the next candidate.
+MAX_CANDIDATE_TIMEOUT = 30
+
+# The maximum number of candidates handed out by a single request.
+MAX_CANDIDATES_PER_REQUEST = 1000
+
 
 def set_exit(_signo, _stack_frame):
     """
@@ -42,8 +53,10 @@ def set_exit(_signo, _stack_frame):
     _logger.warning("Shutting down apsis server, due to signal %s with "
                     "stackframe %s" % (_signo, _stack_frame))
     IOLoop.instance().stop()
-    lAss.set_exit()
     http_server.stop()
+    request_executor.shutdown()
+    plot_cache.exit()
+    lAss.set_exit()
     global exited
     exited = True
     sys.exit()
@@ -52,13 +65,111 @@ def set_exit(_signo, _stack_frame):
 signal.signal(signal.SIGINT, set_exit)
 
 
-def start_apsis(save_path, port=5000, fail_deadly=False):
+class ThreadedWSGIContainer(WSGIContainer):
+    """
+    A WSGIContainer running the WSGI application on a thread pool.
+
+    Tornado's WSGIContainer calls the application on the IOLoop thread, so
+    that a single slow request (for example one waiting for a candidate, or
+    updating an optimizer) blocks all others. Here, only reading the request
+    and writing the response happen on the IOLoop thread.
+
+    Attributes
+    ----------
+    executor : concurrent.futures.Executor
+        The executor the application is called on.
+    """
+    executor = None
+
+    def __init__(self, wsgi_application, executor):
+        super(ThreadedWSGIContainer, self).__init__(wsgi_application)
+        self.executor = executor
+
+    def __call__(self, request):
+        io_loop = IOLoop.current()
+        environ = WSGIContainer.environ(request)
+        self.executor.submit(self._handle, io_loop, request, environ)
+
+    def _handle(self, io_loop, request, environ):
+        """
+        Calls the application on a worker thread and schedules writing its
+        response on io_loop.
+        """
+        try:
+            status_code, reason, headers, body = self._call_application(
+                environ)
+        except Exception:
+            _logger.exception("WSGI application failed for %s.", request.uri)
+            status_code, reason, headers, body = \
+                500, "Internal Server Error", [], b""
+        io_loop.add_callback(self._write_response, request, status_code,
+                             reason, headers, body)
+
+    def _call_application(self, environ):
+        """
+        Calls the application with environ.
+
+        Returns
+        -------
+        status_code, reason, headers, body
+            The response's status code, reason phrase, list of headers and
+            body.
+        """
+        data = {}
+        response = []
+
+        def start_response(status, response_headers, exc_info=None):
+            data["status"] = status
+            data["headers"] = response_headers
+            return response.append
+        app_response = self.wsgi_application(environ, start_response)
+        try:
+            response.extend(app_response)
+            body = b"".join(response)
+        finally:
+            if hasattr(app_response, "close"):
+                app_response.close()
+        if not data:
+            raise Exception("WSGI app did not call start_response")
+        status_code, reason = data["status"].split(' ', 1)
+        return int(status_code), reason, data["headers"], escape.utf8(body)
+
+    def _write_response(self, request, status_code, reason, headers, body):
+        """
+        Writes a response on the IOLoop thread, as WSGIContainer does.
+        """
+        header_set = set(k.lower() for (k, v) in headers)
+        if status_code != 304:
+            if "content-length" not in header_set:
+                headers.append(("Content-Length", str(len(body))))
+            if "content-type" not in header_set:
+                headers.append(("Content-Type", "text/html; charset=UTF-8"))
+        if "server" not in header_set:
+            headers.append(("Server", "TornadoServer/%s" % tornado.version))
+
+        start_line = httputil.ResponseStartLine("HTTP/1.1", status_code,
+                                                reason)
+        header_obj = httputil.HTTPHeaders()
+        for key, value in headers:
+            header_obj.add(key, value)
+        request.connection.write_headers(start_line, header_obj, chunk=body)
+        request.connection.finish()
+        self._log(status_code, request)
+
+
+def start_apsis(save_path, port=5000, fail_deadly=False,
+                num_request_threads=8, hibernate_after=None,
+                num_plot_processes=1):
     """
     Starts apsis.
 
-    Initializes logger, LabAssistant and the REST app.
+    Initializes logger, LabAssistant and the REST app. Requests are handled
+    by num_request_threads threads, so that requests for different
+    experiments do not wait for each other. Experiments not accessed for
+    hibernate_after seconds are hibernated (see LabAssistant). Plots are
+    rendered by num_plot_processes processes.
     """
-    global lAss, _logger
+    global lAss, _logger, request_executor, plot_cache
     file_utils.ensure_directory_exists(save_path)
     _logger = logging_utils.get_logger("webservice.REST_interface",
                                        save_path=save_path)
@@ -77,9 +188,13 @@ def start_apsis(save_path, port=5000, fail_deadly=False):
     should_fail_deadly = fail_deadly
     exited = False
 
-    lAss = LabAssistant(write_dir=write_dir)
+    # Forks the rendering processes before any other thread is started.
+    plot_cache = PlotCache(num_plot_processes)
+    lAss = LabAssistant(write_dir=write_dir, hibernate_after=hibernate_after,
+                        on_hibernate=plot_cache.invalidate)
 
-    http_server = HTTPServer(WSGIContainer(app))
+    request_executor = ThreadPoolExecutor(num_request_threads)
+    http_server = HTTPServer(ThreadedWSGIContainer(app, request_executor))
     http_server.listen(port)
     _logger.info("Finished initialization. Starting tornado..")
     IOLoop.instance().start()
@@ -156,6 +271,10 @@ def client_init_experiment():
     "minimization": bool, optional
         Whether the problem is one of minimization or maximization. Default
         is minimization.
+    "source_exp_ids": list of strings, optional
+        The ids of related experiments whose finished candidates are used to
+        warm start the optimizer. Only the BayesianOptimizer uses them;
+        other optimizers ignore them. Default is no warm start.
     }
     """
     _logger.debug("Initializing experiment. Request is %s, json %s", request,
@@ -175,10 +294,11 @@ def client_init_experiment():
     minimization = data_received.get("minimization", True)
     param_defs = data_received.get("param_defs", None)
     param_defs = dict_to_param_defs(param_defs)
+    source_exp_ids = data_received.get("source_exp_ids", None)
     _logger.debug("Initializing experiment.")
     exp_id = lAss.init_experiment(name, optimizer, param_defs,
                                   exp_id, notes, optimizer_arguments,
-                                  minimization)
+                                  minimization, source_exp_ids=source_exp_ids)
     _logger.info("Initialized new experiment of name %s. exp_id is %s",
                  name, exp_id)
     return exp_id
@@ -220,12 +340,10 @@ def get_experiment(experiment_id):
     pending_candidates_string = exp_dict["candidates_pending"]
     working_candidates_string = exp_dict["candidates_working"]
     best_candidate_string = exp_dict["best_candidate"]
-    fig = lAss.get_plot_result_per_step(experiment_id)
-    fig.autofmt_xdate()
-    canvas = FigureCanvas(fig)
-    png_output = StringIO.StringIO()
-    canvas.print_png(png_output)
-    png_output = png_output.getvalue().encode("base64")
+    # The version only changes the URL, so that browsers reload the plot.
+    result_per_step_url = url_for("get_result_per_step_plot",
+                                  experiment_id=experiment_id,
+                                  v=exp_dict["last_update_time"])
 
     _logger.debug("Rendering template")
     templ = render_template("experiment.html",
@@ -237,13 +355,39 @@ def get_experiment(experiment_id):
                            finished_candidates_string=finished_candidates_string,
                            pending_candidates_string=pending_candidates_string,
                            working_candidates_string=working_candidates_string,
-                           result_per_step=urllib.quote(png_output.rstrip('\n')),
+                           result_per_step_url=result_per_step_url,
                            best_candidate_string=best_candidate_string
                            )
     _logger.log(5, "Returning template %s", templ)
     return templ
 
 
+@app.route(CONTEXT_ROOT + "/experiments/<experiment_id>/result_per_step.png",
+           methods=["GET"])
+def get_result_per_step_plot(experiment_id):
+    """
+    Returns the PNG plot of the experiment's results over the steps.
+
+    The plot is cached until the experiment changes. Its ETag is the
+    experiment's last_update_time, so that browsers only download it again
+    after changes. While the plot of a changed experiment is being
+    rendered, the previous plot is returned with its own ETag.
+    """
+    _logger.debug("Asked for the result plot of %s.", experiment_id)
+    etag = repr(lAss.get_last_update_time(experiment_id))
+    if request.if_none_match.contains(etag):
+        response = make_response("", 304)
+    else:
+        etag, png = plot_cache.get_png(
+            experiment_id, etag,
+            lambda: lAss.get_plot_result_per_step_data(experiment_id))
+        response = make_response(png)
+        response.headers["Content-Type"] = "image/png"
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
 @app.route(CONTEXT_ROOT + "/c/experiments/<experiment_id>"
                           "/get_next_candidate", methods=["GET"])
 @exception_handler
@@ -257,14 +401,22 @@ def client_get_next_candidate(experiment_id):
         The exp_id of the experiment for which the candidate should be
         returned.
 
+    The optional query argument timeout sets the number of seconds to wait
+    for a candidate if none is ready, at most MAX_CANDIDATE_TIMEOUT. By
+    default, the request does not wait.
+
     Returns
     -------
     result : Candidate, None or "failed".
         Returns either a Candidate (if successful), None if none is available
         or possibly "failed" if the request failed.
     """
-    _logger.debug("Should return next candidate for %s", experiment_id)
-    result_cand = lAss.get_next_candidate(experiment_id)
+    timeout = request.args.get("timeout", None, type=float)
+    if timeout is not None:
+        timeout = min(timeout, MAX_CANDIDATE_TIMEOUT)
+    _logger.debug("Should return next candidate for %s, timeout %s",
+                  experiment_id, timeout)
+    result_cand = lAss.get_next_candidate(experiment_id, timeout=timeout)
     if result_cand is None:
         _logger.debug("No next candidate available. Failing.")
         result = "failed"
@@ -274,6 +426,48 @@ def client_get_next_candidate(experiment_id):
     return result
 
 
+@app.route(CONTEXT_ROOT + "/c/experiments/<experiment_id>"
+                          "/get_next_candidates", methods=["GET"])
+@exception_handler
+def client_get_next_candidates(experiment_id):
+    """
+    Returns several next candidates for a specific experiment.
+
+    Parameters
+    ----------
+    experiment_id : string
+        The exp_id of the experiment for which the candidates should be
+        returned.
+
+    The query argument num sets the maximum number of candidates, at most
+    MAX_CANDIDATES_PER_REQUEST. Default is 1. The optional query argument
+    timeout works as for get_next_candidate.
+
+    Returns
+    -------
+    result : list of Candidates or "failed".
+        Returns either a non-empty list of Candidates (if successful) or
+        "failed" if none is available or the request failed.
+    """
+    num_candidates = request.args.get("num", 1, type=int)
+    num_candidates = max(1, min(num_candidates, MAX_CANDIDATES_PER_REQUEST))
+    timeout = request.args.get("timeout", None, type=float)
+    if timeout is not None:
+        timeout = min(timeout, MAX_CANDIDATE_TIMEOUT)
+    _logger.debug("Should return %s next candidates for %s, timeout %s",
+                  num_candidates, experiment_id, timeout)
+    result_cands = lAss.get_next_candidates(experiment_id,
+                                            num_candidates=num_candidates,
+                                            timeout=timeout)
+    if not result_cands:
+        _logger.debug("No next candidate available. Failing.")
+        result = "failed"
+    else:
+        result = [c.to_dict() for c in result_cands]
+    _logger.debug("Returning next cands %s", result)
+    return result
+
+
 @app.route(CONTEXT_ROOT + "/c/experiments/<experiment_id>"
                           "/get_best_candidate", methods=["GET"])
 @exception_handler
@@ -341,30 +535,138 @@ def client_update(experiment_id):
             "result" : float
                 The result of the process we want to optimize.
                 Is None by default
+            "intermediate_results" : list of [step, result] lists
+                The intermediate results reported so far. Workers do not
+                have to send the complete series, since it is kept by apsis.
+            "budget" : float or None
+                The budget to evaluate the candidate with, if assigned by the
+                optimizer (for example by Hyperband). Must not be changed.
+            "lease_token" : string or None
+                The token of the candidate's lease, if the experiment uses
+                leases. Must not be changed. Updates with a token whose lease
+                has expired are ignored, and "working" updates with it ask
+                the worker to stop.
         "status" : string
             One of "finished", "working" and "pausing".
             "finished": The evaluation is finished.
-            "working": The evaluation is still in progress. Later, it will be
-            used to ensure that the worker is still working, allowing us to
-            reschedule the candidate to other workers if necessary.
+            "working": The evaluation is still in progress. This renews the
+            candidate's lease if the experiment uses leases (see the
+            "lease_duration" optimizer argument); candidates without updates
+            for longer are rescheduled to other workers.
+            If the candidate's result is set, it is appended to the
+            candidate's intermediate results.
             "pausing": Signals that this candidate has paused the execution,
             meaning that we are allowed to reschedule it to another worker.
+            If the candidate's result is set, it is recorded as the
+            intermediate result at the candidate's budget.
+        "step" : int or float, optional
+            The step (for example the epoch) of the intermediate result
+            reported with a "working" update. By default, the step following
+            the last reported one.
 
     Returns
     -------
     result : string
-        Returns "success" iff successful, "failed" otherwise.
+        Returns "success" iff successful, "failed" otherwise. Returns "stop"
+        if the update was successful, but the early stopping rule of the
+        experiment decided that the worker should stop evaluating the
+        candidate.
     """
     _logger.debug("Updating client. request is %s, json %s", request,
                   request.json)
     data_received = request.get_json()
     status = data_received["status"]
+    step = data_received.get("step", None)
     candidate = from_dict(data_received["candidate"])
-    lAss.update(experiment_id, status=status, candidate=candidate)
+    stop = lAss.update(experiment_id, status=status, candidate=candidate,
+                       step=step)
     _logger.debug("Updated lAss.")
+    if stop:
+        _logger.debug("Signalling the worker to stop.")
+        return "stop"
     return "success"
 
 
+@app.route(CONTEXT_ROOT + "/c/experiments/<experiment_id>/update_many",
+           methods=["POST"])
+@exception_handler
+def client_update_many(experiment_id):
+    """
+    Applies several updates at once.
+
+    All transitions are applied before the optimizer is updated and the
+    state is written, both only once.
+
+    Parameters
+    ----------
+    exp_id : string
+        The id of the experiment to update.
+    json : json dict
+        Contains one element.
+        "updates" : list of dicts
+            Each has the fields "candidate", "status" and, optionally,
+            "step", with the format described in update.
+
+    Returns
+    -------
+    result : list of strings or "failed"
+        One entry per update, "success" or "stop" as returned by update.
+        "failed" if the request failed, in which case no update has been
+        applied unless the failure happened while applying them.
+    """
+    _logger.debug("Updating client with many updates. request is %s",
+                  request)
+    data_received = request.get_json()
+    updates = []
+    for u in data_received["updates"]:
+        updates.append((from_dict(u["candidate"]), u["status"],
+                        u.get("step", None)))
+    stops = lAss.update_many(experiment_id, updates)
+    _logger.debug("Applied %s updates.", len(updates))
+    return ["stop" if stop else "success" for stop in stops]
+
+
+@app.route(CONTEXT_ROOT + "/c/experiments/<experiment_id>/result_series",
+           methods=["GET"])
+@exception_handler
+def client_get_result_series(experiment_id):
+    """
+    Returns the result of each finished candidate and the best result after
+    each of them.
+
+    Parameters
+    ----------
+    exp_id : string
+        The id of the experiment.
+
+    Returns
+    -------
+    series : dict
+        A dict with two lists of equal length:
+        "step_results" : The results in the order the candidates finished.
+            None for failed candidates.
+        "step_best" : The best result after each step, None while there is
+            none.
+    """
+    _logger.debug("Returning result series for %s", experiment_id)
+    step_results, step_best, num_steps = lAss.get_result_series(
+        experiment_id)
+    return {"step_results": _series_to_list(step_results[:num_steps]),
+            "step_best": _series_to_list(step_best[:num_steps])}
+
+
+def _series_to_list(series):
+    """
+    Converts an array.array of doubles to a list, with None for NaN.
+
+    NaN is not valid json. The conversion is vectorized with numpy.
+    """
+    values = np.frombuffer(series, dtype=np.float64)
+    converted = values.astype(object)
+    converted[np.isnan(values)] = None
+    return converted.tolist()
+
+
 @app.route(CONTEXT_ROOT + "/c/experiments/<experiment_id>/candidates",
            methods=["GET"])
 @exception_handler
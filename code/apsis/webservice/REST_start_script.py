@@ -9,12 +9,15 @@ import REST_interface
 import argparse
 
 
-def start_rest(save_path, port=5000, fail_deadly=False):
+def start_rest(save_path, port=5000, fail_deadly=False,
+               num_request_threads=8, hibernate_after=None):
     print("Initialized apsis on port %s" %port)
     print("Save_path is set to %s" %save_path)
     print("Fail_deadly is %s" %fail_deadly)
     REST_interface.start_apsis(save_path, port,
-                               fail_deadly=fail_deadly)
+                               fail_deadly=fail_deadly,
+                               num_request_threads=num_request_threads,
+                               hibernate_after=hibernate_after)
 
 
 if __name__ == "__main__":
@@ -26,6 +29,11 @@ if __name__ == "__main__":
                                               "instead of catching them. "
                                               "Warning! Dangerous. Do not use "
                                               "unless you know what you do.")
+    parser.add_argument("--request_threads", type=int, default=8,
+                        help="Set the number of threads handling requests.")
+    parser.add_argument("--hibernate_after", type=float, default=None,
+                        help="Hibernate experiments not accessed for this "
+                             "many seconds.")
     args = parser.parse_args()
     print(args)
     port = 5000
@@ -38,4 +46,5 @@ if __name__ == "__main__":
     save_path = args.save_path
     if args.fail_deadly:
         fail_deadly = True
-    start_rest(save_path, port, fail_deadly)
+    start_rest(save_path, port, fail_deadly, args.request_threads,
+               args.hibernate_after)
@@ -2,6 +2,7 @@ __author__ = 'Frederik Diehl'
 
 import requests
 import time
+import threading
 
 
 class Connection(object):
@@ -37,9 +38,15 @@ class Connection(object):
         The minimum time in seconds between repeat attempts to retry a failed
         request. The real time may be slightly longer.
         Default is 0.1s
+
+    wait_margin : float
+        The time in seconds by which the wait_time sent to the server stays
+        below the request's timeout, so that the server answers before the
+        request times out. Default is 1s.
     """
     server_address = None
     repeat_time = None
+    wait_margin = 1.
 
     def __init__(self, server_address, repeat_time=1):
         """
@@ -67,7 +74,8 @@ class Connection(object):
         the "result" field of the returned json is None or "failed", both of
         which indicate a non-successful request, the connection is reattempted.
         Otherwise, or if the connection was successful, the json "result" field
-        is returned.
+        is returned. Requests which time out or cannot connect are treated as
+        returning "failed".
 
         Parameters
         ----------
@@ -90,20 +98,52 @@ class Connection(object):
              Default is None.
         """
         start_time = time.time()
+        request_timeout = timeout
+        if timeout is not None and timeout <= 0:
+            request_timeout = None
         while timeout is None or timeout <= 0 or time.time()-start_time < timeout:
-            if json is None:
-                r = request(url=url, timeout=timeout)
-            else:
-                r = request(url=url, json=json, timeout=timeout)
+            try:
+                if json is None:
+                    r = request(url=url, timeout=request_timeout)
+                else:
+                    r = request(url=url, json=json, timeout=request_timeout)
+                result = r.json()["result"]
+            except (requests.exceptions.Timeout,
+                    requests.exceptions.ConnectionError):
+                result = "failed"
             if blocking:
-                if r.json()["result"] is None or r.json()["result"] == "failed":
+                if result is None or result == "failed":
                     time.sleep(self.repeat_time)
                     continue
-            return r.json()["result"]
+            return result
+
+    def _cap_wait_time(self, wait_time, timeout):
+        """
+        Returns wait_time capped to stay wait_margin below timeout.
+
+        Parameters
+        ----------
+        wait_time : float or None
+            The requested time the server should wait for a candidate.
+        timeout : float or None
+            The timeout of the request. If it is <= 0 or None, wait_time is
+            not capped.
+
+        Returns
+        -------
+        wait_time : float or None
+            The capped wait_time, or None if no waiting is possible.
+        """
+        if wait_time is None or timeout is None or timeout <= 0:
+            return wait_time
+        wait_time = min(wait_time, timeout - self.wait_margin)
+        if wait_time <= 0:
+            return None
+        return wait_time
 
     def init_experiment(self, name, optimizer, param_defs, optimizer_arguments=None,
                         exp_id=None, notes=None, minimization=True, blocking=False,
-                        timeout=None):
+                        timeout=None, source_exp_ids=None):
         """
         Initializes an experiment on the apsis server.
 
@@ -147,6 +187,12 @@ class Connection(object):
             The maximum time to retry the connection. If it is <= 0 or None,
             this is interpreted as a an infinitely long wait.
              Default is None.
+        source_exp_ids : list of strings, optional
+            The ids of related experiments on the server whose finished
+            candidates are used to warm start the optimizer. They must have
+            the same parameter names and optimization direction. Only the
+            BayesianOptimizer uses them; other optimizers ignore them.
+            Default is None, which means no warm start.
 
         Returns
         -------
@@ -160,7 +206,8 @@ class Connection(object):
             "optimizer": optimizer,
             "param_defs": param_defs,
             "optimizer_arguments": optimizer_arguments,
-            "minimization": minimization
+            "minimization": minimization,
+            "source_exp_ids": source_exp_ids
         }
         url = self.server_address + "/c/experiments"
         success = self._request(requests.post, url=url, json=msg,
@@ -192,7 +239,8 @@ class Connection(object):
         url = self.server_address + "/c/experiments"
         return self._request(requests.get, url, blocking=blocking, timeout=timeout)
 
-    def get_next_candidate(self, exp_id, blocking=True, timeout=None):
+    def get_next_candidate(self, exp_id, blocking=True, timeout=None,
+                           wait_time=None):
         """
         Returns the next candidate of an experiment.
 
@@ -209,6 +257,13 @@ class Connection(object):
             The maximum time to retry the connection. If it is <= 0 or None, this
             is interpreted as a an infinitely long wait.
              Default is None.
+        wait_time : float, optional
+            The maximum time the server should wait for a candidate if none
+            is ready, instead of failing right away. The server returns as
+            soon as a candidate is produced, and caps wait_time. It is
+            limited to wait_margin below timeout, so that the request does
+            not time out while the server waits. Default is None, which means
+            no waiting.
 
         Returns
         -------
@@ -240,9 +295,54 @@ class Connection(object):
             timeout > 0, which represents a failed request.
         """
         url = self.server_address + "/c/experiments/%s/get_next_candidate" %exp_id
+        wait_time = self._cap_wait_time(wait_time, timeout)
+        if wait_time is not None and wait_time > 0:
+            url += "?timeout=%s" %wait_time
         return self._request(requests.get, url=url, blocking=blocking, timeout=timeout)
 
-    def update(self, exp_id, candidate, status="finished", blocking=True, timeout=None):
+    def get_next_candidates(self, exp_id, num_candidates=1, blocking=True,
+                            timeout=None, wait_time=None):
+        """
+        Returns up to num_candidates next candidates of an experiment.
+
+        All candidates are leased in a single request.
+
+        Parameters
+        ----------
+        exp_id : string
+            The id of the experiment to return.
+        num_candidates : int, optional
+            The maximum number of candidates to return. The server may cap
+            it. Default is 1.
+        blocking : bool, optional
+            If True, retries the query until it receives at least one
+            candidate, at most timeout seconds.
+            If False, tries the query only once.
+            Default is True.
+        timeout : float, optional
+            The maximum time to retry the connection. If it is <= 0 or None, this
+            is interpreted as a an infinitely long wait.
+             Default is None.
+        wait_time : float, optional
+            As for get_next_candidate.
+
+        Returns
+        -------
+        next_candidates : list of dicts representing candidates.
+            Each has the format described in get_next_candidate.
+            May also return "failed" or None if blocking is false and
+            timeout > 0, which represents a failed request.
+        """
+        url = (self.server_address +
+               "/c/experiments/%s/get_next_candidates?num=%s"
+               %(exp_id, num_candidates))
+        wait_time = self._cap_wait_time(wait_time, timeout)
+        if wait_time is not None and wait_time > 0:
+            url += "&timeout=%s" %wait_time
+        return self._request(requests.get, url=url, blocking=blocking, timeout=timeout)
+
+    def update(self, exp_id, candidate, status="finished", blocking=True,
+               timeout=None, step=None):
         """
         Updates the result of the candidate.
 
@@ -275,14 +375,29 @@ class Connection(object):
             "result" : float
                 The result of the process we want to optimize.
                 Is None by default
+            "intermediate_results" : list of [step, result] lists
+                The intermediate results reported so far.
+            "budget" : float or None
+                The budget to evaluate the candidate with, if assigned by the
+                optimizer (for example by Hyperband). Must not be changed.
+            "lease_token" : string or None
+                The token of the candidate's lease, if the experiment uses
+                leases. Must not be changed. Updates with a token whose lease
+                has expired are ignored, and "working" updates with it ask
+                the worker to stop.
         status : string
             One of "finished", "working" and "pausing".
             "finished": The evaluation is finished.
-            "working": The evaluation is still in progress. Later, it will be
-            used to ensure that the worker is still working, allowing us to
-            reschedule the candidate to other workers if necessary.
+            "working": The evaluation is still in progress. This renews the
+            candidate's lease if the experiment uses leases (see the
+            "lease_duration" optimizer argument); candidates without updates
+            for longer are rescheduled to other workers.
+            If the candidate's result is set, it is recorded as an
+            intermediate result.
             "pausing": Signals that this candidate has paused the execution,
             meaning that we are allowed to reschedule it to another worker.
+            If the candidate's result is set, it is recorded as the
+            intermediate result at the candidate's budget.
         blocking : bool, optional
             If True, retries the query until it receives an acceptable answer, at
             most timeout seconds.
@@ -292,16 +407,67 @@ class Connection(object):
             The maximum time to retry the connection. If it is <= 0 or None, this
             is interpreted as a an infinitely long wait.
              Default is None.
+        step : int or float, optional
+            The step (for example the epoch) of the intermediate result
+            reported with a "working" update. By default, the step following
+            the last reported one.
 
         Returns
         -------
         result : string
-            Returns "success" iff successful, "failed" otherwise.
+            Returns "success" iff successful, "failed" otherwise. Returns
+            "stop" if the worker should stop evaluating the candidate, since
+            the experiment's early stopping rule deems it unpromising.
         """
         url = self.server_address + "/c/experiments/%s/update" %exp_id
         msg = {
             "status": status,
-            "candidate": candidate
+            "candidate": candidate,
+            "step": step
+        }
+        return self._request(requests.post, url, json=msg, blocking=blocking,
+                            timeout=timeout)
+
+    def update_many(self, exp_id, updates, blocking=True, timeout=None):
+        """
+        Sends several updates in a single request.
+
+        The server applies all of them, then updates the optimizer and
+        writes its state once.
+
+        Parameters
+        ----------
+        exp_id : string
+            The id of the experiment to update.
+        updates : list of tuples
+            (candidate, status) or (candidate, status, step) tuples, with the
+            format described in update.
+        blocking : bool, optional
+            If True, retries the query until it receives an acceptable answer, at
+            most timeout seconds.
+            If False, tries the query only once.
+            Default is True.
+        timeout : float, optional
+            The maximum time to retry the connection. If it is <= 0 or None, this
+            is interpreted as a an infinitely long wait.
+             Default is None.
+
+        Returns
+        -------
+        result : list of strings or "failed"
+            One entry per update, "success" or "stop" (see update), or
+            "failed" if the request failed.
+        """
+        url = self.server_address + "/c/experiments/%s/update_many" %exp_id
+        msg_updates = []
+        for u in updates:
+            msg_updates.append({
+                "candidate": u[0],
+                "status": u[1],
+                "step": u[2] if len(u) > 2 else None
+            })
+        msg = {
+            "updates": msg_updates
         }
         return self._request(requests.post, url, json=msg, blocking=blocking,
                             timeout=timeout)
@@ -335,6 +501,36 @@ class Connection(object):
         url = self.server_address + "/c/experiments/%s/get_best_candidate" %exp_id
         return self._request(requests.get, url, blocking=blocking, timeout=timeout)
 
+    def get_result_series(self, exp_id, blocking=True, timeout=None):
+        """
+        Returns the result of each finished candidate and the best result
+        after each of them, for example to monitor convergence.
+
+        Parameters
+        ----------
+        exp_id : string
+            The id of the experiment.
+        blocking : bool, optional
+            If True, retries the query until it receives an acceptable answer, at
+            most timeout seconds.
+            If False, tries the query only once.
+            Default is True.
+        timeout : float, optional
+            The maximum time to retry the connection. If it is <= 0 or None, this
+            is interpreted as a an infinitely long wait.
+             Default is None.
+
+        Returns
+        -------
+        series : dict
+            A dict with two lists of equal length: "step_results", the
+            results in the order the candidates finished (None for failed
+            ones), and "step_best", the best result after each step (None
+            while there is none).
+        """
+        url = self.server_address + "/c/experiments/%s/result_series" %exp_id
+        return self._request(requests.get, url, blocking=blocking, timeout=timeout)
+
     def get_all_candidates(self, exp_id, blocking=True, timeout=None):
         """
         Returns the candidates for an experiment.
@@ -370,4 +566,133 @@ class Connection(object):
             "Failed".
         """
         url = self.server_address + "/c/experiments/%s/candidates" %exp_id
-        return self._request(requests.get, url, blocking=blocking, timeout=timeout)
\ No newline at end of file
+        return self._request(requests.get, url, blocking=blocking, timeout=timeout)
+
+
+class BufferedReporter(object):
+    """
+    Collects updates and sends them with Connection.update_many.
+
+    The buffer is flushed once it contains max_size updates, or when its
+    oldest update is max_delay seconds old, whichever comes first. Since the
+    updates are sent later, stop decisions of the early stopping rule are not
+    returned; use Connection.update for working updates which need them.
+    Call close() when finished to send the remaining updates. Flushes are
+    sent one at a time, so updates arrive in the order they were reported.
+
+    Attributes
+    ----------
+    connection : Connection
+        The connection used to send the updates.
+    exp_id : string
+        The id of the experiment to update.
+    max_size : int
+        The number of buffered updates which triggers a flush.
+    max_delay : float or None
+        The maximum number of seconds an update is buffered. If None, the
+        buffer is only flushed by size, flush() and close().
+    """
+    connection = None
+    exp_id = None
+    max_size = None
+    max_delay = None
+
+    _buffer = None
+    _first_time = None
+    _lock = None
+    _send_lock = None
+    _closed = None
+    _wakeup = None
+    _thread = None
+
+    def __init__(self, connection, exp_id, max_size=32, max_delay=5):
+        """
+        Initializes the reporter.
+
+        Parameters
+        ----------
+        connection : Connection
+            The connection used to send the updates.
+        exp_id : string
+            The id of the experiment to update.
+        max_size : int, optional
+            The number of buffered updates which triggers a flush. Default
+            is 32.
+        max_delay : float or None, optional
+            The maximum number of seconds an update is buffered. Default is 5.
+        """
+        self.connection = connection
+        self.exp_id = exp_id
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._closed = False
+        self._wakeup = threading.Event()
+        if max_delay is not None:
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def report(self, candidate, status="finished", step=None):
+        """
+        Buffers an update, flushing if the buffer is full.
+
+        Parameters are as for Connection.update.
+        """
+        with self._lock:
+            if not self._buffer:
+                self._first_time = time.time()
+            self._buffer.append((candidate, status, step))
+            full = len(self._buffer) >= self.max_size
+        if full:
+            self.flush()
+        else:
+            self._wakeup.set()
+
+    def flush(self):
+        """
+        Sends all buffered updates.
+
+        Returns
+        -------
+        result : list of strings, "failed" or None
+            The result of Connection.update_many, or None if the buffer was
+            empty.
+        """
+        # Held while sending, so that a later flush cannot overtake this
+        # one.
+        with self._send_lock:
+            with self._lock:
+                updates = self._buffer
+                self._buffer = []
+            if not updates:
+                return None
+            return self.connection.update_many(self.exp_id, updates)
+
+    def close(self):
+        """
+        Sends the remaining updates and stops the flushing thread.
+        """
+        self._closed = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def _run(self):
+        """
+        Flushes the buffer whenever its oldest update is max_delay old.
+        """
+        while not self._closed:
+            with self._lock:
+                if self._buffer:
+                    wait = self._first_time + self.max_delay - time.time()
+                else:
+                    wait = None
+            if wait is not None and wait <= 0:
+                self.flush()
+                continue
+            self._wakeup.wait(wait)
+            self._wakeup.clear()